@@ -0,0 +1,167 @@
+# anchor_indexer.py
+# Local index of CreditAnchor `Anchored(blockId, root, caller)` logs, so "is this root anchored?"
+# is a Mongo lookup instead of a live roots() call.
+#
+#   python anchor_indexer.py                      # scan from the last indexed height up to head - confirmations
+#   python anchor_indexer.py --follow --interval 15
+#   python anchor_indexer.py --from-block 5400000 # first run: start at the contract's deploy block
+#
+# Logs are fetched with eth_getLogs over --chunk block ranges (halved automatically when the provider
+# rejects a range as too large). Each log is upserted into db.anchor_events under
+# _id "<contract>:<blockId>" (the contract allows one anchor per blockId), then the scanned height is
+# saved in db.anchor_index_state with that block's hash, so a restart resumes where it stopped and
+# re-scans are harmless.
+#
+# Reorgs: the scan stays --confirmations blocks behind head. A log delivered with "removed": true drops
+# the indexed event it had produced (same id and block hash). On resume, if the saved height's block hash
+# no longer matches the chain, the indexer rewinds ANCHOR_INDEX_REORG_REWIND blocks, drops what it had
+# indexed there and scans again.
+# Works against any JSON-RPC endpoint: Sepolia, or a local dev chain (anvil / hardhat node); the
+# in-process DevChain in tester_anchor_indexer.py stands in for one in tests.
+#
+# env: WEB3_RPC_URL (or --rpc), ANCHOR_CONTRACT_ADDRESS (or --contract), MONGODB_URI, DB_NAME
+#      ANCHOR_DEPLOY_BLOCK=0            first block scanned when there is no saved state
+#      ANCHOR_INDEX_CONFIRMATIONS=6     stay this many blocks behind head (reorg safety)
+#      ANCHOR_INDEX_REORG_REWIND=64     blocks re-scanned when the saved height was reorged away
+
+import os, time, argparse
+from datetime import datetime
+
+DEPLOY_BLOCK  = int(os.getenv("ANCHOR_DEPLOY_BLOCK", "0"))
+CONFIRMATIONS = int(os.getenv("ANCHOR_INDEX_CONFIRMATIONS", "6"))
+REORG_REWIND  = int(os.getenv("ANCHOR_INDEX_REORG_REWIND", "64"))
+CHUNK = 2000
+
+EVENTS = "anchor_events"
+STATE  = "anchor_index_state"
+INDEXES = [
+    (EVENTS, "root", {}),                 # "is this root anchored?"
+    (EVENTS, "block_number", {}),
+]
+
+def topic0() -> str:
+    from web3 import Web3
+    return "0x" + Web3.keccak(text="Anchored(uint256,bytes32,address)").hex().removeprefix("0x")
+
+def event_id(contract: str, onchain_block_id) -> str:
+    return f"{contract.lower()}:{int(onchain_block_id)}"
+
+def decode_log(log: dict) -> dict:
+    t = log["topics"]
+    contract = log["address"].lower()
+    onchain_block_id = int(t[1], 16)
+    return {
+        "_id": event_id(contract, onchain_block_id),
+        "contract": contract,
+        "onchain_block_id": str(onchain_block_id),
+        "root": t[2].lower().removeprefix("0x"),
+        "caller": "0x" + t[3][-40:].lower(),
+        "tx_hash": log["transactionHash"].lower(),
+        "log_index": int(log["logIndex"], 16),
+        "block_number": int(log["blockNumber"], 16),
+        "block_hash": log["blockHash"].lower(),
+    }
+
+def get_logs(rpc, contract: str, lo: int, hi: int, topic: str) -> list:
+    return rpc.call("eth_getLogs", [{"address": contract, "topics": [topic],
+                                     "fromBlock": hex(lo), "toBlock": hex(hi)}])
+
+def block_hash(rpc, n: int):
+    b = rpc.call("eth_getBlockByNumber", [hex(n), False])
+    return b["hash"].lower() if b else None
+
+def indexed_height(db, contract: str):
+    st = db[STATE].find_one({"_id": contract.lower()})
+    return st["last_block"] if st else None
+
+def _resume_point(db, rpc, contract: str, first: int, log) -> tuple:
+    """-> (next block to scan, rewound-to height | None); rewinds when the saved block was reorged away."""
+    st = db[STATE].find_one({"_id": contract})
+    if not st:
+        return first, None
+    last = st["last_block"]
+    if not st.get("last_block_hash") or block_hash(rpc, last) == st["last_block_hash"]:
+        return last + 1, None
+    lo = max(first, last - REORG_REWIND + 1)
+    n = db[EVENTS].delete_many({"contract": contract, "block_number": {"$gte": lo}}).deleted_count
+    log(f"  block {last} was reorged away; re-scanning from {lo} ({n} indexed events dropped)")
+    return lo, lo
+
+def sync(db, rpc, contract: str, from_block: int = None, confirmations: int = CONFIRMATIONS,
+         chunk: int = CHUNK, log=print) -> dict:
+    """Scan [resume point, head - confirmations]; returns {"from", "to", "logs", "ranges"}."""
+    from pymongo import UpdateOne, DeleteOne
+    contract = contract.lower()
+    first = from_block if from_block is not None else DEPLOY_BLOCK
+    lo, rewound = _resume_point(db, rpc, contract, first, log)
+    head = rpc.block_number() - confirmations
+    stats = {"from": lo, "to": head, "logs": 0, "removed": 0, "ranges": 0, "rewound_to": rewound}
+    topic, step = topic0(), chunk
+    while lo <= head:
+        hi = min(lo + step - 1, head)
+        try:
+            logs = get_logs(rpc, contract, lo, hi, topic)
+        except Exception as e:
+            if step == 1:
+                raise
+            step = max(1, step // 2)   # provider limit (range size / result count): shrink for the rest of the run
+            log(f"  eth_getLogs {lo}-{hi} failed ({e}); range -> {step}")
+            continue
+        ops = []
+        for l in logs:
+            d = decode_log(l)
+            if l.get("removed"):   # reorged out: drop the event only if it is the one that block produced
+                ops.append(DeleteOne({"_id": d["_id"], "block_hash": d["block_hash"]}))
+                stats["removed"] += 1
+            else:
+                ops.append(UpdateOne({"_id": d["_id"]}, {"$set": d}, upsert=True))
+                stats["logs"] += 1
+        if ops:
+            db[EVENTS].bulk_write(ops, ordered=True)   # in log order: a removal then its replacement
+        db[STATE].update_one({"_id": contract},
+                             {"$set": {"last_block": hi, "last_block_hash": block_hash(rpc, hi),
+                                       "updated_at": datetime.utcnow()}}, upsert=True)
+        stats["ranges"] += 1
+        lo = hi + 1
+    return stats
+
+def lookup(db, contract: str, onchain_block_id):
+    """Indexed Anchored event for a block, or None (not anchored as of indexed_height())."""
+    return db[EVENTS].find_one({"_id": event_id(contract, onchain_block_id)})
+
+def find_root(db, root_hex: str) -> list:
+    return list(db[EVENTS].find({"root": root_hex.lower().removeprefix("0x")}))
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Index CreditAnchor Anchored logs into Mongo")
+    ap.add_argument("--rpc", default=os.getenv("WEB3_RPC_URL"))
+    ap.add_argument("--contract", default=os.getenv("ANCHOR_CONTRACT_ADDRESS"))
+    ap.add_argument("--from-block", type=int, default=None, help="start height when nothing is indexed yet")
+    ap.add_argument("--confirmations", type=int, default=CONFIRMATIONS)
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="blocks per eth_getLogs request")
+    ap.add_argument("--follow", action="store_true", help="keep polling for new blocks")
+    ap.add_argument("--interval", type=float, default=15.0)
+    args = ap.parse_args()
+    if not args.rpc or not args.contract:
+        raise SystemExit("WEB3_RPC_URL and ANCHOR_CONTRACT_ADDRESS (or --rpc/--contract) are required")
+
+    from pymongo import MongoClient
+    from anchor_verifier import BatchRPC
+    db = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "h2_registry")]
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+    rpc = BatchRPC(args.rpc)
+    while True:
+        t0 = time.perf_counter()
+        st = sync(db, rpc, args.contract, args.from_block, args.confirmations, args.chunk)
+        if st["to"] >= st["from"]:
+            print(f"indexed blocks {st['from']}-{st['to']}: {st['logs']} Anchored logs in {st['ranges']} "
+                  f"requests ({time.perf_counter() - t0:.1f}s)")
+        if not args.follow:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
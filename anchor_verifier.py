@@ -1,31 +1,49 @@
-import os, json, sys
+# anchor_verifier.py
+# usage: python anchor_verifier.py <contract_addr> <block_id> <expect_root_hex>
+#        python anchor_verifier.py --all [--batch 100] [--workers 4] [--report anchor_report.json]
+#
+# --all walks every document in db.blocks (in _id order, i.e. chain order) and checks:
+#   - linkage   : prev_hash == previous block's merkle_root, chain_hash == sha256(prev_hash + merkle_root)
+#   - id        : onchain_block_id == derive_onchain_block_id(str(_id))
+#   - on-chain  : roots(onchain_block_id) == merkle_root
+# On-chain roots are read with JSON-RPC batch requests (--batch eth_calls per HTTP request,
+# --workers requests in flight), all pinned to the same chain block so the report is a snapshot.
+#
+# --indexed compares against the local Anchored-log index kept by anchor_indexer.py (no RPC at all);
+# "chain_block_number" in the report is then the indexed height.
+#
+# env: WEB3_RPC_URL (or --rpc), MONGODB_URI, DB_NAME
+
+import os, json, sys, time, hashlib, argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from web3 import Web3
 
 load_dotenv()
-RPC = os.environ["WEB3_RPC_URL"]
+RPC = os.getenv("WEB3_RPC_URL")
+ZERO_ROOT = "0" * 64
 
 def main():
+    from web3 import Web3
     if len(sys.argv) != 4:
         print("usage: python verify_anchor.py <contract_addr> <block_id_int> <expect_root_hex>")
         sys.exit(1)
     addr = Web3.to_checksum_address(sys.argv[1])
     ########### mongo id to int block id
-    
+
     import hashlib
 
     # turn mongo _id string into deterministic uint
     mongo_id = sys.argv[2] # see it from phase1_full_report.md
-    block_id = int(hashlib.sha256(mongo_id.encode()).hexdigest(), 16) % (2**256)    
+    block_id = int(hashlib.sha256(mongo_id.encode()).hexdigest(), 16) % (2**256)
 
     # block_id = int(sys.argv[2])
     #######################################################
-    # block_id = int(sys.argv[2]) 
+    # block_id = int(sys.argv[2])
     expect = sys.argv[3].lower()
     if not expect.startswith("0x"):
         expect = "0x" + expect
 
-    w3 = Web3(Web3.HTTPProvider(RPC))
+    w3 = Web3(Web3.HTTPProvider(os.environ["WEB3_RPC_URL"]))
     with open("CreditAnchor.abi.json") as f:
         abi = json.load(f)
     c = w3.eth.contract(address=addr, abi=abi)
@@ -36,5 +54,184 @@ def main():
     print("expected       :", expect)
     print("match?         :", ok)
 
+# ---------------- whole chain ----------------
+
+class BatchRPC:
+    """Minimal JSON-RPC client that sends many eth_calls in one HTTP request."""
+
+    def __init__(self, url: str, timeout: float = 30.0, pool: int = 4):
+        import requests
+        from web3 import Web3
+        self.url, self.timeout = url, timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.selector = Web3.keccak(text="roots(uint256)")[:4].hex().removeprefix("0x")
+
+    def _post(self, payload):
+        r = self.session.post(self.url, json=payload, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def call(self, method: str, params: list):
+        res = self._post({"jsonrpc": "2.0", "id": 0, "method": method, "params": params})
+        if "error" in res:
+            raise RuntimeError(res["error"])
+        return res["result"]
+
+    def block_number(self) -> int:
+        return int(self.call("eth_blockNumber", []), 16)
+
+    def roots(self, calls, block_tag) -> dict:
+        """calls: [(key, contract_address, onchain_block_id)] -> {key: root hex (no 0x) | Exception}"""
+        payload = [{
+            "jsonrpc": "2.0", "id": i, "method": "eth_call",
+            "params": [{"to": addr, "data": "0x" + self.selector + format(int(bid), "064x")}, block_tag],
+        } for i, (_, addr, bid) in enumerate(calls)]
+        res = self._post(payload)
+        if isinstance(res, dict):  # provider refused the batch as a whole
+            err = RuntimeError(res.get("error") or res)
+            return {key: err for key, _, _ in calls}
+        by_id = {r.get("id"): r for r in res}
+        out = {}
+        for i, (key, _, _) in enumerate(calls):
+            r = by_id.get(i)
+            if r is None:
+                out[key] = RuntimeError("missing from batch response")
+            elif "error" in r:
+                out[key] = RuntimeError(r["error"])
+            else:
+                h = (r.get("result") or "0x").lower().removeprefix("0x")
+                out[key] = h.zfill(64) if len(h) <= 64 else RuntimeError(f"bad result {r['result'][:80]}")
+        return out
+
+def read_roots(rpc: BatchRPC, calls: list, batch: int, workers: int, block_tag: str) -> dict:
+    """Batched, concurrent roots() reads; calls that fail are retried once in a second pass."""
+    out = {}
+    for attempt in range(2):
+        chunks = [calls[i:i + batch] for i in range(0, len(calls), batch)]
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futs = {ex.submit(rpc.roots, ch, block_tag): ch for ch in chunks}
+            for fut in as_completed(futs):
+                try:
+                    out.update(fut.result())
+                except Exception as e:
+                    out.update({key: e for key, _, _ in futs[fut]})
+        calls = [c for c in calls if isinstance(out[c[0]], Exception)]
+        if not calls:
+            break
+    return out
+
+def read_indexed_roots(db, calls: list):
+    """Same result shape as read_roots(), from anchor_indexer's local Anchored-log index."""
+    import anchor_indexer
+    ids = {anchor_indexer.event_id(addr, oid): key for key, addr, oid in calls}
+    out = {key: ZERO_ROOT for key, _, _ in calls}
+    keys = list(ids)
+    for i in range(0, len(keys), 5000):
+        for e in db[anchor_indexer.EVENTS].find({"_id": {"$in": keys[i:i + 5000]}}, {"root": 1}):
+            out[ids[e["_id"]]] = e["root"]
+    heights = [anchor_indexer.indexed_height(db, a) for a in {addr for _, addr, _ in calls}]
+    if any(h is None for h in heights):
+        raise SystemExit("no anchor index for this contract; run anchor_indexer.py first")
+    return min(heights), out
+
+def verify_all(args) -> int:
+    from pymongo import MongoClient
+    from utils import derive_onchain_block_id
+    db = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "h2_registry")]
+    t0 = time.perf_counter()
+
+    mismatches = []   # {"block_id", "reason", ...}
+    calls = []        # (block_id str, contract_address, onchain_block_id)
+    stored = {}       # block_id str -> (merkle_root, anchor_tx)
+    prev_root, n = None, 0
+    proj = {"merkle_root": 1, "prev_hash": 1, "chain_hash": 1, "onchain_block_id": 1,
+            "contract_address": 1, "anchor_tx": 1}
+    for b in db.blocks.find({}, proj).sort("_id", 1).batch_size(5000):
+        n += 1
+        bid = str(b["_id"])
+        root = (b.get("merkle_root") or "").lower()
+        if b.get("prev_hash") != prev_root:
+            mismatches.append({"block_id": bid, "reason": "prev_hash_mismatch",
+                               "stored": b.get("prev_hash"), "expected": prev_root})
+        want = hashlib.sha256(((b.get("prev_hash") or "") + root).encode("utf-8")).hexdigest()
+        if b.get("chain_hash") != want:
+            mismatches.append({"block_id": bid, "reason": "chain_hash_mismatch",
+                               "stored": b.get("chain_hash"), "expected": want})
+        onchain_id = str(derive_onchain_block_id(bid))
+        if b.get("onchain_block_id") is not None and str(b["onchain_block_id"]) != onchain_id:
+            mismatches.append({"block_id": bid, "reason": "onchain_id_mismatch",
+                               "stored": b["onchain_block_id"], "expected": onchain_id})
+        prev_root = b.get("merkle_root")
+
+        addr = b.get("contract_address") or args.contract
+        if not addr:
+            mismatches.append({"block_id": bid, "reason": "no_contract_address"})
+            continue
+        calls.append((bid, addr, onchain_id))
+        stored[bid] = (root, b.get("anchor_tx"))
+    t_db = time.perf_counter() - t0
+
+    chain_block, unanchored = None, 0
+    if calls and not args.no_chain:
+        if args.indexed:
+            chain_block, onchain = read_indexed_roots(db, calls)
+        else:
+            if not args.rpc:
+                raise SystemExit("WEB3_RPC_URL (or --rpc) is required; use --no-chain for linkage only")
+            rpc = BatchRPC(args.rpc, timeout=args.timeout, pool=args.workers)
+            chain_block = rpc.block_number()
+            onchain = read_roots(rpc, calls, args.batch, args.workers, hex(chain_block))
+        for bid, addr, onchain_id in calls:
+            root, anchor_tx = stored[bid]
+            got = onchain[bid]
+            if isinstance(got, Exception):
+                reason = "chain_read_error"
+            elif got == ZERO_ROOT:
+                if not anchor_tx or str(anchor_tx).startswith("ERROR"):
+                    unanchored += 1   # never anchored: reported in the summary, not a mismatch
+                    continue
+                reason = "root_not_on_chain"
+            elif got != root:
+                reason = "chain_mismatch"
+            else:
+                continue
+            mismatches.append({"block_id": bid, "reason": reason, "contract_address": addr,
+                               "onchain_block_id": onchain_id, "stored_root": root, "anchor_tx": anchor_tx,
+                               "onchain_root": got if isinstance(got, str) else f"error: {got}"})
+    t_chain = time.perf_counter() - t0 - t_db
+
+    reasons = {}
+    for m in mismatches:
+        reasons[m["reason"]] = reasons.get(m["reason"], 0) + 1
+    summary = {
+        "blocks": n, "chain_reads": len(calls) if not args.no_chain else 0,
+        "chain_checked": not args.no_chain, "chain_block_number": chain_block,
+        "unanchored": unanchored, "mismatches": len(mismatches), "mismatches_by_reason": reasons,
+        "timing_s": {"db": round(t_db, 3), "chain": round(t_chain, 3), "total": round(time.perf_counter() - t0, 3)},
+    }
+    with open(args.report, "w") as f:
+        json.dump({"summary": summary, "mismatches": mismatches}, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    print("report:", args.report)
+    return 0 if not mismatches else 2
+
 if __name__ == "__main__":
-    main()
+    if "--all" not in sys.argv:
+        main()
+        sys.exit(0)
+    ap = argparse.ArgumentParser(description="Verify every block's anchor and chain linkage")
+    ap.add_argument("--all", action="store_true", required=True)
+    ap.add_argument("--rpc", default=RPC)
+    ap.add_argument("--contract", default=os.getenv("ANCHOR_CONTRACT_ADDRESS"),
+                    help="fallback for blocks closed without contract_address")
+    ap.add_argument("--batch", type=int, default=100, help="eth_calls per JSON-RPC batch request")
+    ap.add_argument("--workers", type=int, default=4, help="batch requests in flight")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--no-chain", action="store_true", help="only check prev_hash/chain_hash linkage")
+    ap.add_argument("--indexed", action="store_true",
+                    help="compare against db.anchor_events (anchor_indexer.py) instead of reading the chain")
+    ap.add_argument("--report", default="anchor_report.json")
+    sys.exit(verify_all(ap.parse_args()))
@@ -3,7 +3,11 @@
 #   pip install flask pymongo cryptography python-dotenv werkzeug web3
 #   export MONGODB_URI="mongodb://localhost:27017"
 #   export DB_NAME="h2_registry"
-#   python app.py
+#   python app.py                      # dev server (creates indexes first)
+#
+# Production:
+#   python app.py init-indexes         # once per deploy (or: flask --app app init-indexes)
+#   gunicorn "app:create_app()"        # workers connect to Mongo lazily, after fork
 #
 # Optional (for anchoring):
 #   export WEB3_RPC_URL="https://sepolia.infura.io/v3/<KEY>"
@@ -16,9 +20,9 @@ import os, json, hashlib
 from datetime import datetime, timezone
 from typing import Optional, List
 
-from flask import Flask, request, Response
+from flask import Flask, Blueprint, request, Response
 from werkzeug.utils import secure_filename
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING, DESCENDING
 from bson import ObjectId
 from dotenv import load_dotenv
 
@@ -29,34 +33,91 @@ from cryptography.exceptions import InvalidSignature
 
 
 from utils import _signed_raw_bytes, derive_onchain_block_id, _norm0x
+from evidence_ingest import (iter_evidence_rows, iter_signature_lines, iter_batches,
+                             row_event_payload, file_signature_payload)
+import evidence_merkle
+import http_cache
+import idempotency
+import anchor_indexer
+import proof_bundle
+import ledger_replay
+import balance_journal
+import credit_compaction
+import multi_credit
+import bulk_mint
+import order_book
+from lazy_mongo import LazyDatabase
 ###################### phase 2
 from phase2.smt_state import DEFAULTS, build_state_root, prove_account, verify_account  # :contentReference[oaicite:4]{index=4}
-from web3 import Web3
-import os, json, hashlib
+import metrics
+build_state_root = metrics.timed("build_state_root")(build_state_root)
+prove_account    = metrics.timed("prove_account")(prove_account)
 # ---------------- Config ----------------
 load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME      = os.getenv("DB_NAME", "h2_registry")
-EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", "evidence_store")
-os.makedirs(EVIDENCE_DIR, exist_ok=True)
+EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", "evidence_store")  # created on first upload
+UPLOAD_CHUNK      = 1 << 20   # bytes per read when streaming uploads to disk
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
 
 # Optional chain env
 WEB3_RPC_URL = os.getenv("WEB3_RPC_URL")
 REG_PK       = os.getenv("PRIVATE_KEY")
 ANCHOR_ADDR  = os.getenv("ANCHOR_CONTRACT_ADDRESS")
 
-client = MongoClient(MONGODB_URI)
-db = client[DB_NAME]
-
-# Indexes (idempotent)
-db.evidence.create_index("sha256_hex", unique=True)
-db.accounts.create_index("name")
-db.sensors.create_index([("electrolyzer_id", ASCENDING), ("owner_account_id", ASCENDING)], unique=True)
-db.production_events.create_index([("electrolyzer_id", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)])
-db.credits.create_index([("owner_account_id", ASCENDING), ("status", ASCENDING)])
-db.ledger_txs.create_index([("block_id", ASCENDING), ("created_at", ASCENDING)])
-db.blocks.create_index([("created_at", ASCENDING)])
-
+ANCHOR_ABI = [{
+  "inputs":[{"internalType":"uint256","name":"blockId","type":"uint256"},
+            {"internalType":"bytes32","name":"root","type":"bytes32"}],
+  "name":"anchor","outputs":[{"internalType":"bool","name":"","type":"bool"}],
+  "stateMutability":"nonpayable","type":"function"
+}]
+
+def chain_configured() -> bool:
+    return bool(WEB3_RPC_URL and REG_PK and ANCHOR_ADDR)
+
+# connects on first query in each process (fork-safe); see lazy_mongo.py
+db = LazyDatabase(MONGODB_URI, DB_NAME, event_listeners=[metrics.MongoCommandListener()])
+
+# Indexes: (collection, keys, options). Applied by ensure_indexes(), not at import.
+INDEXES = [
+    ("evidence",          "sha256_hex", {"unique": True}),
+    ("accounts",          "name", {}),
+    ("sensors",           [("electrolyzer_id", ASCENDING), ("owner_account_id", ASCENDING)], {"unique": True}),
+    ("production_events", [("electrolyzer_id", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)], {}),
+    ("production_events", [("evidence_id", ASCENDING)], {}),
+    ("credits",           [("owner_account_id", ASCENDING), ("status", ASCENDING)], {}),
+    ("ledger_txs",        [("block_id", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("ledger_txs",        "tx_hash", {}),   # /proof/tx lookups
+    ("credits",           "event_id", {}),  # mint-once check
+    idempotency.INDEX,                     # TTL on idempotency_keys.created_at
+    ("blocks",            [("created_at", ASCENDING)], {}),
+    ("blocks",            "onchain_block_id", {}),
+    *anchor_indexer.INDEXES,               # anchor_events (Anchored logs indexed by anchor_indexer.py)
+    *ledger_replay.INDEXES,                # replay checkpoint chunks
+    *balance_journal.INDEXES,              # balance_journal (account, block_seq) + blocks.seq
+    *credit_compaction.INDEXES,            # credits_merged (fragments folded away by credit_compaction.py)
+    *bulk_mint.INDEXES,                    # verified + unminted production_events
+    *order_book.INDEXES,                   # market_bids / market_trades
+    *multi_credit.INDEXES,                 # multi_credit_ops (unfinished amount transfers / retirements)
+    # list endpoints: equality filter + keyset on _id
+    ("accounts",          [("role", ASCENDING), ("_id", DESCENDING)], {}),
+    ("sensors",           [("owner_account_id", ASCENDING), ("_id", DESCENDING)], {}),
+    ("production_events", [("electrolyzer_id", ASCENDING), ("_id", DESCENDING)], {}),
+    ("production_events", [("sensor_id", ASCENDING), ("_id", DESCENDING)], {}),
+    ("production_events", [("verified", ASCENDING), ("_id", DESCENDING)], {}),
+    ("market_offers",     [("status", ASCENDING), ("_id", DESCENDING)], {}),
+    ("market_offers",     [("producer_id", ASCENDING), ("status", ASCENDING), ("_id", DESCENDING)], {}),
+    ("market_offers",     [("credit_id", ASCENDING), ("status", ASCENDING), ("_id", DESCENDING)], {}),
+    ("ledger_txs",        [("type", ASCENDING), ("_id", DESCENDING)], {}),
+    ("ledger_txs",        [("type", ASCENDING), ("payload.owner_account_id", ASCENDING), ("_id", DESCENDING)], {}),
+]
+
+def ensure_indexes(database=None) -> list:
+    """Create every index in INDEXES (idempotent). Run once per deploy via `python app.py init-indexes`."""
+    database = database if database is not None else db
+    return [database[coll].create_index(keys, **opts) for coll, keys, opts in INDEXES]
+
+@metrics.timed("fetch_balances")
 def _fetch_balances():
     agg = db.credits.aggregate([
         {"$match": {"status": {"$ne": "retired"}}},
@@ -67,42 +128,93 @@ def _fetch_balances():
         balances[str(row["_id"])] = int(row["g"])
     return balances
 from flask_cors import CORS
-app = Flask(__name__)
-CORS(app)
-
-
+import profiling
 from app_keys_blueprint import bp_keys
-app.register_blueprint(bp_keys)
+
+# all registry routes; mounted by create_app()
+bp = Blueprint("registry", __name__)
 
 # --------------- JSON helper ---------------
-def j(data, status=200):
-    return Response(json.dumps(data, default=str), status=status, mimetype="application/json")
-# --- helpers (top of app.py or helpers section) ---
-from datetime import datetime, timezone
-from bson import ObjectId
+# fastjson handles ObjectId/datetime inside the encoder (orjson when installed), no pre-walk copy
+from fastjson import dumps as json_dumps, to_public
 
-def to_public(x):
-    """Recursively convert ObjectId and datetime to JSON-safe values."""
-    if isinstance(x, dict):
-        return {k: to_public(v) for k, v in x.items()}
-    if isinstance(x, list):
-        return [to_public(v) for v in x]
-    try:
-        from bson import ObjectId as _OID
-        if isinstance(x, _OID):
-            return str(x)
-    except Exception:
-        pass
-    if isinstance(x, datetime):
-        return x.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
-    return x
+def j(data, status=200, iso=False):
+    return Response(json_dumps(data, iso), status=status, mimetype="application/json")
 
 def j_ok(payload, code=200):
-    return j(to_public(payload)), code
+    return j(payload, iso=True), code   # ISO-8601 "Z" datetimes, as the old to_public() pre-walk gave
 
 def j_err(msg, code=400):
     return j({"error": msg}), code
 
+# --------------- Pagination (keyset on _id, newest first) ---------------
+PAGE_LIMIT_DEFAULT = int(os.getenv("PAGE_LIMIT_DEFAULT", "100"))
+PAGE_LIMIT_MAX     = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+EXPORT_BATCH       = 1000   # Mongo cursor batch for NDJSON exports
+EXPORT_FLUSH_LINES = 256    # lines per chunk written to the socket
+
+def page_args(field_map: dict):
+    """
+    ?after=<_id>&limit=N&fields=a,b  ->  (after_oid|None, limit, projection|None, keep|None)
+    field_map: public field -> mongo fields it needs (drives the projection). Raises ValueError.
+    """
+    try:
+        limit = int(request.args.get("limit", PAGE_LIMIT_DEFAULT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    limit = max(1, min(limit, PAGE_LIMIT_MAX))
+    after = request.args.get("after")
+    if after:
+        try:
+            after = ObjectId(after)
+        except Exception:
+            raise ValueError("invalid after cursor")
+    projection = keep = None
+    if request.args.get("fields"):
+        keep = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = [f for f in keep if f not in field_map]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)} (allowed: {', '.join(field_map)})")
+        projection = {m: 1 for f in keep for m in field_map[f]}
+    return after or None, limit, projection, keep
+
+def time_range_arg(q: dict, field: str):
+    """?from=&to= (ISO 8601) -> q[field] = {$gte, $lt}. Raises ValueError."""
+    rng = {}
+    for arg, op in (("from", "$gte"), ("to", "$lt")):
+        v = request.args.get(arg)
+        if v:
+            try:
+                rng[op] = as_naive_utc(parse_iso(v))
+            except Exception:
+                raise ValueError(f"invalid {arg}; use ISO 8601")
+    if rng:
+        q[field] = rng
+    return q
+
+def keyset_page(coll, q: dict, after, limit: int, projection=None):
+    """One page newest-first; reads limit+1 docs to learn whether another page exists."""
+    if after is not None:
+        q = {**q, "_id": {"$lt": after}}
+    docs = list(coll.find(q, projection).sort("_id", -1).limit(limit + 1))
+    next_after = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_after
+
+def paged(items, next_after, keep=None, wrap=None):
+    """Bare-list endpoints keep their body shape; the cursor always rides in X-Next-After."""
+    if keep:
+        items = [{k: it.get(k) for k in keep} for it in items]
+    resp = j(items if wrap is None else {wrap: items, "next_after": next_after})
+    if next_after:
+        resp.headers["X-Next-After"] = next_after
+    return resp
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+def _sid(x):
+    return str(x) if x is not None else None
+
 # --------------- Helpers ---------------
 def sha256_hex(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
@@ -124,6 +236,7 @@ def parse_iso(s: str) -> datetime:
 def load_pubkey(pem_text: str) -> Ed25519PublicKey:
     return serialization.load_pem_public_key(pem_text.encode("utf-8"))
 
+@metrics.timed("verify_ed25519")
 def verify_ed25519(pub_pem: str, msg: bytes, sig_hex: str) -> bool:
     try:
         pub = load_pubkey(pub_pem)
@@ -137,6 +250,7 @@ def kg_to_g(kg: float) -> int:
     return int(round(kg * 1000))
 
 # ---------- Merkle (tree hash over tx_hash strings) ----------
+@metrics.timed("merkle_root")
 def merkle_root(hashes: List[str]) -> str:
     if not hashes: return "0"*64
     layer = hashes[:]
@@ -152,18 +266,29 @@ def merkle_root(hashes: List[str]) -> str:
 def tx_hash(payload: dict) -> str:
     return sha256_hex(canonical_json(payload).encode("utf-8"))
 
-def ledger_append(tx_type: str, payload: dict) -> str:
-    th = tx_hash({"type": tx_type, **payload})
-    db.ledger_txs.insert_one({
+def ledger_doc(tx_type: str, payload: dict) -> dict:
+    return {
         "type": tx_type,
         "payload": payload,
-        "tx_hash": th,
+        "tx_hash": tx_hash({"type": tx_type, **payload}),
         "block_id": None,
         "created_at": datetime.utcnow()
-    })
-    return th
+    }
 
-def close_block(note: Optional[str] = None) -> dict:
+@metrics.timed("ledger_append")
+def ledger_append(tx_type: str, payload: dict) -> str:
+    doc = ledger_doc(tx_type, payload)
+    db.ledger_txs.insert_one(doc)
+    return doc["tx_hash"]
+
+def ledger_append_many(entries: list) -> list:
+    """entries: [(tx_type, payload), ...] -> tx hashes, one insert_many round trip."""
+    docs = [ledger_doc(t, p) for t, p in entries]
+    if docs:
+        db.ledger_txs.insert_many(docs, ordered=True)
+    return [d["tx_hash"] for d in docs]
+
+def close_block(note: Optional[str] = None, anchor: bool = True) -> dict:
     # 1) collect pending txs (handle both None and missing field)
     pending = list(db.ledger_txs.find({
         "$or": [{"block_id": None}, {"block_id": {"$exists": False}}]
@@ -183,6 +308,7 @@ def close_block(note: Optional[str] = None) -> dict:
         "prev_hash": prev_hash,
         "merkle_root": root,
         "chain_hash": chain_hash,
+        "seq": balance_journal.next_seq(prev),
         "tx_count": len(pending),
         "note": note,
         "created_at": datetime.utcnow(),
@@ -213,108 +339,67 @@ def close_block(note: Optional[str] = None) -> dict:
             {"$set": {"status": "active", "block_id": block_id}}
         )
 
-    # 6) optional: anchor to chain if env present
-    anchored = False
-    anchor_txh = None
-    if WEB3_RPC_URL and REG_PK and ANCHOR_ADDR:
-        try:
-            from web3 import Web3
-            w3 = Web3(Web3.HTTPProvider(WEB3_RPC_URL))
-            acct = w3.eth.account.from_key(REG_PK)
-            abi = [{
-              "inputs":[{"internalType":"uint256","name":"blockId","type":"uint256"},
-                        {"internalType":"bytes32","name":"root","type":"bytes32"}],
-              "name":"anchor","outputs":[{"internalType":"bool","name":"","type":"bool"}],
-              "stateMutability":"nonpayable","type":"function"
-            }]
-            contract = w3.eth.contract(address=Web3.to_checksum_address(ANCHOR_ADDR), abi=abi)
-            root_bytes = w3.to_bytes(hexstr=root)
-            # tx = contract.functions.anchor(onchain_block_id, root_bytes).build_transaction({
-            #     "from": acct.address,
-            #     "nonce": w3.eth.get_transaction_count(acct.address),
-            #     "gas": 200000,
-            #     "maxFeePerGas": w3.to_wei("20", "gwei"),
-            #     "maxPriorityFeePerGas": w3.to_wei("1", "gwei"),
-            #     "chainId": w3.eth.chain_id,
-            # })
-            # signed = w3.eth.account.sign_transaction(tx, REG_PK)
-
-            # # handle web3 SignedTransaction attr names across versions
-            # raw = getattr(signed, "rawTransaction", None) or getattr(signed, "raw_transaction", None)
-            # if raw is None:
-            #     raw = signed  # fallback if provider already returns raw bytes
-
-            # txh = w3.eth.send_raw_transaction(raw)
-            # anchor_txh = txh.hex() if hasattr(txh, "hex") else str(txh)
-
-            # # persist on the block
-            # db.blocks.update_one({"_id": block_id}, {"$set": {"anchor_tx": anchor_txh}})
-
-            # # mark ALL txs in this block as anchored (so reports show anchored:true)
-            # db.ledger_txs.update_many(
-            #     {"block_id": block_id},
-            #     {"$set": {"anchored": True, "anchor_tx": anchor_txh}}
-            # )
-
-            # # (optional) for convenience, also stamp minted credits with anchor_tx
-            # for t in db.ledger_txs.find({"block_id": block_id, "type": "mint"}):
-            #     db.credits.update_one(
-            #         {"_id": ObjectId(t["payload"]["credit_id"])},
-            #         {"$set": {"anchor_tx": anchor_txh}}
-            #     )
-
-            # # add an anchor marker into the ledger (itself will go into the next block)
-            # ledger_append("anchor", {
-            #     "block_id": str(block_id),
-            #     "root": root,
-            #     "anchor_tx": anchor_txh,
-            #     "anchored": True
-            # })
-
-            # anchored = True
-            ### edit
-            from utils import send_anchor_with_bump
-            txh_hex = send_anchor_with_bump(
-                w3=w3,
-                acct=acct,
-                contract=contract,
-                onchain_block_id=onchain_block_id,
-                root_bytes=root_bytes,
-                chain_id=w3.eth.chain_id,
-                attempts=4,
-                wait_receipt=False  # or True if you want to block until mined
-            )
-
-            db.blocks.update_one({"_id": block_id}, {"$set": {"anchor_tx": txh_hex}})
-            db.ledger_txs.update_many({"block_id": block_id}, {"$set": {"anchored": True, "anchor_tx": txh_hex}})
-            for t in db.ledger_txs.find({"block_id": block_id, "type": "mint"}):
-                db.credits.update_one({"_id": ObjectId(t["payload"]["credit_id"])}, {"$set": {"anchor_tx": txh_hex}})
-            ledger_append("anchor", {"block_id": str(block_id), "root": root, "anchor_tx": txh_hex, "anchored": True})
-            anchored = True
-            # end edit
-        except Exception as e:
-            anchor_txh = f"ERROR: {e}"  # do not fail the block close
-
-    return {
+    result = {
         "block_id": str(block_id),
         "onchain_block_id": str(onchain_block_id),
         "merkle_root": root,
         "tx_count": len(pending),
         "chain_hash": chain_hash,
         "contract_address": ANCHOR_ADDR,
-        "anchored": anchored,
-        "anchor_tx": anchor_txh,
+        "anchored": False,
+        "anchor_tx": None,
         "activated_mints": activated_mints,
     }
 
+    # 6) balance journal (balances at the close of this block); a failure here only delays it to the next close
+    try:
+        result["block_seq"] = balance_journal.sync(db)["to_seq"]
+    except Exception as e:
+        result["block_seq"] = None
+        result["balance_journal"] = f"ERROR: {e}"
+
+    # 7) optional: anchor to chain if env present (asgi.py passes anchor=False and does this step async)
+    if anchor and chain_configured():
+        try:
+            from web3 import Web3
+            from utils import send_anchor_with_bump
+            w3 = Web3(Web3.HTTPProvider(WEB3_RPC_URL))
+            acct = w3.eth.account.from_key(REG_PK)
+            contract = w3.eth.contract(address=Web3.to_checksum_address(ANCHOR_ADDR), abi=ANCHOR_ABI)
+            with metrics.timer("anchor_send"):
+                txh_hex = send_anchor_with_bump(
+                    w3=w3,
+                    acct=acct,
+                    contract=contract,
+                    onchain_block_id=onchain_block_id,
+                    root_bytes=w3.to_bytes(hexstr=root),
+                    chain_id=w3.eth.chain_id,
+                    attempts=4,
+                    wait_receipt=False  # or True if you want to block until mined
+                )
+            record_close_anchor(block_id, root, txh_hex)
+            result["anchored"] = True
+        except Exception as e:
+            result["anchor_tx"] = f"ERROR: {e}"  # do not fail the block close
+    return result
+
+def record_close_anchor(block_id: ObjectId, root: str, txh_hex: str) -> None:
+    """Persist an anchor sent by close_block: block, its txs, minted credits, and an anchor marker tx."""
+    db.blocks.update_one({"_id": block_id}, {"$set": {"anchor_tx": txh_hex}})
+    db.ledger_txs.update_many({"block_id": block_id}, {"$set": {"anchored": True, "anchor_tx": txh_hex}})
+    for t in db.ledger_txs.find({"block_id": block_id, "type": "mint"}):
+        db.credits.update_one({"_id": ObjectId(t["payload"]["credit_id"])}, {"$set": {"anchor_tx": txh_hex}})
+    # the marker itself goes into the next block
+    ledger_append("anchor", {"block_id": str(block_id), "root": root, "anchor_tx": txh_hex, "anchored": True})
+
 # --------------- Routes (prefix: /api/v1) ---------------
 
-@app.get("/api/v1/health")
+@bp.get("/api/v1/health")
 def health():
     return j({"ok": True})
 
 # ---- Accounts ----
-@app.post("/api/v1/accounts")
+@bp.post("/api/v1/accounts")
 def create_account():
     body = request.get_json(force=True)
     name = body.get("name")
@@ -327,15 +412,23 @@ def create_account():
     ledger_append("account_create", {"account_id": str(res.inserted_id), "role": role})
     return j({"id": str(res.inserted_id), **doc})
 
-@app.get("/api/v1/accounts")
+ACCOUNT_FIELDS = {"id": ["_id"], "name": ["name"], "role": ["role"], "public_key_pem": ["public_key_pem"]}
+
+@bp.get("/api/v1/accounts")
 def list_accounts():
-    out = []
-    for a in db.accounts.find({}):
-        out.append({"id": str(a["_id"]), "name": a["name"], "role": a["role"], "public_key_pem": a["public_key_pem"]})
-    return j(out)
+    """?role=&name=&after=&limit=&fields="""
+    try:
+        after, limit, projection, keep = page_args(ACCOUNT_FIELDS)
+    except ValueError as e:
+        return j_err(str(e))
+    q = {k: request.args[k] for k in ("role", "name") if request.args.get(k)}
+    docs, nxt = keyset_page(db.accounts, q, after, limit, projection)
+    out = [{"id": str(a["_id"]), "name": a.get("name"), "role": a.get("role"),
+            "public_key_pem": a.get("public_key_pem")} for a in docs]
+    return paged(out, nxt, keep)
 
 # ---- Sensors ----
-@app.post("/api/v1/sensors")
+@bp.post("/api/v1/sensors")
 def register_sensor():
     body = request.get_json(force=True)
     name = body.get("name")
@@ -361,38 +454,117 @@ def register_sensor():
     return j({"id": str(res.inserted_id), "name": name, "electrolyzer_id": electrolyzer_id,
               "owner_account_id": str(owner["_id"]), "public_key_pem": public_key_pem})
 
-@app.get("/api/v1/sensors")
+SENSOR_FIELDS = {"id": ["_id"], "name": ["name"], "electrolyzer_id": ["electrolyzer_id"],
+                 "owner_account_id": ["owner_account_id"], "public_key_pem": ["public_key_pem"]}
+
+@bp.get("/api/v1/sensors")
 def list_sensors():
-    out = []
-    for s in db.sensors.find({}):
-        out.append({"id": str(s["_id"]), "name": s["name"], "electrolyzer_id": s["electrolyzer_id"],
-                    "owner_account_id": str(s["owner_account_id"]), "public_key_pem": s["public_key_pem"]})
-    return j(out)
+    """?electrolyzer_id=&owner_account_id=&after=&limit=&fields="""
+    try:
+        after, limit, projection, keep = page_args(SENSOR_FIELDS)
+        q = {}
+        if request.args.get("electrolyzer_id"):
+            q["electrolyzer_id"] = request.args["electrolyzer_id"]
+        if request.args.get("owner_account_id"):
+            q["owner_account_id"] = ObjectId(request.args["owner_account_id"])
+    except ValueError as e:
+        return j_err(str(e))
+    except Exception:
+        return j_err("invalid owner_account_id")
+    docs, nxt = keyset_page(db.sensors, q, after, limit, projection)
+    out = [{"id": str(s["_id"]), "name": s.get("name"), "electrolyzer_id": s.get("electrolyzer_id"),
+            "owner_account_id": _sid(s.get("owner_account_id")), "public_key_pem": s.get("public_key_pem")}
+           for s in docs]
+    return paged(out, nxt, keep)
 
 # ---- Evidence ----
-@app.post("/api/v1/evidence/upload")
+@bp.post("/api/v1/evidence/upload")
 def upload_evidence():
     if "file" not in request.files:
         return j({"error": "file is required"}, 400)
     f = request.files["file"]
     filename = secure_filename(f.filename or "evidence.bin")
-    content = f.read()
-    digest = sha256_hex(content)
+    # stream to disk while hashing so large files never sit in memory
+    os.makedirs(EVIDENCE_DIR, exist_ok=True)
+    h = hashlib.sha256()
+    tmp_path = os.path.join(EVIDENCE_DIR, f".upload_{ObjectId()}")
+    try:
+        with open(tmp_path, "wb") as out:
+            for chunk in iter(lambda: f.stream.read(UPLOAD_CHUNK), b""):
+                h.update(chunk)
+                out.write(chunk)
+    except BaseException:  # client disconnect / disk full: don't leave the partial file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    digest = h.hexdigest()
 
     ex = db.evidence.find_one({"sha256_hex": digest})
     if ex:
+        os.remove(tmp_path)
         return j({"id": str(ex["_id"]), "filename": ex["filename"], "sha256_hex": ex["sha256_hex"],
                   "stored_path": ex["stored_path"], "created_at": ex["created_at"].isoformat()})
 
     stored_name = f"{digest[:12]}_{filename}"
     stored_path = os.path.join(EVIDENCE_DIR, stored_name)
-    with open(stored_path, "wb") as out:
-        out.write(content)
-    doc = {"filename": filename, "sha256_hex": digest, "stored_path": stored_path, "created_at": datetime.utcnow()}
+    os.replace(tmp_path, stored_path)
+    from evidence_reconcile import reconcile_file  # numpy/pyarrow load on first upload, not at import
+    doc = {"filename": filename, "sha256_hex": digest, "stored_path": stored_path, "created_at": datetime.utcnow(),
+           "rows_merkle": evidence_merkle.build_row_tree(stored_path),
+           "reconcile": reconcile_file(stored_path)}  # structure/efficiency checks; totals vs events come later
     res = db.evidence.insert_one(doc)
-    ledger_append("evidence", {"evidence_id": str(res.inserted_id), "sha256_hex": digest})
+    ledger_append("evidence", {"evidence_id": str(res.inserted_id), "sha256_hex": digest,
+                               "rows_merkle_root": doc["rows_merkle"]["root"]})
     return j({"id": str(res.inserted_id), **doc, "created_at": doc["created_at"].isoformat()})
 
+@bp.get("/api/v1/evidence/<evidence_id>/reconcile")
+def evidence_reconcile(evidence_id):
+    """Re-run reconciliation including totals claimed by the events that cite this evidence."""
+    try:
+        ev = db.evidence.find_one({"_id": ObjectId(evidence_id)})
+    except Exception:
+        return j({"error": "invalid evidence_id"}, 400)
+    if not ev: return j({"error": "evidence not found"}, 404)
+    from evidence_reconcile import reconcile_file, claimed_totals
+    claimed = claimed_totals(db, [ev["_id"]]).get(ev["_id"])   # None: no event cites it yet, like audit_store
+    rep = reconcile_file(ev["stored_path"], claimed)
+    db.evidence.update_one({"_id": ev["_id"]}, {"$set": {"reconcile": rep}})
+    return j({"evidence_id": evidence_id, "sha256_hex": ev["sha256_hex"], **rep})
+
+@bp.get("/api/v1/evidence/<evidence_id>/rows/<int:row>/proof")
+def evidence_row_proof(evidence_id, row):
+    """One line of an evidence file (0 = header) + its inclusion proof against rows_merkle.root."""
+    try:
+        ev = db.evidence.find_one({"_id": ObjectId(evidence_id)})
+    except Exception:
+        return j({"error": "invalid evidence_id"}, 400)
+    if not ev: return j({"error": "evidence not found"}, 404)
+
+    rm = ev.get("rows_merkle")
+    if not rm or not os.path.exists(evidence_merkle.tree_path(ev["stored_path"])):
+        # evidence uploaded before row trees existed: build once, file is pinned by sha256_hex;
+        # a lost sidecar is rebuilt with the rule its ledgered root was built with
+        rule = rm.get("rule", 1) if rm else evidence_merkle.RULE
+        rm = evidence_merkle.build_row_tree(ev["stored_path"], rule)
+        db.evidence.update_one({"_id": ev["_id"]}, {"$set": {"rows_merkle": rm}})
+    if row < 0 or row >= rm["leaves"]:
+        return j({"error": f"row out of range (0..{rm['leaves'] - 1})"}, 404)
+
+    raw = evidence_merkle.read_row(ev["stored_path"], row)
+    return j({
+        "evidence_id": evidence_id,
+        "sha256_hex": ev["sha256_hex"],
+        "row": row,
+        "row_text": raw.decode("utf-8", errors="replace"),
+        "leaf": evidence_merkle.leaf_hex(raw, rm.get("rule", 1)),
+        "proof": evidence_merkle.row_proof(ev["stored_path"], rm["leaves"], row),
+        "rows_merkle_root": rm["root"],
+        "leaves": rm["leaves"],
+        "rule": rm.get("rule", 1),
+        "leaf_rule": rm["leaf_rule"],
+        "node_rule": rm["node_rule"],
+    })
+
 # ---- Overlap check ----
 def overlap_exists(electrolyzer_id: str, start: datetime, end: datetime) -> bool:
     q = {
@@ -407,7 +579,8 @@ def overlap_exists(electrolyzer_id: str, start: datetime, end: datetime) -> bool
     return hit is not None
 
 # ---- Events (signed by sensor) ----
-@app.post("/api/v1/events")
+@bp.post("/api/v1/events")
+@idempotency.idempotent(db, "events")
 def submit_event():
     body = request.get_json(force=True)
     sensor_id = body.get("sensor_id")
@@ -484,23 +657,180 @@ def submit_event():
         "signature_valid": sig_ok, "overlap_ok": ov_ok, "verified": verified
     })
 
-@app.get("/api/v1/events")
+EVENT_FIELDS = {"id": ["_id"], "sensor_id": ["sensor_id"], "electrolyzer_id": ["electrolyzer_id"],
+                "start_time": ["start_time"], "end_time": ["end_time"],
+                "energy_kwh": ["energy_kwh"], "hydrogen_kg": ["hydrogen_kg"], "evidence_id": ["evidence_id"],
+                "signature_valid": ["signature_valid"], "overlap_ok": ["overlap_ok"], "verified": ["verified"]}
+
+def event_query() -> dict:
+    """Filters shared by the events list and export. Raises ValueError."""
+    q = time_range_arg({}, "start_time")
+    if request.args.get("electrolyzer_id"):
+        q["electrolyzer_id"] = request.args["electrolyzer_id"]
+    for k in ("sensor_id", "evidence_id"):
+        if request.args.get(k):
+            try:
+                q[k] = ObjectId(request.args[k])
+            except Exception:
+                raise ValueError(f"invalid {k}")
+    if request.args.get("verified") is not None:
+        q["verified"] = request.args["verified"].lower() in ("1", "true", "yes")
+    return q
+
+def event_public(e: dict) -> dict:
+    return {
+        "id": str(e["_id"]), "sensor_id": _sid(e.get("sensor_id")),
+        "electrolyzer_id": e.get("electrolyzer_id"),
+        "start_time": _iso(e.get("start_time")), "end_time": _iso(e.get("end_time")),
+        "energy_kwh": e.get("energy_kwh"), "hydrogen_kg": e.get("hydrogen_kg"),
+        "evidence_id": str(e["evidence_id"]) if e.get("evidence_id") else None,
+        "signature_valid": bool(e.get("signature_valid")),
+        "overlap_ok": bool(e.get("overlap_ok")), "verified": bool(e.get("verified"))
+    }
+
+@bp.get("/api/v1/events")
 def list_events():
-    out = []
-    for e in db.production_events.find({}).sort("created_at", -1):
-        out.append({
-            "id": str(e["_id"]), "sensor_id": str(e["sensor_id"]),
-            "electrolyzer_id": e["electrolyzer_id"],
-            "start_time": e["start_time"].isoformat(), "end_time": e["end_time"].isoformat(),
-            "energy_kwh": e["energy_kwh"], "hydrogen_kg": e["hydrogen_kg"],
-            "evidence_id": str(e["evidence_id"]) if e.get("evidence_id") else None,
-            "signature_valid": bool(e["signature_valid"]),
-            "overlap_ok": bool(e["overlap_ok"]), "verified": bool(e["verified"])
+    """?electrolyzer_id=&sensor_id=&evidence_id=&verified=true|false&from=&to=&after=&limit=&fields="""
+    try:
+        after, limit, projection, keep = page_args(EVENT_FIELDS)
+        q = event_query()
+    except ValueError as e:
+        return j_err(str(e))
+    docs, nxt = keyset_page(db.production_events, q, after, limit, projection)
+    return paged([event_public(e) for e in docs], nxt, keep)
+
+# ---- Evidence -> events (bulk ingest) ----
+def _ingest_batch(sdoc, ev_oid, batch, file_auth=None):
+    """
+    batch: [(row_no, payload|None, sig_hex|None, error|None), ...]
+    file_auth: (canonical, sig_hex) of an already-verified per-file signature, else None (per-row).
+    One overlap query + one insert_many for events + one insert_many for ledger.
+    """
+    good = [b for b in batch if b[1] is not None]
+    if not good:
+        return 0
+    times = [(as_naive_utc(parse_iso(p["start_time"])), as_naive_utc(parse_iso(p["end_time"]))) for _, p, _, _ in good]
+    lo = min(t[0] for t in times)
+    hi = max(t[1] for t in times)
+    taken = [(e["start_time"], e["end_time"]) for e in db.production_events.find(
+        {"electrolyzer_id": sdoc["electrolyzer_id"], "start_time": {"$lt": hi}, "end_time": {"$gt": lo}},
+        {"start_time": 1, "end_time": 1})]
+
+    docs = []
+    for (row_no, payload, sig_hex, _), (st, en) in zip(good, times):
+        if file_auth:
+            canonical, sig = file_auth
+            sig_ok = True  # checked once up-front for the whole file
+        else:
+            canonical, sig = canonical_json(payload), sig_hex
+            sig_ok = bool(sig) and verify_ed25519(sdoc["public_key_pem"], canonical.encode("utf-8"), sig)
+        ov_ok = not any(s < en and e > st for s, e in taken)
+        taken.append((st, en))
+        docs.append({
+            "sensor_id": sdoc["_id"],
+            "electrolyzer_id": sdoc["electrolyzer_id"],
+            "start_time": st, "end_time": en,
+            "energy_kwh": payload["energy_kwh"], "hydrogen_kg": payload["hydrogen_kg"],
+            "evidence_id": ev_oid,
+            "evidence_row": row_no,
+            "payload_canonical": canonical,
+            "sensor_signature_hex": sig,
+            "signature_scope": "file" if file_auth else "row",
+            "signature_valid": sig_ok,
+            "overlap_ok": ov_ok,
+            "verified": bool(sig_ok and ov_ok),
+            "created_at": datetime.utcnow()
         })
-    return j(out)
+    res = db.production_events.insert_many(docs, ordered=True)
+    ledger_append_many([
+        ("event", {"event_id": str(oid), "electrolyzer_id": sdoc["electrolyzer_id"],
+                   "start_time": d["start_time"].isoformat(), "end_time": d["end_time"].isoformat(),
+                   "hydrogen_kg": d["hydrogen_kg"]})
+        for oid, d in zip(res.inserted_ids, docs)
+    ])
+    return sum(1 for d in docs if d["verified"])
+
+@bp.post("/api/v1/evidence/<evidence_id>/ingest")
+def ingest_evidence(evidence_id):
+    """
+    Turn every row of an uploaded evidence CSV into a production event.
+    multipart form (or JSON): sensor_id, and either
+      file_signature_hex  -> sensor sig over canonical({evidence_id,sensor_id,sha256_hex})
+      signatures (file)   -> one hex sig per data row over the normal event payload
+    """
+    body = request.form if request.form else (request.get_json(silent=True) or {})
+    sensor_id = body.get("sensor_id")
+    file_sig  = body.get("file_signature_hex")
+    sig_file  = request.files.get("signatures")
+    if not sensor_id or not (file_sig or sig_file):
+        return j({"error": "sensor_id and file_signature_hex or signatures file required"}, 400)
+
+    try:
+        ev = db.evidence.find_one({"_id": ObjectId(evidence_id)})
+        sdoc = db.sensors.find_one({"_id": ObjectId(sensor_id)})
+    except Exception:
+        return j({"error": "invalid id(s)"}, 400)
+    if not ev: return j({"error": "evidence not found"}, 404)
+    if not sdoc: return j({"error": "sensor not found"}, 404)
+    if ev.get("ingest"): return j({"error": "evidence already ingested", "ingest": ev["ingest"]}, 400)
+
+    ev_id_s, sensor_id_s = str(ev["_id"]), str(sdoc["_id"])
+    scope, file_auth = "row", None
+    if file_sig:
+        scope = "file"
+        file_auth = (file_signature_payload(ev_id_s, sensor_id_s, ev["sha256_hex"]), file_sig)
+        if not verify_ed25519(sdoc["public_key_pem"], file_auth[0].encode("utf-8"), file_sig):
+            return j({"error": "file signature invalid"}, 400)
+
+    # claim the evidence so two concurrent ingests cannot double-insert
+    claim = db.evidence.update_one({"_id": ev["_id"], "ingest": {"$exists": False}},
+                                   {"$set": {"ingest": {"status": "running", "sensor_id": sensor_id_s}}})
+    if claim.modified_count != 1:
+        return j({"error": "evidence already ingested"}, 400)
+
+    sigs = iter_signature_lines(sig_file.stream if (scope == "row" and sig_file) else None)
+    rows_total = created = verified = 0
+    rejected = []  # capped so memory stays flat
+
+    def parsed():
+        nonlocal rows_total
+        for row_no, row in iter_evidence_rows(ev["stored_path"]):
+            rows_total += 1
+            sig_hex = next(sigs) if scope == "row" else None
+            try:
+                yield row_no, row_event_payload(sensor_id_s, ev_id_s, row), sig_hex, None
+            except (TypeError, ValueError) as e:
+                yield row_no, None, sig_hex, str(e)
+
+    try:
+        for batch in iter_batches(parsed(), INGEST_BATCH_SIZE):
+            for row_no, payload, _, err in batch:
+                if err and len(rejected) < 50:
+                    rejected.append({"row": row_no, "error": err})
+            verified += _ingest_batch(sdoc, ev["_id"], batch, file_auth)
+            created += sum(1 for b in batch if b[1] is not None)
+    except Exception as e:
+        # never leave the claim "running": release it if nothing was written (a failed bulk insert may
+        # have written part of its batch, so look), else mark it failed with what was created
+        if created == 0 and not db.production_events.find_one({"evidence_id": ev["_id"]}, {"_id": 1}):
+            db.evidence.update_one({"_id": ev["_id"]}, {"$unset": {"ingest": ""}})
+        else:
+            db.evidence.update_one({"_id": ev["_id"]}, {"$set": {"ingest.status": "failed", "ingest.error": str(e),
+                                                                 "ingest.events_created": created}})
+        if isinstance(e, ValueError):  # missing columns / undecodable file
+            return j({"error": str(e), "events_created": created}, 400)
+        raise
+
+    summary = {"status": "done", "sensor_id": sensor_id_s, "signature_scope": scope,
+               "rows_total": rows_total, "events_created": created, "events_verified": verified,
+               "rows_rejected": rows_total - created, "ingested_at": datetime.utcnow()}
+    db.evidence.update_one({"_id": ev["_id"]}, {"$set": {"ingest": summary}})
+    return j({"evidence_id": ev_id_s, **summary, "ingested_at": summary["ingested_at"].isoformat(),
+              "rejected_sample": rejected})
 
 # ---- Credits (1g) ----
-@app.post("/api/v1/credits/mint")
+@bp.post("/api/v1/credits/mint")
+@idempotency.idempotent(db, "credits_mint")
 def mint_credits():
     body = request.get_json(force=True)
     event_id = body.get("event_id")
@@ -511,6 +841,11 @@ def mint_credits():
         return j({"error": "invalid event_id"}, 400)
     if not evt: return j({"error": "event not found"}, 404)
     if not evt.get("verified"): return j({"error": "event not verified"}, 400)
+    if evt.get("minted_credit_id"):
+        return j({"error": "event already minted", "credit_id": str(evt["minted_credit_id"])}, 409)
+    legacy = db.credits.find_one({"event_id": evt["_id"]}, {"_id": 1})  # minted before the flag existed
+    if legacy:
+        return j({"error": "event already minted", "credit_id": str(legacy["_id"])}, 409)
 
     sensor = db.sensors.find_one({"_id": evt["sensor_id"]})
     if not sensor: return j({"error": "sensor not found"}, 500)
@@ -527,8 +862,15 @@ def mint_credits():
         "anchor_tx": None,
         "created_at": datetime.utcnow()
     }
-    res = db.credits.insert_one(cred)
-    credit_id = str(res.inserted_id)
+    # claim the event first so concurrent mints of the same event can't both succeed
+    cred["_id"] = ObjectId()
+    claim = db.production_events.update_one({"_id": evt["_id"], "minted_credit_id": None},
+                                             {"$set": {"minted_credit_id": cred["_id"]}})
+    if claim.modified_count != 1:
+        cur = db.production_events.find_one({"_id": evt["_id"]}, {"minted_credit_id": 1}) or {}
+        return j({"error": "event already minted", "credit_id": str(cur.get("minted_credit_id"))}, 409)
+    db.credits.insert_one(cred)
+    credit_id = str(cred["_id"])
 
     th = ledger_append("mint", {"credit_id": credit_id, "event_id": event_id, "amount_g": amount_g,
                                 "owner_account_id": str(producer_id)})
@@ -536,8 +878,36 @@ def mint_credits():
     return j({"credit_id": credit_id, "amount_g": amount_g, "owner_account_id": str(producer_id),
               "status": "pending", "tx_hash": th})
 
-@app.get("/api/v1/accounts/<account_id>/balance")
+@bp.post("/api/v1/credits/mint_bulk")
+@idempotency.idempotent(db, "credits_mint_bulk")
+def mint_credits_bulk():
+    """
+    Mints every verified, unminted event matching the body (see bulk_mint.py), oldest first.
+    Body: { event_ids: [...] } or { producer_id | sensor_id | electrolyzer_id, limit }
+    """
+    body = request.get_json(force=True, silent=True) or {}
+    try:
+        limit = int(body.get("limit") or bulk_mint.MAX_PER_REQUEST)
+        event_ids = [ObjectId(e) for e in body["event_ids"]] if body.get("event_ids") is not None else None
+        producer_id = ObjectId(body["producer_id"]) if body.get("producer_id") else None
+        sensor_id = ObjectId(body["sensor_id"]) if body.get("sensor_id") else None
+    except Exception:
+        return j({"error": "invalid id(s) or limit"}, 400)
+    if limit <= 0 or limit > bulk_mint.MAX_PER_REQUEST or len(event_ids or ()) > bulk_mint.MAX_PER_REQUEST:
+        return j({"error": f"at most {bulk_mint.MAX_PER_REQUEST} events per request"}, 400)
+    if event_ids is None and not (producer_id or sensor_id or body.get("electrolyzer_id")):
+        return j({"error": "event_ids, producer_id, sensor_id or electrolyzer_id required"}, 400)
+
+    q = bulk_mint.unminted_query(db, producer_id, sensor_id, body.get("electrolyzer_id"), event_ids)
+    st = bulk_mint.run(db, q, limit, collect=True)
+    return j({"minted": st["minted"], "amount_g": st["amount_g"], "events_scanned": st["events"],
+              "already_minted": st["already_minted"], "no_sensor": st["no_sensor"], "status": "pending",
+              "credits": [{"event_id": str(e), "credit_id": str(c), "amount_g": g} for e, c, g in st["credits"]]})
+
+@bp.get("/api/v1/accounts/<account_id>/balance")
 def get_balance(account_id: str):
+    if request.args.get("at_block"):
+        return balance_at_block(account_id, request.args["at_block"])
     from bson import ObjectId
     try:
         acc_oid = ObjectId(account_id)
@@ -558,7 +928,57 @@ def get_balance(account_id: str):
     g = int(res[0]["g"]) if res else 0
     return j({"account_id": account_id, "balance_g": g, "balance_kg": g / 1000.0})
 
-@app.post("/api/v1/credits/transfer")
+def journal_block(ref: str):
+    """?at_block= value (block _id or seq) -> (block, None) or (None, error response)."""
+    try:
+        q = {"seq": int(ref)} if ref.isdigit() and len(ref) != 24 else {"_id": ObjectId(ref)}
+    except Exception:
+        return None, j_err("block must be a block id or seq")
+    blk = db.blocks.find_one(q, {"seq": 1, "created_at": 1})
+    if not blk:
+        return None, j_err("block not found", 404)
+    st = balance_journal.tip(db)
+    if not blk.get("seq") or not st or blk["seq"] > st["block_seq"]:
+        return None, j_err("balance journal has not reached this block yet", 409)
+    return blk, None
+
+def balance_at_block(account_id: str, ref: str):
+    # balance at the close of a block: newest journal row at or before it
+    blk, err = journal_block(ref)
+    if err:
+        return err
+    g, row = balance_journal.balance_at(db, account_id, blk["seq"])
+    return j({"account_id": account_id, "balance_g": g, "balance_kg": g / 1000.0,
+              "block_id": str(blk["_id"]), "block_seq": blk["seq"], "block_closed_at": _iso(blk.get("created_at")),
+              "changed_in_block_seq": row["block_seq"] if row else None})
+
+@bp.get("/api/v1/accounts/<account_id>/balance/history")
+def get_balance_history(account_id: str):
+    """?from_block=&to_block= (block id or seq) &after=<seq>&limit= ; one row per block the balance changed in."""
+    lo = hi = None
+    for arg in ("from_block", "to_block"):
+        if request.args.get(arg):
+            blk, err = journal_block(request.args[arg])
+            if err:
+                return err
+            lo, hi = (blk["seq"], hi) if arg == "from_block" else (lo, blk["seq"])
+    try:
+        limit = max(1, min(int(request.args.get("limit", PAGE_LIMIT_DEFAULT)), PAGE_LIMIT_MAX))
+        after = int(request.args["after"]) if request.args.get("after") else None
+    except ValueError:
+        return j_err("limit and after must be integers")
+    rows, nxt = balance_journal.history(db, account_id, lo, hi, after, limit)
+    opening = balance_journal.balance_at(db, account_id, lo - 1)[0] if lo else 0
+    entries = [{"block_id": str(r["block_id"]), "block_seq": r["block_seq"], "balance_g": r["balance_g"],
+                "delta_g": r["delta_g"], "closed_at": _iso(r.get("closed_at"))} for r in rows]
+    resp = j({"account_id": account_id, "opening_balance_g": opening, "entries": entries,
+              "next_after": nxt, "journal_tip": (balance_journal.tip(db) or {}).get("block_seq")})
+    if nxt is not None:
+        resp.headers["X-Next-After"] = str(nxt)
+    return resp
+
+@bp.post("/api/v1/credits/transfer")
+@idempotency.idempotent(db, "credits_transfer")
 def transfer_credit():
     """
     Supports partial transfer via 'amount_g'.
@@ -591,14 +1011,18 @@ def transfer_credit():
     if not verify_ed25519(from_acc["public_key_pem"], canonical.encode("utf-8"), sig_hex):
         return j({"error": "owner signature invalid"}, 400)
 
-    # Split or move whole
+    # Split or move whole; only if the credit is still as read (not merged / spent meanwhile)
     new_credit_id = None
     if amount_g == int(cred["amount_g"]):
-        db.credits.update_one({"_id": cred["_id"]}, {"$set": {"owner_account_id": to_acc["_id"]}})
+        res = db.credits.update_one(multi_credit.as_read(cred), {"$set": {"owner_account_id": to_acc["_id"]}})
+        if res.matched_count != 1:
+            return j({"error": "credit changed concurrently; re-read and retry"}, 409)
         new_credit_id = credit_id
     else:
         # reduce source, create new for receiver
-        db.credits.update_one({"_id": cred["_id"]}, {"$inc": {"amount_g": -amount_g}})
+        res = db.credits.update_one(multi_credit.as_read(cred), {"$inc": {"amount_g": -amount_g}})
+        if res.matched_count != 1:
+            return j({"error": "credit changed concurrently; re-read and retry"}, 409)
         new_doc = {
             "amount_g": amount_g, "status": cred["status"],
             "producer_account_id": cred["producer_account_id"],
@@ -613,7 +1037,7 @@ def transfer_credit():
     th = ledger_append("transfer", {**payload, "new_credit_id": new_credit_id})
     return j({"ok": True, "to_credit_id": new_credit_id, "tx_hash": th})
 
-@app.post("/api/v1/credits/retire")
+@bp.post("/api/v1/credits/retire")
 def retire_credit():
     """
     Supports partial retire via 'amount_g'.
@@ -647,32 +1071,118 @@ def retire_credit():
     if not verify_ed25519(owner["public_key_pem"], canonical.encode("utf-8"), sig_hex):
         return j({"error": "owner signature invalid"}, 400)
 
-    # Partial or full retire
+    # Partial or full retire; only if the credit is still as read (not merged / spent meanwhile)
     if amount_g == int(cred["amount_g"]):
-        db.credits.update_one({"_id": cred["_id"]}, {"$set": {"status": "retired"}})
-        retired_credit_id = credit_id
+        change = {"$set": {"status": "retired"}}
     else:
-        db.credits.update_one({"_id": cred["_id"]}, {"$inc": {"amount_g": -amount_g}})
+        change = {"$inc": {"amount_g": -amount_g}}
+    if db.credits.update_one(multi_credit.as_read(cred), change).matched_count != 1:
+        return j({"error": "credit changed concurrently; re-read and retry"}, 409)
+    if amount_g != int(cred["amount_g"]):
         # store retirement record
         db.retirements.insert_one({
             "credit_id": cred["_id"], "owner_account_id": owner["_id"],
             "amount_g": amount_g, "reason": reason, "timestamp": datetime.utcnow()
         })
-        retired_credit_id = credit_id
+    retired_credit_id = credit_id
 
     th = ledger_append("retire", payload)
     return j({"ok": True, "retired_from_credit_id": retired_credit_id, "amount_g": amount_g, "tx_hash": th})
 
+def _amount_parts(owner_id: str, amount_g: int, order: str, nonce: str):
+    """Picks the credits for an amount-based request and claims its nonce -> (parts, None) or (None, error)."""
+    multi_credit.recover(db)   # ops a crashed worker left unfinished still hold their credits
+    parts, seen = multi_credit.select(db, owner_id, amount_g, order)
+    if parts is None:
+        return None, j({"error": f"insufficient balance: {seen}g available"}, 400)
+    if len(parts) > multi_credit.MAX_PARTS:
+        return None, j({"error": f"amount spans {len(parts)} credits (max {multi_credit.MAX_PARTS}); "
+                                 f"compact fragments first (credit_compaction.py)"}, 400)
+    if not multi_credit.claim_nonce(db, owner_id, nonce):
+        return None, j({"error": "nonce already used"}, 409)
+    return parts, None
+
+@bp.post("/api/v1/credits/transfer_amount")
+@idempotency.idempotent(db, "credits_transfer_amount")
+def transfer_amount():
+    """
+    Moves amount_g from one owner to another across as many credits as needed (see multi_credit.py).
+    Body: { from_account_id, to_account_id, amount_g, nonce, order: fifo|vintage, owner_signature_hex }
+    Signature by FROM account over canonical({from_account_id,to_account_id,amount_g,nonce})
+    """
+    body = request.get_json(force=True)
+    from_id, to_id, nonce = body.get("from_account_id"), body.get("to_account_id"), body.get("nonce")
+    amount_g = int(body.get("amount_g", 0))
+    order    = body.get("order") or "fifo"
+    sig_hex  = body.get("owner_signature_hex")
+    if not all([from_id, to_id, amount_g, nonce, sig_hex]):
+        return j({"error": "from_account_id, to_account_id, amount_g, nonce, owner_signature_hex required"}, 400)
+    if amount_g <= 0: return j({"error": "invalid amount_g"}, 400)
+    if order not in multi_credit.ORDERS: return j({"error": f"order must be one of {', '.join(multi_credit.ORDERS)}"}, 400)
+    try:
+        from_acc = db.accounts.find_one({"_id": ObjectId(from_id)})
+        to_acc   = db.accounts.find_one({"_id": ObjectId(to_id)})
+    except Exception:
+        return j({"error": "invalid id(s)"}, 400)
+    if not from_acc or not to_acc: return j({"error": "account(s) not found"}, 404)
+
+    signed = {"from_account_id": from_id, "to_account_id": to_id, "amount_g": amount_g, "nonce": nonce}
+    if not verify_ed25519(from_acc["public_key_pem"], canonical_json(signed).encode("utf-8"), sig_hex):
+        return j({"error": "owner signature invalid"}, 400)
+
+    parts, err = _amount_parts(from_id, amount_g, order, nonce)
+    if err: return err
+    op = multi_credit.plan_transfer(parts, to_acc["_id"], signed, order, f"{from_id}:{nonce}")
+    if not multi_credit.run(db, op):
+        return j({"error": "credits changed concurrently; retry"}, 409)
+    return j({"ok": True, "amount_g": amount_g, "parts": op["out"], "tx_hash": op["ledger"]["tx_hash"]})
+
+@bp.post("/api/v1/credits/retire_amount")
+@idempotency.idempotent(db, "credits_retire_amount")
+def retire_amount():
+    """
+    Retires amount_g of one owner's credits across as many credits as needed (see multi_credit.py).
+    Body: { owner_account_id, amount_g, reason, nonce, order: fifo|vintage, owner_signature_hex }
+    Signature by OWNER over canonical({owner_account_id,amount_g,reason,nonce})
+    """
+    body = request.get_json(force=True)
+    owner_id, nonce = body.get("owner_account_id"), body.get("nonce")
+    amount_g = int(body.get("amount_g", 0))
+    reason   = body.get("reason") or ""
+    order    = body.get("order") or "fifo"
+    sig_hex  = body.get("owner_signature_hex")
+    if not all([owner_id, amount_g, nonce, sig_hex]):
+        return j({"error": "owner_account_id, amount_g, nonce, owner_signature_hex required"}, 400)
+    if amount_g <= 0: return j({"error": "invalid amount_g"}, 400)
+    if order not in multi_credit.ORDERS: return j({"error": f"order must be one of {', '.join(multi_credit.ORDERS)}"}, 400)
+    try:
+        owner = db.accounts.find_one({"_id": ObjectId(owner_id)})
+    except Exception:
+        return j({"error": "invalid id(s)"}, 400)
+    if not owner: return j({"error": "owner account not found"}, 404)
+
+    signed = {"owner_account_id": owner_id, "amount_g": amount_g, "reason": reason, "nonce": nonce}
+    if not verify_ed25519(owner["public_key_pem"], canonical_json(signed).encode("utf-8"), sig_hex):
+        return j({"error": "owner signature invalid"}, 400)
+
+    parts, err = _amount_parts(owner_id, amount_g, order, nonce)
+    if err: return err
+    op = multi_credit.plan_retire(parts, owner["_id"], signed, order, f"{owner_id}:{nonce}")
+    if not multi_credit.run(db, op):
+        return j({"error": "credits changed concurrently; retry"}, 409)
+    return j({"ok": True, "amount_g": amount_g, "parts": op["out"], "tx_hash": op["ledger"]["tx_hash"]})
+
 # ---- Ledger / Blocks ----
-@app.post("/api/v1/blocks/close")
+@bp.post("/api/v1/blocks/close")
 def blocks_close():
     body = request.get_json(silent=True) or {}
     note = body.get("note")
-    res = close_block(note)
+    # under asgi.py the block was closed (and anchored) off-thread already
+    res = request.environ.get("registry.close_result") or close_block(note)
     if "error" in res: return j(res, 400)
     return j(res)
 
-@app.get("/api/v1/blocks/latest")
+@bp.get("/api/v1/blocks/latest")
 def blocks_latest():
     blk = db.blocks.find_one(sort=[("_id", -1)])
     if not blk: return j({"error": "no blocks yet"}, 404)
@@ -690,34 +1200,24 @@ def blocks_latest():
     })
 
 # ---- Optional Anchor to chain ----
-@app.post("/api/v1/blocks/<block_id>/anchor")
-def anchor_block(block_id):
-    if not (WEB3_RPC_URL and REG_PK and ANCHOR_ADDR):
-        return j({"error": "chain env missing (WEB3_RPC_URL, REGISTRY_PRIVATE_KEY, ANCHOR_CONTRACT_ADDRESS)"}, 400)
-    from web3 import Web3
-    w3 = Web3(Web3.HTTPProvider(WEB3_RPC_URL))
-
+def anchor_target(block_id: str):
+    """(block, None) if block_id can be anchored, else (None, (error_body, status))."""
     try:
         blk = db.blocks.find_one({"_id": ObjectId(block_id)})
     except Exception:
-        return j({"error": "invalid block_id"}, 400)
+        return None, ({"error": "invalid block_id"}, 400)
     if not blk:
-        return j({"error": "block not found"}, 404)
+        return None, ({"error": "block not found"}, 404)
     if blk.get("anchor_tx"):
-        return j({"error": "already anchored", "anchor_tx": blk["anchor_tx"]}, 400)
+        return None, ({"error": "already anchored", "anchor_tx": blk["anchor_tx"]}, 400)
+    return blk, None
 
+def send_block_anchor(onchain_block_id: int, root_hex: str) -> str:
+    from web3 import Web3
+    w3 = Web3(Web3.HTTPProvider(WEB3_RPC_URL))
     acct = w3.eth.account.from_key(REG_PK)
-    abi = [{
-      "inputs":[{"internalType":"uint256","name":"blockId","type":"uint256"},
-                {"internalType":"bytes32","name":"root","type":"bytes32"}],
-      "name":"anchor","outputs":[{"internalType":"bool","name":"","type":"bool"}],
-      "stateMutability":"nonpayable","type":"function"
-    }]
-    contract = w3.eth.contract(address=Web3.to_checksum_address(ANCHOR_ADDR), abi=abi)
-
-    onchain_block_id = int(blk.get("onchain_block_id") or derive_onchain_block_id(block_id))
-    root_bytes = w3.to_bytes(hexstr=blk["merkle_root"])
-    txn = contract.functions.anchor(onchain_block_id, root_bytes).build_transaction({
+    contract = w3.eth.contract(address=Web3.to_checksum_address(ANCHOR_ADDR), abi=ANCHOR_ABI)
+    txn = contract.functions.anchor(onchain_block_id, w3.to_bytes(hexstr=root_hex)).build_transaction({
         "from": acct.address,
         "nonce": w3.eth.get_transaction_count(acct.address),
         "gas": 200000,
@@ -726,7 +1226,26 @@ def anchor_block(block_id):
         "chainId": w3.eth.chain_id
     })
     signed = w3.eth.account.sign_transaction(txn, REG_PK)
-    txh = w3.eth.send_raw_transaction(_signed_raw_bytes(signed)).hex()
+    return w3.eth.send_raw_transaction(_signed_raw_bytes(signed)).hex()
+
+@bp.post("/api/v1/blocks/<block_id>/anchor")
+def anchor_block(block_id):
+    if not chain_configured():
+        return j({"error": "chain env missing (WEB3_RPC_URL, REGISTRY_PRIVATE_KEY, ANCHOR_CONTRACT_ADDRESS)"}, 400)
+    blk, err = anchor_target(block_id)
+    if err:
+        return j(*err)
+
+    onchain_block_id = int(blk.get("onchain_block_id") or derive_onchain_block_id(block_id))
+    # under asgi.py the tx was already sent on the event loop
+    sent = request.environ.get("registry.anchor_tx")
+    if isinstance(sent, Exception):
+        raise sent
+    if sent is not None:
+        txh = sent
+    else:
+        with metrics.timer("anchor_send"):
+            txh = send_block_anchor(onchain_block_id, blk["merkle_root"])
 
     db.blocks.update_one({"_id": blk["_id"]}, {"$set": {"anchor_tx": txh}})
     minted_in_block = db.ledger_txs.find({"block_id": blk["_id"], "type": "mint"})
@@ -742,6 +1261,7 @@ from flask import abort
 import math
 
 # helper: recompute merkle root for txs in a block
+@metrics.timed("merkle_root")
 def compute_merkle_root(tx_hashes):
     if not tx_hashes:
         return None
@@ -757,6 +1277,7 @@ def compute_merkle_root(tx_hashes):
     return layer[0]
 
 # helper: build merkle proof for a tx
+@metrics.timed("merkle_proof")
 def build_merkle_proof(tx_hashes, target):
     if target not in tx_hashes:
         return None
@@ -778,64 +1299,152 @@ def build_merkle_proof(tx_hashes, target):
         layer = nxt
     return proof
 
-@app.get("/api/v1/blocks/<block_id>")
+# ---- closed-block resources: strong ETag + LRU (see http_cache.py) ----
+BLOCK_CACHE = http_cache.LRUCache()
+
+def serve_block_cached(kind: str, key: str, build):
+    """
+    build() -> (payload, block_oid, anchor_tx, complete) or an error response.
+    Only complete blocks (every tx attached) are cached/ETagged; unanchored hits are
+    revalidated with a projected point read since anchoring may still set anchor_tx.
+    """
+    ent = BLOCK_CACHE.get((kind, key))
+    if ent is not None and not ent.immutable:
+        cur = db.blocks.find_one({"_id": ent.block_id}, {"anchor_tx": 1})
+        if cur is None or cur.get("anchor_tx") != ent.anchor_tx:
+            BLOCK_CACHE.pop((kind, key))
+            ent = None
+    if ent is not None:
+        http_cache.CACHE_EVENTS.inc(kind, "hit")
+        return http_cache.respond(ent, request)
+
+    http_cache.CACHE_EVENTS.inc(kind, "miss")
+    out = build()
+    if not isinstance(out, tuple) or len(out) != 4:
+        return out
+    payload, block_oid, anchor_tx, complete = out
+    if not complete:
+        return j(payload)
+    ent = http_cache.Entry(http_cache.etag_for(kind, key, block_oid, anchor_tx), json_dumps(payload), block_oid, anchor_tx)
+    BLOCK_CACHE.put((kind, key), ent)
+    return http_cache.respond(ent, request)
+
+def _block_txs(block_oid) -> list:
+    return list(db.ledger_txs.find({"block_id": block_oid}, {"tx_hash": 1, "type": 1}).sort("created_at", 1))
+
+@bp.get("/api/v1/blocks/<block_id>")
 def get_block(block_id):
-    block = db.blocks.find_one({"_id": ObjectId(block_id)})
-    if not block:
-        return j({"error": "block not found"}), 404
-    block["id"] = str(block["_id"])
-    block.pop("_id")
-    return j(block)
-
-@app.get("/api/v1/blocks/<block_id>/txs")
+    def build():
+        block = db.blocks.find_one({"_id": ObjectId(block_id)})
+        if not block:
+            return j({"error": "block not found"}), 404
+        oid = block.pop("_id")
+        block["id"] = str(oid)
+        # onchain_block_id is written right after the block insert in close_block()
+        return block, oid, block.get("anchor_tx"), "onchain_block_id" in block
+    return serve_block_cached("block", block_id, build)
+
+@bp.get("/api/v1/blocks/<block_id>/txs")
 def get_block_txs(block_id):
-    blk = db.blocks.find_one({"_id": ObjectId(block_id)})
-    if not blk:
-        return j({"error": "block not found"}), 404
-
-    txs = list(db.ledger_txs.find({"block_id": ObjectId(block_id)}).sort("created_at", 1))
-    out = [{"tx_hash": t["tx_hash"], "type": t.get("type","")} for t in txs]
-    return j({
-        "block_id": block_id,
-        "order": "created_at_asc",
-        "hash_algo": "sha256",
-        "merkle_concat": "left||right, duplicate last if odd",
-        "txs": out
-    })
-
-
-@app.get("/api/v1/proof/tx/<tx_hash>")
+    def build():
+        blk = db.blocks.find_one({"_id": ObjectId(block_id)}, {"anchor_tx": 1, "tx_count": 1})
+        if not blk:
+            return j({"error": "block not found"}), 404
+
+        txs = _block_txs(blk["_id"])
+        out = [{"tx_hash": t["tx_hash"], "type": t.get("type","")} for t in txs]
+        return {
+            "block_id": block_id,
+            "order": "created_at_asc",
+            "hash_algo": "sha256",
+            "merkle_concat": "left||right, duplicate last if odd",
+            "txs": out
+        }, blk["_id"], blk.get("anchor_tx"), len(txs) == blk.get("tx_count")
+    return serve_block_cached("block_txs", block_id, build)
+
+
+@bp.get("/api/v1/proof/tx/<tx_hash>")
 def get_tx_proof(tx_hash):
-    tx = db.ledger_txs.find_one({"tx_hash": tx_hash})
-    if not tx:
-        return j({"error": "tx not found"}), 404
-    block_id = tx["block_id"]
-    block = db.blocks.find_one({"_id": ObjectId(block_id)})
-    if not block:
-        return j({"error": "block not found"}), 404
-
-    txs = list(db.ledger_txs.find({"block_id": block_id}).sort("created_at", 1))
-    tx_hashes = [t["tx_hash"] for t in txs]
-    proof = build_merkle_proof(tx_hashes, tx_hash)
-    root = compute_merkle_root(tx_hashes)
+    def build():
+        tx = db.ledger_txs.find_one({"tx_hash": tx_hash}, {"block_id": 1})
+        if not tx:
+            return j({"error": "tx not found"}), 404
+        block_id = tx.get("block_id")
+        block = db.blocks.find_one({"_id": ObjectId(block_id)})
+        if not block:
+            return j({"error": "block not found"}), 404
+
+        txs = _block_txs(block_id)
+        tx_hashes = [t["tx_hash"] for t in txs]
+        proof = build_merkle_proof(tx_hashes, tx_hash)
+        root = compute_merkle_root(tx_hashes)
+
+        return {
+            "block_id": block_id,
+            "onchain_block_id": block.get("onchain_block_id"),
+            "tx_hash": tx_hash,
+            "index": tx_hashes.index(tx_hash),
+            "hashes_count": len(tx_hashes),
+            "proof": proof,
+            "merkle_root": root,
+            "anchor_tx": block.get("anchor_tx"),
+            "contract_address": block.get("contract_address"),
+            "chain": block.get("chain", "sepolia")
+        }, block_id, block.get("anchor_tx"), len(txs) == block.get("tx_count")
+    return serve_block_cached("proof_tx", tx_hash, build)
+
+
+@bp.post("/api/v1/proof/bundle")
+def proof_bundle_export():
+    # many tx inclusion proofs + one SMT proof in one binary file; verify with bundle_verifier.py
+    body = request.get_json(force=True, silent=True) or {}
+    tx_hashes = body.get("tx_hashes") or []
+    account_ids = body.get("account_ids") or []
+    if not isinstance(tx_hashes, list) or not isinstance(account_ids, list):
+        return j({"error": "tx_hashes and account_ids must be lists"}, 400)
+    if not tx_hashes and not account_ids:
+        return j({"error": "tx_hashes or account_ids required"}, 400)
+    if len(tx_hashes) > proof_bundle.MAX_TXS or len(account_ids) > proof_bundle.MAX_ACCOUNTS:
+        return j({"error": f"at most {proof_bundle.MAX_TXS} tx_hashes and {proof_bundle.MAX_ACCOUNTS} account_ids"}, 400)
+    by_block, missing, pending = proof_bundle.locate(db, [str(h) for h in tx_hashes])
+    if missing:
+        return j({"error": "tx not found", "missing": missing[:100]}, 404)
+    if pending:
+        return j({"error": "tx not in a closed block yet", "pending": pending[:100]}, 409)
+    data = proof_bundle.build(db, by_block, [str(a) for a in account_ids],
+                              _fetch_balances() if account_ids else None, ANCHOR_ADDR)
+    return Response(data, mimetype=proof_bundle.MIMETYPE,
+                    headers={"Content-Disposition": 'attachment; filename="proof_bundle.h2pb"'})
+
+@bp.get("/api/v1/anchors/<root_hex>")
+def anchor_lookup(root_hex):
+    # answered from the local Anchored-log index (anchor_indexer.py), no RPC call;
+    # "anchored": false only holds up to the indexed height reported in "indexed_to"
+    root = _norm0x(root_hex)
+    if len(root) != 64 or any(c not in "0123456789abcdef" for c in root):
+        return j({"error": "root must be 32 bytes hex"}, 400)
+    events = anchor_indexer.find_root(db, root)
+    ids = [e["onchain_block_id"] for e in events]
+    blocks = {b["onchain_block_id"]: b for b in db.blocks.find({"onchain_block_id": {"$in": ids}},
+                                                                 {"onchain_block_id": 1, "merkle_root": 1})}
+    out = []
+    for e in events:
+        blk = blocks.get(e["onchain_block_id"])
+        out.append({
+            "contract_address": e["contract"],
+            "onchain_block_id": e["onchain_block_id"],
+            "block_id": str(blk["_id"]) if blk else None,
+            "matches_block_root": bool(blk) and blk.get("merkle_root") == root,
+            "caller": e["caller"],
+            "tx_hash": e["tx_hash"],
+            "chain_block_number": e["block_number"],
+        })
+    indexed_to = {s["_id"]: s.get("last_block") for s in db[anchor_indexer.STATE].find()}
+    return j({"root": root, "anchored": bool(out), "events": out, "indexed_to": indexed_to})
+
 
-    return j({
-        "block_id": block_id,
-        "onchain_block_id": block.get("onchain_block_id"),
-        "tx_hash": tx_hash,
-        "index": tx_hashes.index(tx_hash),
-        "hashes_count": len(tx_hashes),
-        "proof": proof,
-        "merkle_root": root,
-        "anchor_tx": block.get("anchor_tx"),
-        "contract_address": block.get("contract_address"),
-        "chain": block.get("chain", "sepolia")
-    })
-    
-    
-    
 ############## account balance proof
-@app.get("/api/v2/state/root")
+@bp.get("/api/v2/state/root")
 def v2_state_root():
     balances = _fetch_balances()  # :contentReference[oaicite:5]{index=5}
     root_hex = build_state_root(balances)  # "0x..." :contentReference[oaicite:6]{index=6}
@@ -849,7 +1458,7 @@ def v2_state_root():
         "created_at": datetime.utcnow().isoformat() + "Z"
     })
 
-@app.get("/api/v2/state/proof/<account_id>")
+@bp.get("/api/v2/state/proof/<account_id>")
 def v2_state_proof(account_id):
     balances = _fetch_balances()
     leaf_hex, proof, root_hex = prove_account(balances, account_id)  # :contentReference[oaicite:7]{index=7}
@@ -862,7 +1471,7 @@ def v2_state_proof(account_id):
         "state_root": root_hex,
         "local_verify_ok": ok_local
     })
-@app.get("/api/v2/state/proof/<account_id>/compressed")
+@bp.get("/api/v2/state/proof/<account_id>/compressed")
 def v2_state_proof_compressed(account_id):
     balances = _fetch_balances()
     leaf_hex, proof, root_hex = prove_account(balances, account_id)
@@ -884,8 +1493,9 @@ def v2_state_proof_compressed(account_id):
 
 
 ###############################     phase 3 market phase
-@app.post("/api/v1/market/offers")
+@bp.post("/api/v1/market/offers")
 def market_create_offer():
+    # a limit sell order: reserves the credit, then matches resting bids (order_book.py) before it rests
     data = request.get_json(force=True, silent=True) or {}
     producer_id = data.get("producer_id")     # stringified account _id
     credit_id   = data.get("credit_id")       # stringified credit _id
@@ -894,71 +1504,39 @@ def market_create_offer():
 
     if not producer_id or not credit_id or amount_g <= 0 or price_per_g <= 0:
         return j_err("producer_id, credit_id, amount_g>0, price_per_g>0 required")
+    try:
+        offer_doc, res = order_book.engine(db).sell(producer_id, credit_id, amount_g, price_per_g)
+    except order_book.OrderError as e:
+        return j_err(str(e), e.code)
 
-    credit = db.credits.find_one({"_id": ObjectId(credit_id)})
-    if not credit:
-        return j_err("credit not found", 404)
-
-    if str(credit.get("owner_account_id")) != producer_id:
-        return j_err("not credit owner", 403)
-
-    status = credit.get("status")
-    if status in ["retired", "pending"]:
-        return j_err(f"credit status not sellable: {status}")
-
-    locked   = int(credit.get("locked_g", 0))
-    available= int(credit.get("amount_g", 0)) - locked
-    if amount_g > available:
-        return j_err(f"insufficient available: {available}g")
-
-    # atomic reservation (prevent oversell)
-    res = db.credits.update_one(
-        {
-            "_id": credit["_id"],
-            "$or": [{"locked_g": locked}, {"locked_g": {"$exists": False}}]
-        },
-        {"$set": {"locked_g": locked + amount_g}}
-    )
-    if res.modified_count != 1:
-        return j_err("reservation failed (concurrent change)")
-
-    offer_doc = {
-        "producer_id": producer_id,
-        "credit_id": credit_id,
-        "amount_g": int(amount_g),
-        "price_per_g": float(price_per_g),
-        "created_at": datetime.now(timezone.utc),
-        "status": "open"
-    }
-    ins = db.market_offers.insert_one(offer_doc)
-
-    # optional: append to ledger_txs so it’s included in the next block root
-    ledger_append("market_list", {
-        "offer_id": str(ins.inserted_id),
-        "producer_id": producer_id,
-        "credit_id": credit_id,
-        "amount_g": int(amount_g),
-        "price_per_g": float(price_per_g)
-    })
-
-    out = {**offer_doc, "id": str(ins.inserted_id)}
+    out = {**offer_doc, "id": str(offer_doc["_id"]), "trades": res["trades"]}
     return j_ok(out, 201)
 
-@app.get("/api/v1/market/offers")
+OFFER_FIELDS = {k: [k] for k in ("_id", "producer_id", "credit_id", "amount_g", "price_per_g", "created_at", "status")}
+
+@bp.get("/api/v1/market/offers")
 def market_list_offers():
-    q = {"status": "open"}
+    """?status=open|closed|all&producer_id=&credit_id=&from=&to=&after=&limit=&fields="""
+    try:
+        after, limit, projection, keep = page_args(OFFER_FIELDS)
+        q = time_range_arg({}, "created_at")
+    except ValueError as e:
+        return j_err(str(e))
+    status = request.args.get("status", "open")
+    if status != "all": q["status"] = status
     producer_id = request.args.get("producer_id")
     credit_id   = request.args.get("credit_id")
     if producer_id: q["producer_id"] = producer_id
     if credit_id:   q["credit_id"] = credit_id
-    offers = list(db.market_offers.find(q).sort("created_at", -1))
-    return j_ok({"offers": offers})
-@app.get("/api/v1/market/offers/<offer_id>")
+    offers, nxt = keyset_page(db.market_offers, q, after, limit, projection)
+    return paged(offers, nxt, keep, wrap="offers")
+@bp.get("/api/v1/market/offers/<offer_id>")
 def market_get_offer(offer_id):
     o = db.market_offers.find_one({"_id": ObjectId(offer_id)})
     if not o: return j_err("offer not found", 404)
     return j_ok(o)
-@app.post("/api/v1/market/buy")
+@bp.post("/api/v1/market/buy")
+@idempotency.idempotent(db, "market_buy")
 def market_buy():
     data = request.get_json(force=True, silent=True) or {}
     buyer_id = data.get("buyer_id")
@@ -967,91 +1545,240 @@ def market_buy():
 
     if not buyer_id or not offer_id or amount_g <= 0:
         return j_err("buyer_id, offer_id, amount_g>0 required")
+    try:
+        offer_oid = ObjectId(offer_id)
+    except Exception:
+        return j_err("invalid offer_id")
+    # same settlement as a matched order, under the engine lock so the book sees the fill
+    try:
+        res = order_book.engine(db).take(offer_oid, buyer_id, amount_g)
+    except order_book.OrderError as e:
+        return j_err(str(e), e.code)
+    return j_ok(res, 201)
+
+@bp.post("/api/v1/market/orders")
+@idempotency.idempotent(db, "market_orders")
+def market_submit_order():
+    """
+    Price-time priority matching (see order_book.py).
+    Body: { side: buy|sell, type: limit|market, account_id, amount_g, price_per_g (limit), credit_id (sell) }
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    side, typ = data.get("side"), data.get("type") or "limit"
+    account_id = data.get("account_id")
+    try:
+        amount_g = int(data.get("amount_g", 0))
+        price = float(data["price_per_g"]) if typ == "limit" and data.get("price_per_g") is not None else None
+    except (TypeError, ValueError):
+        return j_err("amount_g and price_per_g must be numbers")
+    if side not in order_book.SIDES or typ not in order_book.TYPES:
+        return j_err("side must be buy|sell and type limit|market")
+    if not account_id or amount_g <= 0 or (typ == "limit" and not (price and price > 0)):
+        return j_err("account_id, amount_g>0 and (for limit orders) price_per_g>0 required")
+    if side == "sell" and not data.get("credit_id"):
+        return j_err("credit_id required for sell orders")
+    try:
+        if not db.accounts.find_one({"_id": ObjectId(account_id)}, {"_id": 1}):
+            return j_err("account not found", 404)
+    except Exception:
+        return j_err("invalid account_id")
 
-    offer = db.market_offers.find_one({"_id": ObjectId(offer_id)})
-    if not offer:
-        return j_err("offer not found", 404)
-    if offer.get("status") != "open":
-        return j_err("offer closed")
-
-    if amount_g > int(offer["amount_g"]):
-        return j_err(f"exceeds available in offer: {offer['amount_g']}g")
-
-    credit = db.credits.find_one({"_id": ObjectId(offer["credit_id"])})
-    if not credit:
-        return j_err("linked credit missing", 404)
-
-    # atomic decrement of amount and lock
-    upd = db.credits.update_one(
-        {
-            "_id": credit["_id"],
-            "amount_g": {"$gte": amount_g},
-            "$or": [
-                {"locked_g": {"$exists": False}},
-                {"locked_g": {"$gte": amount_g}}
-            ]
-        },
-        {"$inc": {"amount_g": -amount_g, "locked_g": -amount_g}}
-    )
-    if upd.modified_count != 1:
-        return j_err("not enough locked or amount changed concurrently")
-
-    # issue buyer credit
-    buyer_credit = {
-        "amount_g": int(amount_g),
-        "owner_account_id": ObjectId(buyer_id),   # <-- ObjectId to match schema
-        "status": "issued",
-        "from_offer": offer_id,
-        "source_credit_id": str(credit["_id"]),
-        "created_at": datetime.now(timezone.utc)
-    }
-    buyer_credit_id = db.credits.insert_one(buyer_credit).inserted_id
-
-    # adjust or close offer
-    offer_left = int(offer["amount_g"]) - amount_g
-    new_status = "closed" if offer_left == 0 else "open"
-    db.market_offers.update_one(
-        {"_id": offer["_id"]},
-        {"$set": {"amount_g": offer_left, "status": new_status}}
-    )
+    eng = order_book.engine(db)
+    try:
+        if side == "buy":
+            res = eng.buy(account_id, amount_g, price)
+        else:
+            res = eng.sell(account_id, data["credit_id"], amount_g, price)[1]
+    except order_book.OrderError as e:
+        return j_err(str(e), e.code)
+    return j_ok({**res, "type": typ}, 201)
+
+@bp.delete("/api/v1/market/orders/<order_id>")
+def market_cancel_order(order_id):
+    """?account_id= (owner of the bid / offer); releases a sell order's reservation."""
+    account_id = request.args.get("account_id") or (request.get_json(silent=True) or {}).get("account_id")
+    if not account_id:
+        return j_err("account_id required")
+    try:
+        oid = ObjectId(order_id)
+    except Exception:
+        return j_err("invalid order id")
+    try:
+        return j_ok(order_book.engine(db).cancel(oid, account_id))
+    except order_book.OrderError as e:
+        return j_err(str(e), e.code)
 
-    # append to ledger so buy hits the next block root
-    ledger_append("market_buy", {
-        "buyer_id": buyer_id,
-        "producer_id": offer["producer_id"],
-        "offer_id": offer_id,
-        "new_credit_id": str(buyer_credit_id),
-        "amount_g": int(amount_g),
-        "price_per_g": float(offer["price_per_g"])
-    })
+@bp.get("/api/v1/market/book")
+def market_book():
+    """?depth=N price levels per side, best first (aggregated amount_g and order count per price)."""
+    try:
+        depth = max(1, min(int(request.args.get("depth", 20)), 500))
+    except ValueError:
+        return j_err("depth must be an integer")
+    return j(order_book.engine(db).depth(depth))
 
-    return j_ok({
-        "ok": True,
-        "new_credit_id": str(buyer_credit_id),
-        "offer_left": offer_left,
-        "offer_status": new_status
-    }, 201)
-@app.get("/api/v1/reports/retirements")
-def report_retirements():
+TRADE_FIELDS = {k: [k] for k in ("_id", "offer_id", "bid_id", "buyer_id", "seller_id", "credit_id", "new_credit_id",
+                                 "amount_g", "price_per_g", "taker", "created_at")}
+
+@bp.get("/api/v1/market/trades")
+def market_list_trades():
+    """?offer_id=&bid_id=&from=&to=&after=&limit=&fields= (newest first)"""
+    try:
+        after, limit, projection, keep = page_args(TRADE_FIELDS)
+        q = time_range_arg({}, "created_at")
+    except ValueError as e:
+        return j_err(str(e))
+    for k in ("offer_id", "bid_id"):
+        if request.args.get(k):
+            q[k] = request.args[k]
+    trades, nxt = keyset_page(db[order_book.TRADES], q, after, limit, projection)
+    return paged(trades, nxt, keep, wrap="trades")
+
+RETIREMENT_FIELDS = {"credit_id": ["payload.credit_id"], "parts": ["payload.parts"],
+                     "owner_account_id": ["payload.owner_account_id"], "amount_g": ["payload.amount_g"],
+                     "reason": ["payload.reason"], "tx_hash": ["tx_hash"], "block_id": ["block_id"], "anchored": ["anchored"], "timestamp": ["created_at"]}
+
+def retirement_query() -> dict:
     # from Phase-1 you already record retire txs in ledger_txs
-    cur = db.ledger_txs.find({"type": "retire"}).sort("created_at", -1)
+    q = time_range_arg({"type": {"$in": ["retire", "multi_retire"]}}, "created_at")
+    if request.args.get("owner_account_id"):
+        q["payload.owner_account_id"] = request.args["owner_account_id"]
+    if request.args.get("credit_id"):
+        q["$or"] = [{"payload.credit_id": request.args["credit_id"]}, {"payload.parts.credit_id": request.args["credit_id"]}]
+    return q
+
+def retirement_public(r: dict) -> dict:
+    p = r.get("payload", {})
+    return {
+        "credit_id": p.get("credit_id"),
+        "parts": p.get("parts"),         # multi_retire: [{credit_id, amount_g}] instead of one credit_id
+        "owner_account_id": p.get("owner_account_id"),
+        "amount_g": p.get("amount_g"),
+        "reason": p.get("reason"),
+        "tx_hash": r.get("tx_hash"),
+        "block_id": str(r.get("block_id", "")),
+        "anchored": bool(r.get("anchored", False)),
+        "timestamp": to_public(r.get("created_at"))
+    }
 
-    out = []
-    for r in cur:
-        p = r.get("payload", {})
-        out.append({
-            "credit_id": p.get("credit_id"),
-            "owner_account_id": p.get("owner_account_id"),
-            "amount_g": p.get("amount_g"),
-            "reason": p.get("reason"),
-            "tx_hash": r.get("tx_hash"),
-            "block_id": str(r.get("block_id", "")),
-            "anchored": bool(r.get("anchored", False)),
-            "timestamp": to_public(r.get("created_at"))
-        })
-    return j_ok({"retirements": out})
+@bp.get("/api/v1/reports/retirements")
+def report_retirements():
+    """?owner_account_id=&credit_id=&from=&to=&after=&limit=&fields="""
+    try:
+        after, limit, projection, keep = page_args(RETIREMENT_FIELDS)
+        q = retirement_query()
+    except ValueError as e:
+        return j_err(str(e))
+    docs, nxt = keyset_page(db.ledger_txs, q, after, limit, projection)
+    return paged([retirement_public(r) for r in docs], nxt, keep, wrap="retirements")
+
+###############################     bulk exports (NDJSON, streamed)
+def ledger_query() -> dict:
+    q = time_range_arg({}, "created_at")
+    if request.args.get("type"):
+        q["type"] = request.args["type"]
+    if request.args.get("block_id"):
+        try:
+            q["block_id"] = ObjectId(request.args["block_id"])
+        except Exception:
+            raise ValueError("invalid block_id")
+    return q
+
+def ledger_tx_public(t: dict) -> dict:
+    return {
+        "id": str(t["_id"]), "type": t.get("type"), "payload": t.get("payload"),
+        "tx_hash": t.get("tx_hash"), "block_id": _sid(t.get("block_id")),
+        "anchored": bool(t.get("anchored", False)), "anchor_tx": t.get("anchor_tx"),
+        "created_at": to_public(t.get("created_at"))
+    }
+
+def ndjson_export(coll, q: dict, fmt):
+    """
+    Stream one JSON document per line straight off a Mongo cursor (oldest first).
+    ?after=<_id> resumes an interrupted dump; memory is one batch regardless of size.
+    """
+    after = request.args.get("after")
+    if after:
+        try:
+            q = {**q, "_id": {"$gt": ObjectId(after)}}
+        except Exception:
+            return j_err("invalid after cursor")
+    cursor = coll.find(q).sort("_id", 1).batch_size(EXPORT_BATCH)
+
+    def gen():
+        try:
+            it = iter(cursor)
+            first = next(it, None)
+            if first is None:
+                return
+            # first line goes out on its own so time-to-first-byte stays low
+            yield json_dumps(fmt(first)) + b"\n"
+            buf = []
+            for doc in it:
+                buf.append(json_dumps(fmt(doc)))
+                if len(buf) >= EXPORT_FLUSH_LINES:
+                    yield b"\n".join(buf) + b"\n"
+                    buf = []
+            if buf:
+                yield b"\n".join(buf) + b"\n"
+        finally:
+            cursor.close()
+    return Response(gen(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+@bp.get("/api/v1/export/events.ndjson")
+def export_events():
+    try:
+        q = event_query()
+    except ValueError as e:
+        return j_err(str(e))
+    return ndjson_export(db.production_events, q, event_public)
+
+@bp.get("/api/v1/export/ledger_txs.ndjson")
+def export_ledger_txs():
+    """?type=&block_id=&from=&to=&after="""
+    try:
+        q = ledger_query()
+    except ValueError as e:
+        return j_err(str(e))
+    return ndjson_export(db.ledger_txs, q, ledger_tx_public)
+
+@bp.get("/api/v1/export/retirements.ndjson")
+def export_retirements():
+    try:
+        q = retirement_query()
+    except ValueError as e:
+        return j_err(str(e))
+    return ndjson_export(db.ledger_txs, q, lambda r: {"id": str(r["_id"]), **retirement_public(r)})
+
+###############################     app factory
+def create_app() -> Flask:
+    """Build a configured app. Cheap: no Mongo connection, no web3 import until used."""
+    app = Flask(__name__)
+    CORS(app)
+    metrics.init_app(app)    # per-route latency, per-request Mongo tally, GET /metrics
+    profiling.init_app(app)  # PROFILE_SAMPLE_N / X-Profile -> cProfile dumps under PROFILE_DIR
+    app.register_blueprint(bp)
+    app.register_blueprint(bp_keys)
+
+    @app.cli.command("init-indexes")
+    def init_indexes_cmd():
+        """Create/verify all Mongo indexes."""
+        for name in ensure_indexes():
+            print("✔", name)
+
+    return app
+
+# module-level app for `gunicorn app:app` and existing imports
+app = create_app()
 
 if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["init-indexes"]:
+        for name in ensure_indexes():
+            print("✔", name)
+        sys.exit(0)
+    ensure_indexes()  # dev server keeps the old "just run it" behaviour
     app.run(debug=True, host="0.0.0.0", port=5000)
 
 
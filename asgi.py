@@ -0,0 +1,227 @@
+# asgi.py
+# Async serving mode: the same registry routes behind an ASGI server.
+#
+#   pip install uvicorn
+#   uvicorn asgi:app --workers 2            # ASGI_THREADS=32 per worker by default
+#
+# Every /api/v1 and /api/v2 route still runs its Flask view (same domain code, same
+# responses, CORS, metrics and profiling hooks), but on a bounded thread pool driven by the
+# event loop, so idle/slow clients no longer hold a thread. Mongo round trips stay on that pool.
+#
+# The slow part -- JSON-RPC to the chain in block close / anchor -- runs on the event loop via
+# AsyncWeb3, and the finished result is handed to the view through a WSGI environ key:
+#   POST /api/v1/blocks/close          close in a thread, anchor async, view renders "registry.close_result"
+#   POST /api/v1/blocks/<id>/anchor    validate in a thread, send async, view persists "registry.anchor_tx"
+# Without chain env these two take the plain Flask path too. Their Mongo work done before the view runs is
+# tallied into the request's http_request_mongo_* metrics all the same.
+#
+# Mongo stays synchronous (pymongo on the pool), so the Mongo-bound throughput of a worker is the same as
+# under gunicorn with as many threads: this mode frees threads from slow clients and chain RPC, not from Mongo.
+
+import os, re, sys, json, asyncio, contextvars, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+
+import app as registry
+import metrics
+from utils import derive_onchain_block_id, send_anchor_with_bump_async
+
+THREADS     = int(os.getenv("ASGI_THREADS", "32"))
+BODY_SPOOL  = 1 << 20   # request bodies above this spill to a temp file (evidence uploads)
+
+_pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi")
+_ANCHOR_RE = re.compile(r"^/api/v1/blocks/([^/]+)/anchor$")
+_DONE = object()
+
+async def _run(fn, *args, ctx: contextvars.Context = None):
+    # run in a copy of the caller's Context (like _call_flask), so metrics context vars reach the pool thread
+    ctx = ctx or contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_pool, ctx.run, fn, *args)
+
+# ---------------- WSGI bridge ----------------
+async def _read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL)
+    more = True
+    while more:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            break
+        body.write(msg.get("body", b""))
+        more = msg.get("more_body", False)
+    size = body.tell()
+    body.seek(0)
+    return body, size
+
+def _environ(scope, body, size: int, extra: dict) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root = scope.get("root_path", "")
+    path = scope["path"][len(root):] if scope["path"].startswith(root) else scope["path"]
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(size),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for k, v in scope["headers"]:
+        name, v = k.decode("latin-1").upper().replace("-", "_"), v.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else "HTTP_" + name
+        env[key] = env[key] + "," + v if key in env else v
+    env.update(extra)
+    return env
+
+async def _call_flask(scope, body, size: int, send, extra: dict = None):
+    """Run the Flask app for one request on the pool and stream its response back."""
+    env = _environ(scope, body, size, extra or {})
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = int(status.split(" ", 1)[0]), headers
+        return lambda data: None  # legacy write() is not used by Flask
+
+    def call():
+        it = registry.app(env, start_response)
+        return it, iter(it)
+
+    # one Context for the whole response: streamed views (NDJSON export) resume
+    # on whichever pool thread is free but see the same Flask/metrics context vars
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    it, chunks = await loop.run_in_executor(_pool, ctx.run, call)
+    try:
+        await send({"type": "http.response.start", "status": started["status"],
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in started["headers"]]})
+        while True:
+            chunk = await loop.run_in_executor(_pool, ctx.run, next, chunks, _DONE)
+            if chunk is _DONE:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(it, "close"):
+            await loop.run_in_executor(_pool, ctx.run, it.close)
+        body.close()
+
+# ---------------- async chain I/O ----------------
+_chain = {}
+
+def _chain_client():
+    # one AsyncWeb3 (and aiohttp session) per process, built on first use
+    if not _chain:
+        from web3 import AsyncWeb3, AsyncHTTPProvider
+        w3 = AsyncWeb3(AsyncHTTPProvider(registry.WEB3_RPC_URL))
+        _chain["w3"] = w3
+        _chain["acct"] = w3.eth.account.from_key(registry.REG_PK)
+        _chain["contract"] = w3.eth.contract(address=AsyncWeb3.to_checksum_address(registry.ANCHOR_ADDR),
+                                             abi=registry.ANCHOR_ABI)
+    return _chain["w3"], _chain["acct"], _chain["contract"]
+
+async def _chain_id(w3) -> int:
+    if "chain_id" not in _chain:
+        _chain["chain_id"] = await w3.eth.chain_id
+    return _chain["chain_id"]
+
+async def send_close_anchor_async(onchain_block_id: int, root_hex: str) -> str:
+    """Async twin of the anchoring step in close_block()."""
+    w3, acct, contract = _chain_client()
+    with metrics.timer("anchor_send"):
+        return await send_anchor_with_bump_async(
+            w3=w3, acct=acct, contract=contract,
+            onchain_block_id=onchain_block_id,
+            root_bytes=w3.to_bytes(hexstr=root_hex),
+            chain_id=await _chain_id(w3),
+            attempts=4,
+            wait_receipt=False,
+        )
+
+async def send_block_anchor_async(onchain_block_id: int, root_hex: str) -> str:
+    """Async twin of app.send_block_anchor()."""
+    w3, acct, contract = _chain_client()
+    with metrics.timer("anchor_send"):
+        txn = await contract.functions.anchor(onchain_block_id, w3.to_bytes(hexstr=root_hex)).build_transaction({
+            "from": acct.address,
+            "nonce": await w3.eth.get_transaction_count(acct.address),
+            "gas": 200000,
+            "maxFeePerGas": w3.to_wei("20", "gwei"),
+            "maxPriorityFeePerGas": w3.to_wei("1", "gwei"),
+            "chainId": await _chain_id(w3),
+        })
+        signed = w3.eth.account.sign_transaction(txn, registry.REG_PK)
+        return (await w3.eth.send_raw_transaction(registry._signed_raw_bytes(signed))).hex()
+
+# ---------------- chain-bound routes ----------------
+def _json_note(scope, body):
+    # mirrors request.get_json(silent=True) in blocks_close()
+    ctype = dict(scope["headers"]).get(b"content-type", b"").split(b";")[0].strip().decode("latin-1")
+    if ctype != "application/json" and not (ctype.startswith("application/") and ctype.endswith("+json")):
+        return None
+    try:
+        data = json.loads(body.read() or b"null")
+    except ValueError:
+        data = None
+    finally:
+        body.seek(0)
+    return data.get("note") if isinstance(data, dict) else None
+
+async def _blocks_close(scope, body, size, send):
+    ctx, tally = metrics.mongo_tally_context()
+    res = await _run(registry.close_block, _json_note(scope, body), False, ctx=ctx)
+    if "error" not in res and registry.chain_configured():
+        try:
+            txh = await send_close_anchor_async(int(res["onchain_block_id"]), res["merkle_root"])
+            await _run(registry.record_close_anchor, ObjectId(res["block_id"]), res["merkle_root"], txh, ctx=ctx)
+            res["anchored"] = True
+        except Exception as e:
+            res["anchor_tx"] = f"ERROR: {e}"  # do not fail the block close
+    await _call_flask(scope, body, size, send, {"registry.close_result": res, metrics.TALLY_ENVIRON: tally})
+
+async def _block_anchor(scope, body, size, send, block_id: str):
+    ctx, tally = metrics.mongo_tally_context()
+    blk, err = await _run(registry.anchor_target, block_id, ctx=ctx)
+    extra = {metrics.TALLY_ENVIRON: tally}
+    if not err:
+        onchain_block_id = int(blk.get("onchain_block_id") or derive_onchain_block_id(block_id))
+        try:
+            extra["registry.anchor_tx"] = await send_block_anchor_async(onchain_block_id, blk["merkle_root"])
+        except Exception as e:
+            extra["registry.anchor_tx"] = e  # re-raised by the view -> same 500 as the sync path
+    await _call_flask(scope, body, size, send, extra)
+
+# ---------------- ASGI entry point ----------------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                _pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body, size = await _read_body(receive)
+    path, method = scope["path"], scope["method"]
+    if method == "POST" and registry.chain_configured():
+        if path == "/api/v1/blocks/close":
+            return await _blocks_close(scope, body, size, send)
+        m = _ANCHOR_RE.match(path)
+        if m:
+            return await _block_anchor(scope, body, size, send, m.group(1))
+    await _call_flask(scope, body, size, send)
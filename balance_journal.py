@@ -0,0 +1,158 @@
+# balance_journal.py
+# Per-account balance journal: one row per (account, block) the account's balance changed in, holding the
+# balance at the close of that block. "Balance of X at block B" is then a single indexed lookup (newest row
+# with block_seq <= B) instead of a ledger replay.
+#
+# close_block() calls sync() right after it closes a block; sync() journals every block after the
+# journal tip, so it also back-fills history (and assigns blocks.seq to blocks closed before it existed):
+#
+#   python balance_journal.py sync       # catch up to the newest block (first run after deploy)
+#   python balance_journal.py verify     # journal at its tip vs a ledger replay (ledger_replay.py)
+#
+#   GET /api/v1/accounts/<id>/balance?at_block=<block_id|seq>
+#   GET /api/v1/accounts/<id>/balance/history?from_block=&to_block=&after=<seq>&limit=
+#
+# Balances follow the ledger_replay rule: every non-retired credit, counted from the block its mint
+# was closed in.
+#
+# env: MONGODB_URI, DB_NAME
+
+import os, sys, json, time, argparse
+
+from ledger_replay import iter_block_txs
+
+JOURNAL = "balance_journal"
+STATE   = "balance_journal_state"
+INDEXES = [
+    (JOURNAL, [("account_id", 1), ("block_seq", 1)], {"unique": True}),
+    ("blocks", "seq", {}),
+]
+
+def balance_deltas(typ: str, p: dict) -> list:
+    """[(account_id, delta_g)] one ledger tx moves; market_list only locks, it moves nothing."""
+    amt = int(p.get("amount_g") or 0)
+    if typ == "mint":
+        return [(str(p["owner_account_id"]), amt)]
+    if typ in ("transfer", "multi_transfer"):
+        return [(str(p["from_account_id"]), -amt), (str(p["to_account_id"]), amt)]
+    if typ in ("retire", "multi_retire"):
+        return [(str(p["owner_account_id"]), -amt)]
+    if typ == "market_buy":
+        return [(str(p["producer_id"]), -amt), (str(p["buyer_id"]), amt)]
+    return []
+
+def next_seq(prev) -> int:
+    """blocks.seq for the block after `prev` (None while older blocks still await sync())."""
+    if prev is None:
+        return 1
+    return prev["seq"] + 1 if prev.get("seq") else None
+
+def tip(db):
+    """{"block_seq", "block_id"} of the newest journaled block, or None."""
+    return db[STATE].find_one({"_id": "tip"})
+
+def latest(db, account_ids: list, upto_seq: int = None) -> dict:
+    """account_id -> balance_g after block `upto_seq` (default: journal tip); absent = no rows."""
+    match = {"account_id": {"$in": list(account_ids)}}
+    if upto_seq is not None:
+        match["block_seq"] = {"$lte": upto_seq}
+    rows = db[JOURNAL].aggregate([
+        {"$match": match},
+        {"$sort": {"account_id": 1, "block_seq": -1}},
+        {"$group": {"_id": "$account_id", "g": {"$first": "$balance_g"}}},
+    ])
+    return {r["_id"]: int(r["g"]) for r in rows}
+
+def balance_at(db, account_id: str, seq: int):
+    """(balance_g, journal row | None) at the close of block `seq`."""
+    row = db[JOURNAL].find_one({"account_id": account_id, "block_seq": {"$lte": seq}}, sort=[("block_seq", -1)])
+    return (int(row["balance_g"]) if row else 0), row
+
+def history(db, account_id: str, lo: int = None, hi: int = None, after: int = None, limit: int = 100):
+    """Journal rows oldest-first in [lo, hi]; -> (rows, next_after seq | None)."""
+    rng = {}
+    if lo is not None:
+        rng["$gte"] = lo
+    if hi is not None:
+        rng["$lte"] = hi
+    if after is not None:
+        rng["$gt"] = after
+    q = {"account_id": account_id, **({"block_seq": rng} if rng else {})}
+    rows = list(db[JOURNAL].find(q, {"_id": 0, "account_id": 0}).sort("block_seq", 1).limit(limit + 1))
+    nxt = rows[limit - 1]["block_seq"] if len(rows) > limit else None
+    return rows[:limit], nxt
+
+def sync(db, log=None) -> dict:
+    """Journal every block after the tip, in _id order; safe to re-run after a crash."""
+    from pymongo import UpdateOne
+    st = tip(db)
+    seq = st["block_seq"] if st else 0
+    q = {"_id": {"$gt": st["block_id"]}} if st else {}
+    blocks = list(db.blocks.find(q, {"seq": 1, "created_at": 1}).sort("_id", 1))
+    stats = {"from_seq": seq + 1, "blocks": len(blocks), "rows": 0}
+    known = {}   # account_id -> balance_g as of the last block journaled in this run
+    t0 = time.perf_counter()
+    for b, txs in iter_block_txs(db, blocks):
+        seq += 1
+        if b.get("seq") != seq:
+            db.blocks.update_one({"_id": b["_id"]}, {"$set": {"seq": seq}})
+        delta = {}
+        for t in txs:
+            for acc, d in balance_deltas(t["type"], t["payload"]):
+                delta[acc] = delta.get(acc, 0) + d
+        delta = {a: d for a, d in delta.items() if d}
+        missing = [a for a in delta if a not in known]
+        if missing:
+            prev = latest(db, missing, seq - 1)
+            known.update({a: prev.get(a, 0) for a in missing})
+        ops = []
+        for acc, d in delta.items():
+            known[acc] += d
+            ops.append(UpdateOne({"account_id": acc, "block_seq": seq},
+                                 {"$set": {"block_id": b["_id"], "balance_g": known[acc], "delta_g": d,
+                                           "closed_at": b.get("created_at")}}, upsert=True))
+        if ops:
+            db[JOURNAL].bulk_write(ops, ordered=False)
+        # the tip moves only once the block's rows are all in
+        db[STATE].update_one({"_id": "tip"}, {"$set": {"block_seq": seq, "block_id": b["_id"]}}, upsert=True)
+        stats["rows"] += len(ops)
+        if log and seq % 1000 == 0:
+            log(f"  journaled block {seq:,} ({stats['rows']:,} rows, {time.perf_counter() - t0:.1f}s)")
+    stats["to_seq"] = seq
+    return stats
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-account balance journal (balance at any block)")
+    ap.add_argument("--uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default=os.getenv("DB_NAME", "h2_registry"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("sync", help="journal every block after the tip")
+    sub.add_parser("verify", help="compare the journal at its tip with a ledger replay")
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri)[args.db]
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+
+    if args.cmd == "sync":
+        print(json.dumps(sync(db, log=print), indent=2))
+        return
+
+    import ledger_replay
+    st = tip(db)
+    if not st:
+        sys.exit("❌ journal is empty; run `python balance_journal.py sync` first")
+    state, height, _ = ledger_replay.state_at(db, st["block_id"])
+    replayed = state.balances()
+    accounts = db[JOURNAL].distinct("account_id")
+    journal = {a: g for a, g in latest(db, accounts, st["block_seq"]).items() if g}
+    diff = [{"account_id": a, "journal_g": journal.get(a, 0), "ledger_g": replayed.get(a, 0)}
+            for a in sorted(journal.keys() | replayed.keys()) if journal.get(a, 0) != replayed.get(a, 0)]
+    ok = not diff and height == st["block_seq"]
+    print(json.dumps({"block_seq": st["block_seq"], "replay_height": height, "accounts": len(replayed),
+                      "mismatches": len(diff), "sample": diff[:20], "ok": ok}, indent=2))
+    sys.exit(0 if ok else 2)
+
+if __name__ == "__main__":
+    main()
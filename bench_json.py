@@ -0,0 +1,81 @@
+# bench_json.py
+# Compare response serialization: old to_public() walk + json.dumps(default=str)
+# against fastjson (stdlib one-pass and orjson) on proof-sized and list-sized payloads.
+#
+# usage:
+#   python bench_json.py [--repeat 200]
+
+import argparse, json, os, time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+
+import fastjson
+
+def legacy_to_public(x):
+    # to_public() as it was in app.py (recursive copy, per-value import)
+    if isinstance(x, dict):
+        return {k: legacy_to_public(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [legacy_to_public(v) for v in x]
+    try:
+        from bson import ObjectId as _OID
+        if isinstance(x, _OID):
+            return str(x)
+    except Exception:
+        pass
+    if isinstance(x, datetime):
+        return x.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+    return x
+
+def legacy_j_ok(data) -> bytes:
+    return json.dumps(legacy_to_public(data), default=str).encode("utf-8")
+
+def proof_payload():
+    # shape of GET /api/v2/state/proof/<id>
+    return {
+        "account_id": str(ObjectId()),
+        "balance_g": 12345,
+        "leaf": "0x" + os.urandom(32).hex(),
+        "proof": [{"sibling": "0x" + os.urandom(32).hex(), "is_right": bool(i % 2)} for i in range(256)],
+        "state_root": "0x" + os.urandom(32).hex(),
+        "local_verify_ok": True,
+    }
+
+def offers_payload(n: int):
+    # shape of GET /api/v1/market/offers (raw Mongo docs)
+    t0 = datetime.utcnow()
+    return {"offers": [{
+        "_id": ObjectId(), "producer_id": str(ObjectId()), "credit_id": str(ObjectId()),
+        "amount_g": 5000 + i, "price_per_g": 0.1 + i / 1e4,
+        "created_at": t0 - timedelta(seconds=i), "status": "open",
+    } for i in range(n)], "next_after": None}
+
+def bench(fn, data, repeat: int) -> float:
+    fn(data)  # warm-up
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - t) / repeat * 1e6  # µs per call
+
+def main():
+    ap = argparse.ArgumentParser(description="JSON response serialization benchmark")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    cases = [("proof (256 steps)", proof_payload()),
+             ("offers x1000", offers_payload(1000)),
+             ("offers x10000", offers_payload(10000))]
+    # iso=True: same output as legacy j_ok (ISO "Z" datetimes)
+    impls = [("legacy to_public+json", legacy_j_ok), ("fastjson stdlib", lambda d: fastjson.dumps_stdlib(d, iso=True))]
+    if fastjson.orjson is not None:
+        impls.append(("fastjson orjson", lambda d: fastjson.dumps(d, iso=True)))
+
+    print(f"{'payload':<20}" + "".join(f"{name:>24}" for name, _ in impls))
+    for label, data in cases:
+        rep = max(1, args.repeat // (10 if "10000" in label else 1))
+        times = [bench(fn, data, rep) for _, fn in impls]
+        base = times[0]
+        print(f"{label:<20}" + "".join(f"{t:>14.1f} µs ({base / t:4.1f}x)" for t in times))
+
+if __name__ == "__main__":
+    main()
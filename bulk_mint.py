@@ -0,0 +1,148 @@
+# bulk_mint.py
+# Mints every verified production event that has no credit yet, in batches: one bulk claim of the events
+# (production_events.minted_credit_id, the same mint-once flag POST /credits/mint sets), one insert_many
+# of credits and one insert_many of "mint" ledger txs per batch.
+#
+#   POST /api/v1/credits/mint_bulk  {"producer_id"|"sensor_id"|"electrolyzer_id": ..., "limit": N}
+#                                   or {"event_ids": [...]}
+#   python bulk_mint.py                          # everything unminted
+#   python bulk_mint.py --producer <account_id> --limit 50000
+#
+# Credits and ledger payloads are exactly those of /credits/mint (status "pending" until the next
+# block close). An event is claimed with a conditional update before its credit is written, so this
+# job, the single-event route and a second job running at the same time never mint an event twice.
+# Events minted before the flag existed (a credit with their event_id already exists) get the flag
+# back-filled and are skipped.
+#
+# env: BULK_MINT_BATCH=1000, BULK_MINT_MAX=10000 (events per API request)
+
+import os, time, argparse
+from datetime import datetime
+
+from bson import ObjectId
+
+BATCH = int(os.getenv("BULK_MINT_BATCH", "1000"))
+MAX_PER_REQUEST = int(os.getenv("BULK_MINT_MAX", "10000"))
+
+INDEXES = [
+    # "verified and not minted yet", walked in _id order
+    ("production_events", [("verified", 1), ("minted_credit_id", 1), ("_id", 1)], {}),
+]
+
+def unminted_query(db, producer_id=None, sensor_id=None, electrolyzer_id=None, event_ids=None) -> dict:
+    q = {"verified": True, "minted_credit_id": None}
+    if event_ids is not None:
+        q["_id"] = {"$in": list(event_ids)}
+    if electrolyzer_id is not None:
+        q["electrolyzer_id"] = electrolyzer_id
+    if producer_id is not None:
+        sq = {"owner_account_id": producer_id}
+        if sensor_id is not None:
+            sq["_id"] = sensor_id   # both given: that sensor, and only if the producer owns it (else nothing)
+        q["sensor_id"] = {"$in": [s["_id"] for s in db.sensors.find(sq, {"_id": 1})]}
+    elif sensor_id is not None:
+        q["sensor_id"] = sensor_id
+    return q
+
+def mint_batch(db, events: list) -> dict:
+    """Claims and mints one batch of events -> {"minted": [(event, credit)], "already": n, "no_sensor": n}."""
+    from pymongo import UpdateOne
+    from app import kg_to_g, ledger_append_many
+    out = {"minted": [], "already": 0, "no_sensor": 0}
+    ev_ids = [e["_id"] for e in events]
+
+    # minted before the flag existed: back-fill it and leave the event alone
+    legacy = {}
+    for cr in db.credits.find({"event_id": {"$in": ev_ids}}, {"event_id": 1}).sort("_id", 1):
+        legacy.setdefault(cr["event_id"], cr["_id"])
+    if legacy:
+        db.production_events.bulk_write([UpdateOne({"_id": e, "minted_credit_id": None}, {"$set": {"minted_credit_id": c}})
+                                         for e, c in legacy.items()], ordered=False)
+        out["already"] += len(legacy)
+
+    sensors = {s["_id"]: s["owner_account_id"] for s in db.sensors.find(
+        {"_id": {"$in": list({e["sensor_id"] for e in events})}}, {"owner_account_id": 1})}
+    todo = []
+    for e in events:
+        if e["_id"] in legacy:
+            continue
+        if e["sensor_id"] not in sensors:
+            out["no_sensor"] += 1
+            continue
+        todo.append((e, ObjectId()))
+    if not todo:
+        return out
+
+    # claim first (same rule as /credits/mint): only events we flagged get a credit
+    db.production_events.bulk_write([UpdateOne({"_id": e["_id"], "minted_credit_id": None},
+                                               {"$set": {"minted_credit_id": cid}}) for e, cid in todo], ordered=False)
+    ours = {d["_id"] for d in db.production_events.find(
+        {"_id": {"$in": [e["_id"] for e, _ in todo]}, "minted_credit_id": {"$in": [cid for _, cid in todo]}}, {"_id": 1})}
+    out["already"] += len(todo) - len(ours)
+
+    now, credits, entries = datetime.utcnow(), [], []
+    for e, cid in todo:
+        if e["_id"] not in ours:
+            continue
+        producer_id = sensors[e["sensor_id"]]
+        amount_g = kg_to_g(float(e["hydrogen_kg"]))
+        cred = {"_id": cid, "amount_g": amount_g, "status": "pending",
+                "producer_account_id": producer_id, "owner_account_id": producer_id, "event_id": e["_id"],
+                "block_id": None, "anchor_tx": None, "created_at": now}
+        credits.append(cred)
+        entries.append(("mint", {"credit_id": str(cid), "event_id": str(e["_id"]), "amount_g": amount_g,
+                                 "owner_account_id": str(producer_id)}))
+        out["minted"].append((e, cred))
+    if credits:
+        db.credits.insert_many(credits, ordered=False)
+        ledger_append_many(entries)
+    return out
+
+def run(db, q: dict, limit: int = None, batch: int = BATCH, collect: bool = False, log=None) -> dict:
+    """Mints events matching q (oldest first) until none are left or `limit` were looked at."""
+    stats = {"events": 0, "minted": 0, "amount_g": 0, "already_minted": 0, "no_sensor": 0}
+    if collect:
+        stats["credits"] = []   # [(event_id, credit_id, amount_g)]
+    proj = {"sensor_id": 1, "hydrogen_kg": 1}
+    after, t0 = None, time.perf_counter()
+    while limit is None or stats["events"] < limit:
+        n = batch if limit is None else min(batch, limit - stats["events"])
+        page = q if after is None else {**q, "_id": {**q.get("_id", {}), "$gt": after}}
+        events = list(db.production_events.find(page, proj).sort("_id", 1).limit(n))
+        if not events:
+            break
+        after = events[-1]["_id"]
+        res = mint_batch(db, events)
+        stats["events"] += len(events)
+        stats["minted"] += len(res["minted"])
+        stats["amount_g"] += sum(c["amount_g"] for _, c in res["minted"])
+        stats["already_minted"] += res["already"]
+        stats["no_sensor"] += res["no_sensor"]
+        if collect:
+            stats["credits"] += [(e["_id"], c["_id"], c["amount_g"]) for e, c in res["minted"]]
+        if log:
+            log(f"  {stats['events']:,} events, {stats['minted']:,} minted ({time.perf_counter() - t0:.1f}s)")
+    return stats
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Mint every verified, unminted production event")
+    ap.add_argument("--producer", help="only events of this producer account id")
+    ap.add_argument("--electrolyzer", help="only events of this electrolyzer id")
+    ap.add_argument("--limit", type=int, default=None, help="stop after this many events")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    args = ap.parse_args()
+
+    from app import db
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+    q = unminted_query(db, producer_id=ObjectId(args.producer) if args.producer else None,
+                       electrolyzer_id=args.electrolyzer)
+    t0 = time.perf_counter()
+    st = run(db, q, args.limit, args.batch, log=print)
+    print(f"✔ minted {st['minted']:,} credits ({st['amount_g'] / 1000:,.3f} kg) from {st['events']:,} events in "
+          f"{time.perf_counter() - t0:.1f}s; {st['already_minted']} already minted, {st['no_sensor']} without sensor")
+
+if __name__ == "__main__":
+    main()
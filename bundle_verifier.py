@@ -0,0 +1,305 @@
+# bundle_verifier.py
+# Standalone, offline verifier for proof bundles (.h2pb) exported by proof_bundle.py or
+# POST /api/v1/proof/bundle. Python stdlib only: auditors can run it without the registry code.
+#
+# usage: python bundle_verifier.py bundle.h2pb [--json] [--rpc https://...]
+#   --rpc  additionally reads CreditAnchor.roots(id) for every anchor reference (plain JSON-RPC eth_call):
+#          each block's merkle_root under onchain id sha256(block_id), the state_root under sha256("smt|" + root)
+#
+# Checks, in one local pass:
+#   - every tx inclusion multiproof folds to its block's merkle_root
+#   - every block's chain_hash == sha256(prev_hash || merkle_root)
+#   - the SMT multiproof for all listed account balances folds to state_root
+# and prints the anchor references (contract, onchain id) to check on chain.
+#
+# Offline, the bundle is only consistent with itself: whoever wrote it could pick any block_id, merkle_root,
+# prev_hash or state_root and build matching proofs. Which block a root belongs to (block_id -> onchain id)
+# and that the roots are the registry's are authenticated only on chain, so only a run with --rpc
+# (VERIFIED with "anchors checked on chain") ties the proofs to the registry. The meta JSON (generated_at,
+# chain, rules) is informational and never authenticated.
+#
+# ---- format v1 (big-endian; varint = unsigned LEB128; H32 = 32 raw bytes) ----
+#   "H2PB" u8 version u8 flags(bit0: state section present)
+#   varint len, JSON meta (utf-8)                       generated_at, chain, rules
+#   varint block count, then per block:
+#     12 block_id | H32 merkle_root | u8 bits(0 prev, 1 anchor_tx, 2 contract)
+#     [H32 prev_hash] H32 chain_hash varint tx_count [20 contract] [H32 anchor_tx]
+#     varint k, k x (varint index, H32 tx_hash)         proven leaves, ascending index
+#     varint m, m x H32                                 siblings, in fold order (see fold_merkle)
+#   state section:
+#     H32 state_root | [20 contract]  (bit3 of flags)
+#     varint a, a x (varint len, utf-8 account_id, varint balance_g)
+#     varint m, ceil(m/8) bytes bitmap (1 = explicit), popcount x H32   siblings in fold order;
+#                                                                      0 bits are default subtrees
+#
+# Tx Merkle: node = sha256_hex(left_hex + right_hex), an odd last node is paired with itself.
+# SMT: 256-bit keys sha256(account_id), leaf H(0x00||u256 balance), node H(0x01||left||right).
+
+import sys, json, hashlib, argparse
+
+MAGIC = b"H2PB"
+VERSION = 1
+F_STATE, F_STATE_CONTRACT = 0x01, 0x08
+B_PREV, B_ANCHOR, B_CONTRACT = 0x01, 0x02, 0x04
+SMT_DEPTH = 256
+
+def H(b: bytes) -> bytes:
+    return hashlib.sha256(b).digest()
+
+def smt_defaults() -> list:
+    d = [b""] * (SMT_DEPTH + 1)
+    d[SMT_DEPTH] = H(b"\x00" + (0).to_bytes(32, "big"))
+    for depth in range(SMT_DEPTH - 1, -1, -1):
+        d[depth] = H(b"\x01" + d[depth + 1] + d[depth + 1])
+    return d
+
+DEFAULTS = smt_defaults()
+
+# ---------------- multiproof folding (shared with proof_bundle.py) ----------------
+
+def fold_merkle(width: int, known: dict, next_sibling) -> str:
+    """Tx tree: known {index: hex}; next_sibling() yields missing siblings in fold order. Returns root hex."""
+    if width == 0:
+        return "0" * 64
+    while width > 1:
+        up = {}
+        for pos in sorted(known):
+            parent = pos >> 1
+            if parent in up:
+                continue
+            left, right = pos & ~1, pos | 1
+            if right >= width:                       # odd tail: paired with itself
+                r = known[left]
+                up[parent] = hashlib.sha256((r + r).encode("utf-8")).hexdigest()
+                continue
+            a = known[left] if left in known else next_sibling(width, left)
+            b = known[right] if right in known else next_sibling(width, right)
+            up[parent] = hashlib.sha256((a + b).encode("utf-8")).hexdigest()
+        known, width = up, (width + 1) // 2
+    return known[0]
+
+def fold_smt(known: dict, next_sibling) -> bytes:
+    """SMT: known {key position: leaf hash}; next_sibling(depth, pos) -> sibling hash. Returns root bytes."""
+    for depth in range(SMT_DEPTH, 0, -1):
+        up = {}
+        for pos in sorted(known):
+            parent = pos >> 1
+            if parent in up:
+                continue
+            left, right = pos & ~1, pos | 1
+            a = known[left] if left in known else next_sibling(depth, left)
+            b = known[right] if right in known else next_sibling(depth, right)
+            up[parent] = H(b"\x01" + a + b)
+        known = up
+    return known[0] if known else DEFAULTS[0]
+
+def smt_key(account_id: str) -> int:
+    return int.from_bytes(hashlib.sha256(account_id.encode("utf-8")).digest(), "big")
+
+def smt_leaf(balance_g: int) -> bytes:
+    return H(b"\x00" + int(balance_g).to_bytes(32, "big"))
+
+def onchain_block_id(block_id: str) -> int:
+    # same rule as utils.derive_onchain_block_id
+    return int(hashlib.sha256(block_id.encode()).hexdigest(), 16)
+
+def onchain_state_id(root_hex: str) -> int:
+    # same rule as phase2/anchor_state.derive_block_id_from_root
+    return int(hashlib.sha256(("smt|" + root_hex.lower().removeprefix("0x")).encode()).hexdigest(), 16)
+
+# ---------------- reader ----------------
+
+class Reader:
+    def __init__(self, buf: bytes):
+        self.buf, self.pos = memoryview(buf), 0
+
+    def take(self, n: int) -> bytes:
+        if self.pos + n > len(self.buf):
+            raise ValueError("truncated bundle")
+        b = bytes(self.buf[self.pos:self.pos + n])
+        self.pos += n
+        return b
+
+    def u8(self) -> int:
+        return self.take(1)[0]
+
+    def varint(self) -> int:
+        shift = out = 0
+        while True:
+            b = self.u8()
+            out |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return out
+            shift += 7
+
+    def h32(self) -> bytes:
+        return self.take(32)
+
+def read_bundle(data: bytes) -> dict:
+    r = Reader(data)
+    if r.take(4) != MAGIC:
+        raise ValueError("not a proof bundle")
+    version, flags = r.u8(), r.u8()
+    if version != VERSION:
+        raise ValueError(f"unsupported bundle version {version}")
+    meta = json.loads(r.take(r.varint()).decode("utf-8"))
+    blocks = []
+    for _ in range(r.varint()):
+        b = {"block_id": r.take(12).hex(), "merkle_root": r.h32().hex()}
+        bits = r.u8()
+        b["prev_hash"] = r.h32().hex() if bits & B_PREV else None
+        b["chain_hash"] = r.h32().hex()
+        b["tx_count"] = r.varint()
+        b["contract_address"] = "0x" + r.take(20).hex() if bits & B_CONTRACT else None
+        b["anchor_tx"] = "0x" + r.h32().hex() if bits & B_ANCHOR else None
+        b["leaves"] = [(r.varint(), r.h32().hex()) for _ in range(r.varint())]
+        b["siblings"] = [r.h32().hex() for _ in range(r.varint())]
+        blocks.append(b)
+    state = None
+    if flags & F_STATE:
+        state = {"state_root": r.h32().hex(),
+                 "contract_address": "0x" + r.take(20).hex() if flags & F_STATE_CONTRACT else None}
+        state["accounts"] = [(r.take(r.varint()).decode("utf-8"), r.varint()) for _ in range(r.varint())]
+        m = r.varint()
+        bitmap = r.take((m + 7) // 8)
+        explicit = [bool(bitmap[i >> 3] & (0x80 >> (i & 7))) for i in range(m)]
+        state["siblings"] = [r.h32() if e else None for e in explicit]
+    if r.pos != len(data):
+        raise ValueError("trailing bytes after bundle")
+    return {"meta": meta, "blocks": blocks, "state": state}
+
+# ---------------- verification ----------------
+
+def _feeder(items):
+    it = iter(items)
+    def nxt(*_):
+        try:
+            return next(it)
+        except StopIteration:
+            raise ValueError("proof is missing siblings") from None
+    return nxt, it
+
+def verify_block(b: dict) -> list:
+    errors = []
+    if any(i >= b["tx_count"] for i, _ in b["leaves"]):
+        errors.append("tx index out of range")
+    elif b["leaves"]:
+        nxt, rest = _feeder(b["siblings"])
+        try:
+            root = fold_merkle(b["tx_count"], dict(b["leaves"]), nxt)
+            if next(rest, None) is not None:
+                errors.append("unused siblings in tx proof")
+            if root != b["merkle_root"]:
+                errors.append("tx proof does not fold to merkle_root")
+        except (ValueError, KeyError) as e:
+            errors.append(f"tx proof malformed: {e}")
+    want = hashlib.sha256(((b["prev_hash"] or "") + b["merkle_root"]).encode("utf-8")).hexdigest()
+    if want != b["chain_hash"]:
+        errors.append("chain_hash != sha256(prev_hash || merkle_root)")
+    return errors
+
+def verify_state(s: dict) -> list:
+    sibs = iter(s["siblings"])
+    def nxt(depth, pos):
+        h = next(sibs, False)
+        if h is False:
+            raise ValueError("proof is missing siblings")
+        return DEFAULTS[depth] if h is None else h
+    known = {}
+    for account_id, bal in s["accounts"]:
+        known[smt_key(account_id)] = smt_leaf(bal)
+    try:
+        root = fold_smt(known, nxt)
+    except ValueError as e:
+        return [f"state proof malformed: {e}"]
+    errors = []
+    if next(sibs, False) is not False:
+        errors.append("unused siblings in state proof")
+    if root.hex() != s["state_root"]:
+        errors.append("state proof does not fold to state_root")
+    return errors
+
+def read_onchain_root(rpc: str, contract: str, onchain_id: int) -> str:
+    import urllib.request
+    data = "0x" + ROOTS_SELECTOR + format(onchain_id, "064x")
+    req = urllib.request.Request(rpc, json.dumps({
+        "jsonrpc": "2.0", "id": 1, "method": "eth_call", "params": [{"to": contract, "data": data}, "latest"],
+    }).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        res = json.load(resp)
+    if "error" in res:
+        raise RuntimeError(res["error"])
+    return res["result"].lower().removeprefix("0x").zfill(64)
+
+ROOTS_SELECTOR = "c2b40ae4"   # keccak256("roots(uint256)")[:4]; stdlib has no keccak
+
+def _check_anchor(rpc: str, contract: str, onchain_id: int, root_hex: str, anchor: dict, errs: list):
+    try:
+        onchain = read_onchain_root(rpc, contract, onchain_id)
+    except Exception as e:
+        errs.append(f"chain read failed: {e}")
+        return
+    anchor["onchain_root_matches"] = onchain == root_hex
+    if onchain != root_hex:
+        errs.append("on-chain root differs" if int(onchain, 16) else "root not anchored on chain")
+
+def verify(data: bytes, rpc: str = None) -> dict:
+    bundle = read_bundle(data)
+    # header identity (block_id, state root) is only authenticated by the on-chain check
+    out = {"meta": bundle["meta"], "ok": True, "onchain_checked": bool(rpc), "blocks": [], "state": None}
+    for b in bundle["blocks"]:
+        errs = verify_block(b)
+        rec = {"block_id": b["block_id"], "merkle_root": b["merkle_root"], "txs": [h for _, h in b["leaves"]],
+               "anchor": {"contract_address": b["contract_address"], "anchor_tx": b["anchor_tx"],
+                          "onchain_block_id": str(onchain_block_id(b["block_id"]))},
+               "errors": errs}
+        if rpc:
+            if b["contract_address"]:
+                _check_anchor(rpc, b["contract_address"], onchain_block_id(b["block_id"]), b["merkle_root"],
+                              rec["anchor"], errs)
+            else:
+                errs.append("block has no anchor contract to check on chain")
+        out["ok"] &= not errs
+        out["blocks"].append(rec)
+    s = bundle["state"]
+    if s is not None:
+        errs = verify_state(s)
+        out["state"] = {"state_root": "0x" + s["state_root"], "accounts": dict(s["accounts"]),
+                        "anchor": {"contract_address": s["contract_address"],
+                                   "onchain_block_id": str(onchain_state_id(s["state_root"]))},
+                        "errors": errs}
+        if rpc:
+            if s["contract_address"]:
+                _check_anchor(rpc, s["contract_address"], onchain_state_id(s["state_root"]), s["state_root"],
+                              out["state"]["anchor"], errs)
+            else:
+                errs.append("state root has no anchor contract to check on chain")
+        out["ok"] &= not errs
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Verify a registry proof bundle offline")
+    ap.add_argument("bundle")
+    ap.add_argument("--json", action="store_true", help="print the full result as JSON")
+    ap.add_argument("--rpc", help="also check anchors on chain via this JSON-RPC URL")
+    args = ap.parse_args()
+    with open(args.bundle, "rb") as f:
+        res = verify(f.read(), args.rpc)
+    if args.json:
+        print(json.dumps(res, indent=2))
+    else:
+        ntx = sum(len(b["txs"]) for b in res["blocks"])
+        bad = [b for b in res["blocks"] if b["errors"]]
+        print(f"blocks: {len(res['blocks'])}  txs: {ntx}  failing blocks: {len(bad)}")
+        for b in bad:
+            print(f"  block {b['block_id']}: {'; '.join(b['errors'])}")
+        if res["state"]:
+            st = res["state"]
+            print(f"state root {st['state_root']}  accounts: {len(st['accounts'])}  "
+                  f"{'; '.join(st['errors']) or 'ok'}")
+        print("VERIFIED:", res["ok"], "(anchors checked on chain)" if res["onchain_checked"] else
+              "(offline: proofs are self-consistent; block ids and roots are not authenticated without --rpc)")
+    sys.exit(0 if res["ok"] else 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# credit_compaction.py
+# Merges credit fragments. Partial transfers and market buys leave many small credits behind; every
+# group of live fragments with the same owner, status and provenance (event_id, or source_credit_id for
+# market buys) is folded into its oldest credit:
+#
+#   target credit   amount_g += fragments, merged_from += [{credit_id, amount_g, merge_id}]
+#   fragments       moved out of db.credits into db.credits_merged (merged_into = target), so
+#                   _fetch_balances / balance queries stop scanning them; old ids still resolve there
+#   ledger          one "merge" tx per merge ({merge_id, credit_id, owner_account_id, merged_from}),
+#                   replayed by ledger_replay.py
+#
+#   python credit_compaction.py                          # one pass over all owners
+#   python credit_compaction.py --owner <account_id> --min-fragments 10
+#   python credit_compaction.py --follow --interval 300  # keep compacting alongside the API
+#
+# Online: nothing is locked. A fragment is removed only if it still holds the amount/owner/status it was
+# read with, and credits reserved by an open offer (locked_g > 0) or in a multi-credit op are never touched, so a concurrent
+# transfer / retire / buy simply keeps its fragment out of this pass. The other way round, those routes write
+# only if the credit is still as they read it (multi_credit.as_read) and answer 409 if it was merged. Each batch is
+# archive copy -> conditional delete -> target update -> ledger tx, and any interrupted batch is
+# finished (or rolled back) by recover() at the start of the next run.
+#
+# env: MONGODB_URI, DB_NAME
+
+import os, time, argparse
+from datetime import datetime
+
+from bson import ObjectId
+
+ARCHIVE = "credits_merged"
+MAX_MERGE = 500        # fragments per merge (= per ledger tx)
+BATCH_GROUPS = 200     # merges written per bulk round trip
+LIVE = ("active", "issued")
+
+INDEXES = [
+    (ARCHIVE, "merge_state", {}),
+    (ARCHIVE, "merged_into", {}),
+]
+
+def provenance(c: dict):
+    return c.get("event_id") or c.get("source_credit_id")
+
+def candidates(db, owner=None, min_fragments: int = 2):
+    """Yields (owner, status, [fragment {_id, amount_g}] oldest first) for every compactable group."""
+    match = {"status": {"$in": list(LIVE)}, "amount_g": {"$gt": 0},
+             "$or": [{"locked_g": {"$exists": False}}, {"locked_g": {"$lte": 0}}], "ops.0": {"$exists": False}}
+    if owner is not None:
+        match["owner_account_id"] = owner
+    rows = db.credits.aggregate([
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"o": "$owner_account_id", "s": "$status",
+                            "p": {"$ifNull": ["$event_id", "$source_credit_id"]}},
+                    "f": {"$push": {"_id": "$_id", "amount_g": "$amount_g"}}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gte": max(2, min_fragments)}, "_id.p": {"$ne": None}}},
+    ], allowDiskUse=True)
+    for r in rows:
+        yield r["_id"]["o"], r["_id"]["s"], r["f"]
+
+def plan(groups, max_merge: int = MAX_MERGE):
+    """-> [(merge_id, owner, status, target_id, [fragment ids])]; big groups become several merges into one target."""
+    out = []
+    for owner, status, frags in groups:
+        target, rest = frags[0]["_id"], [f["_id"] for f in frags[1:]]
+        for i in range(0, len(rest), max_merge):
+            out.append((ObjectId(), owner, status, target, rest[i:i + max_merge]))
+    return out
+
+def _claim(db, merges: list):
+    """Archive copies first, then delete the fragments that are still exactly as copied."""
+    from pymongo import DeleteOne
+    src = {fid: m for m in merges for fid in m[4]}
+    now = datetime.utcnow()
+    docs = []
+    for c in db.credits.find({"_id": {"$in": list(src)}}):
+        mid, owner, status, target, _ = src[c["_id"]]
+        if c.get("owner_account_id") != owner or c.get("status") != status or int(c.get("locked_g") or 0) > 0 \
+                or c.get("ops"):
+            continue
+        docs.append({**c, "merge_id": mid, "merged_into": target, "merge_state": "claimed", "merged_at": now})
+    if not docs:
+        return
+    db[ARCHIVE].insert_many(docs, ordered=False)
+    db.credits.bulk_write([DeleteOne({"_id": d["_id"], "amount_g": d["amount_g"], "owner_account_id": d["owner_account_id"],
+                                      "status": d["status"], "locked_g": d.get("locked_g", {"$exists": False}), "ops.0": {"$exists": False}})
+                           for d in docs], ordered=False)
+
+def _strip(a: dict) -> dict:
+    return {k: v for k, v in a.items() if k not in ("merge_id", "merged_into", "merge_state", "merged_at")}
+
+def _finish(db, merge_ids: list) -> dict:
+    """Completes claimed merges: target update, rollback of merges whose target moved, ledger txs. Idempotent."""
+    from pymongo import UpdateOne
+    from app import ledger_append_many
+    arch = list(db[ARCHIVE].find({"merge_id": {"$in": merge_ids}, "merge_state": "claimed"}))
+    still = {c["_id"] for c in db.credits.find({"_id": {"$in": [a["_id"] for a in arch]}}, {"_id": 1})}
+    if still:   # changed under us before the delete: never merged, drop the copy
+        db[ARCHIVE].delete_many({"_id": {"$in": list(still)}, "merge_state": "claimed"})
+    groups = {}
+    for a in arch:
+        if a["_id"] not in still:
+            groups.setdefault(a["merge_id"], []).append(a)
+    ops = []
+    for mid, frags in groups.items():
+        frags.sort(key=lambda a: a["_id"])
+        ops.append(UpdateOne(
+            {"_id": frags[0]["merged_into"], "owner_account_id": frags[0]["owner_account_id"],
+             "status": frags[0]["status"], "merged_from.merge_id": {"$ne": mid}},
+            {"$inc": {"amount_g": sum(int(a["amount_g"]) for a in frags)},
+             "$push": {"merged_from": {"$each": [{"credit_id": a["_id"], "amount_g": int(a["amount_g"]), "merge_id": mid}
+                                                for a in frags]}}}))
+    if ops:
+        db.credits.bulk_write(ops, ordered=False)
+    targets = {frags[0]["merged_into"] for frags in groups.values()}
+    landed = {m["merge_id"] for t in db.credits.find({"_id": {"$in": list(targets)}}, {"merged_from.merge_id": 1})
+              for m in t.get("merged_from", [])} & set(groups)
+    failed = [a for mid, frags in groups.items() if mid not in landed for a in frags]
+    if failed:  # target transferred away / retired meanwhile: put the fragments back
+        db.credits.insert_many([_strip(a) for a in failed], ordered=False)
+        db[ARCHIVE].delete_many({"_id": {"$in": [a["_id"] for a in failed]}})
+    logged = {t["payload"]["merge_id"] for t in db.ledger_txs.find(
+        {"type": "merge", "payload.merge_id": {"$in": [str(m) for m in landed]}}, {"payload.merge_id": 1})}
+    entries = []
+    for mid in sorted(landed):
+        if str(mid) in logged:
+            continue
+        frags = groups[mid]
+        entries.append(("merge", {
+            "merge_id": str(mid), "credit_id": str(frags[0]["merged_into"]),
+            "owner_account_id": str(frags[0]["owner_account_id"]),
+            "merged_from": [{"credit_id": str(a["_id"]), "amount_g": int(a["amount_g"])} for a in frags],
+            "amount_g": sum(int(a["amount_g"]) for a in frags),
+        }))
+    ledger_append_many(entries)
+    if landed:
+        db[ARCHIVE].update_many({"merge_id": {"$in": list(landed)}}, {"$set": {"merge_state": "merged"}})
+    return {"merges": len(landed), "fragments": sum(len(groups[m]) for m in landed),
+            "skipped": len(still), "rolled_back": len(failed)}
+
+def recover(db) -> dict:
+    """Finishes merges a crashed run left in the "claimed" state."""
+    mids = db[ARCHIVE].distinct("merge_id", {"merge_state": "claimed"})
+    return _finish(db, mids) if mids else {"merges": 0, "fragments": 0, "skipped": 0, "rolled_back": 0}
+
+def compact(db, owner=None, min_fragments: int = 2, max_merge: int = MAX_MERGE,
+            batch: int = BATCH_GROUPS, log=print) -> dict:
+    stats = {"merges": 0, "fragments": 0, "skipped": 0, "rolled_back": 0}
+    rec = recover(db)
+    if rec["merges"] or rec["rolled_back"]:
+        log(f"  recovered an interrupted run: {rec}")
+    merges = plan(candidates(db, owner, min_fragments), max_merge)
+    t0 = time.perf_counter()
+    for i in range(0, len(merges), batch):
+        part = merges[i:i + batch]
+        _claim(db, part)
+        for k, v in _finish(db, [m[0] for m in part]).items():
+            stats[k] += v
+        log(f"  {min(i + batch, len(merges)):,}/{len(merges):,} merges, {stats['fragments']:,} fragments "
+            f"({time.perf_counter() - t0:.1f}s)")
+    return stats
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Merge same-owner credit fragments")
+    ap.add_argument("--owner", help="only this account id")
+    ap.add_argument("--min-fragments", type=int, default=2, help="compact groups with at least this many credits")
+    ap.add_argument("--max-merge", type=int, default=MAX_MERGE, help="fragments per merge / ledger tx")
+    ap.add_argument("--follow", action="store_true", help="keep compacting every --interval seconds")
+    ap.add_argument("--interval", type=float, default=300.0)
+    args = ap.parse_args()
+
+    from app import db
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+    owner = None
+    if args.owner:
+        owner = ObjectId(args.owner) if ObjectId.is_valid(args.owner) else args.owner
+    while True:
+        t0 = time.perf_counter()
+        st = compact(db, owner, args.min_fragments, args.max_merge)
+        print(f"merged {st['fragments']:,} fragments in {st['merges']:,} merges "
+              f"({st['skipped']} changed meanwhile, {st['rolled_back']} rolled back) in {time.perf_counter() - t0:.1f}s")
+        if not args.follow:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
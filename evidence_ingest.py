@@ -0,0 +1,94 @@
+# evidence_ingest.py
+# Streaming parser for evidence CSVs -> canonical event payloads.
+#
+# Expected columns (extra columns are ignored):
+#   start_time_utc, end_time_utc, energy_kwh, hydrogen_kg
+#
+# Signatures (detached, made by the sensor key):
+#   - per-file: sign canonical({"evidence_id","sensor_id","sha256_hex"})
+#   - per-row : sign the same canonical event payload POST /events expects,
+#               one hex signature per line in a sidecar file (row order)
+#
+# Everything here is a generator so a 10 GB file costs one row of memory.
+
+import csv, io, json
+from datetime import datetime, timezone
+
+EVIDENCE_COLUMNS = ("start_time_utc", "end_time_utc", "energy_kwh", "hydrogen_kg")
+
+def canonical_json(d: dict) -> str:
+    return json.dumps(d, separators=(",", ":"), sort_keys=True)
+
+def _parse_iso_naive(s: str) -> datetime:
+    s = (s or "").strip()
+    if s.endswith("Z"):
+        s = s[:-1]
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def file_signature_payload(evidence_id: str, sensor_id: str, sha256_hex: str) -> str:
+    """Canonical string a sensor signs to vouch for a whole evidence file."""
+    return canonical_json({"evidence_id": evidence_id, "sensor_id": sensor_id, "sha256_hex": sha256_hex})
+
+def row_event_payload(sensor_id: str, evidence_id: str, row: dict) -> dict:
+    """
+    Map one CSV row to the exact payload dict used by POST /api/v1/events,
+    so a per-row signature is interchangeable with a normal event signature.
+    Raises ValueError on a malformed row.
+    """
+    st = _parse_iso_naive(row.get("start_time_utc"))
+    en = _parse_iso_naive(row.get("end_time_utc"))
+    if en <= st:
+        raise ValueError("end_time must be after start_time")
+    energy_kwh = float(row.get("energy_kwh"))
+    hydrogen_kg = float(row.get("hydrogen_kg"))
+    if energy_kwh < 0 or hydrogen_kg < 0:
+        raise ValueError("energy_kwh/hydrogen_kg must be >= 0")
+    return {
+        "sensor_id": sensor_id,
+        "start_time": st.isoformat(),
+        "end_time": en.isoformat(),
+        "energy_kwh": round(energy_kwh, 6),
+        "hydrogen_kg": round(hydrogen_kg, 6),
+        "evidence_id": evidence_id,
+    }
+
+def iter_evidence_rows(path: str):
+    """
+    Yield (row_no, row_dict) for each data row (row_no starts at 1).
+    Raises ValueError up-front if required columns are missing.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        reader = csv.DictReader(fh)
+        missing = [c for c in EVIDENCE_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"evidence CSV missing columns: {', '.join(missing)}")
+        for row_no, row in enumerate(reader, start=1):
+            yield row_no, row
+
+def iter_signature_lines(stream):
+    """
+    Yield hex signatures from a detached signature file (bytes stream),
+    one per non-empty line. Yields None forever once the file is exhausted
+    so it can be zipped against rows without truncating them.
+    """
+    if stream is not None:
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            line = line.strip()
+            if line:
+                yield line
+    while True:
+        yield None
+
+def iter_batches(it, size: int):
+    """Group any iterator into lists of at most `size` items."""
+    batch = []
+    for item in it:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
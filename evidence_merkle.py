@@ -0,0 +1,127 @@
+# evidence_merkle.py
+# Row-level Merkle tree over an evidence file, for single-row disclosure proofs.
+#
+# Leaves : line i of the file (0 = CSV header, i = data row i), without its line ending
+#          leaf_i = sha256(0x00 || line_bytes)
+# Nodes  : sha256(0x01 || left || right) over the raw 32-byte children, duplicate last if odd.
+#          The prefixes keep a leaf from ever being read as an inner node (same split as the SMT in
+#          bundle_verifier), so a 64-byte row cannot pass for the two children of a node.
+#
+# Trees built before the prefixes (summary without "rule") used sha256(line) and sha256(left_hex + right_hex);
+# their roots are already in the ledger, so they keep rule 1 and are rebuilt / verified with it.
+#
+# Two sidecar files live next to the stored evidence:
+#   <stored>.rowidx  : uint64 LE byte offsets of each line start, plus end-of-data (n+1 entries)
+#   <stored>.rowtree : every level of the tree, leaves first, 32 raw bytes per node
+# so fetching one row + its proof is O(log n) seeks with flat memory.
+
+import hashlib, struct
+
+RULE = 2
+LEAF_RULE = "sha256(0x00 || line_bytes without line ending); line 0 = header"
+NODE_RULE = "sha256(0x01 || left || right), duplicate last if odd"
+RULES = {
+    1: ("sha256(line_bytes without line ending); line 0 = header",
+        "sha256(left_hex || right_hex), duplicate last if odd"),
+    RULE: (LEAF_RULE, NODE_RULE),
+}
+EMPTY_ROOT = "0" * 64
+_READ = 1 << 20  # bytes per read while building
+
+def index_path(stored_path: str) -> str:
+    return stored_path + ".rowidx"
+
+def tree_path(stored_path: str) -> str:
+    return stored_path + ".rowtree"
+
+def level_sizes(n: int) -> list:
+    sizes = [n]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+def _leaf(line: bytes, rule: int = RULE) -> bytes:
+    return hashlib.sha256(line if rule == 1 else b"\x00" + line).digest()
+
+def leaf_hex(line: bytes, rule: int = RULE) -> str:
+    return _leaf(line, rule).hex()
+
+def _node(a: bytes, b: bytes, rule: int = RULE) -> bytes:
+    if rule == 1:
+        return hashlib.sha256((a.hex() + b.hex()).encode("utf-8")).digest()
+    return hashlib.sha256(b"\x01" + a + b).digest()
+
+def _strip_eol(line: bytes) -> bytes:
+    if line.endswith(b"\n"): line = line[:-1]
+    if line.endswith(b"\r"): line = line[:-1]
+    return line
+
+def build_row_tree(stored_path: str, rule: int = RULE) -> dict:
+    """Write both sidecars for `stored_path`; returns the summary stored on the evidence doc."""
+    if rule not in RULES:
+        raise ValueError(f"unknown row tree rule {rule}")
+    n = 0
+    with open(stored_path, "rb") as src, open(index_path(stored_path), "wb") as idx, \
+         open(tree_path(stored_path), "wb") as tree:
+        off = 0
+        for line in src:
+            idx.write(struct.pack("<Q", off))
+            tree.write(_leaf(_strip_eol(line), rule))
+            off += len(line)
+            n += 1
+        idx.write(struct.pack("<Q", off))
+
+    # fold level by level on disk: read level k sequentially, append level k+1
+    sizes = level_sizes(n)
+    start = 0
+    with open(tree_path(stored_path), "rb", buffering=0) as rd, open(tree_path(stored_path), "ab") as wr:
+        for size in sizes[:-1]:
+            rd.seek(start * 32)
+            left = size
+            while left > 0:
+                take = min(left, _READ // 32)
+                if take % 2 and take != left:
+                    take -= 1
+                buf = rd.read(take * 32)
+                nodes = [buf[i:i + 32] for i in range(0, len(buf), 32)]
+                if len(nodes) % 2:
+                    nodes.append(nodes[-1])
+                wr.write(b"".join(_node(nodes[i], nodes[i + 1], rule) for i in range(0, len(nodes), 2)))
+                left -= take
+            wr.flush()
+            start += size
+        root = EMPTY_ROOT
+        if n:
+            rd.seek(start * 32)
+            root = rd.read(32).hex()
+    return {"root": root, "leaves": n, "rule": rule, "leaf_rule": RULES[rule][0], "node_rule": RULES[rule][1]}
+
+def read_row(stored_path: str, index: int) -> bytes:
+    with open(index_path(stored_path), "rb") as idx:
+        idx.seek(index * 8)
+        a, b = struct.unpack("<QQ", idx.read(16))
+    with open(stored_path, "rb") as src:
+        src.seek(a)
+        return _strip_eol(src.read(b - a))
+
+def row_proof(stored_path: str, n: int, index: int) -> list:
+    """[{sibling, is_right}] from leaf to root, same shape as /proof/tx/<hash>."""
+    proof = []
+    start = 0
+    with open(tree_path(stored_path), "rb") as tree:
+        for size in level_sizes(n)[:-1]:
+            sib = index ^ 1
+            if sib >= size:  # odd tail is paired with itself
+                sib = index
+            tree.seek((start + sib) * 32)
+            proof.append({"sibling": tree.read(32).hex(), "is_right": index % 2 == 0})
+            start += size
+            index //= 2
+    return proof
+
+def verify_row(row_bytes: bytes, proof: list, root_hex: str, rule: int = RULE) -> bool:
+    cur = _leaf(row_bytes, rule)
+    for step in proof:
+        sib = bytes.fromhex(step["sibling"])
+        cur = _node(cur, sib, rule) if step.get("is_right") else _node(sib, cur, rule)
+    return cur.hex() == root_hex.lower()
@@ -0,0 +1,279 @@
+# evidence_reconcile.py
+# Vectorized reconciliation of evidence CSVs against the events that cite them.
+#
+# Checks (vectorized over chunks of CSV_CHUNK rows, no per-row Python loop; memory stays at one chunk):
+#   - totals      : sum(energy_kwh), sum(hydrogen_kg) vs linked production_events
+#   - continuity  : end > start per row, no overlapping rows, gaps reported
+#   - efficiency  : kWh per kg H2 within [EFFICIENCY_MIN_KWH_PER_KG, EFFICIENCY_MAX_KWH_PER_KG]
+#
+# Loading streams record batches from pyarrow's CSV reader when installed (optional), else np.loadtxt
+# chunks; both parse straight into typed arrays.
+#
+# env:
+#   MONGODB_URI, DB_NAME
+#   EFFICIENCY_MIN_KWH_PER_KG=39.4   (HHV of H2: nothing can beat this)
+#   EFFICIENCY_MAX_KWH_PER_KG=120
+#   EVIDENCE_GAP_TOLERANCE_S=1
+#
+# usage (bulk audit of the whole evidence store):
+#   python evidence_reconcile.py [--out reconcile_report.json] [--write]
+
+import os, sys, csv, json, time, argparse, warnings
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # optional: reconciliation is skipped without NumPy
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pa_compute
+except ImportError:
+    pa = None
+
+from evidence_ingest import EVIDENCE_COLUMNS
+
+EFF_MIN = float(os.getenv("EFFICIENCY_MIN_KWH_PER_KG", "39.4"))
+EFF_MAX = float(os.getenv("EFFICIENCY_MAX_KWH_PER_KG", "120"))
+GAP_TOLERANCE_S = float(os.getenv("EVIDENCE_GAP_TOLERANCE_S", "1"))
+SAMPLE_ROWS = 20  # row numbers listed per issue
+CSV_CHUNK = 100_000             # rows per NumPy chunk
+CSV_BLOCK_BYTES = 8 << 20       # bytes per pyarrow record batch
+
+# ---------- loading ----------
+def _header(path: str) -> list:
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        return next(csv.reader(fh), [])
+
+def _iter_arrow(path: str):
+    reader = pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+                             convert_options=pa_csv.ConvertOptions(
+        include_columns=list(EVIDENCE_COLUMNS),
+        column_types={"start_time_utc": pa.string(), "end_time_utc": pa.string(),
+                      "energy_kwh": pa.float64(), "hydrogen_kg": pa.float64()}))
+    for batch in reader:
+        out = {}
+        for key, col in (("start", "start_time_utc"), ("end", "end_time_utc")):
+            s = pa_compute.replace_substring_regex(batch.column(col), r"Z$", "")
+            out[key] = pa_compute.cast(s, pa.timestamp("us")).to_numpy(zero_copy_only=False).astype("int64")
+        out["energy_kwh"] = batch.column("energy_kwh").to_numpy(zero_copy_only=False)
+        out["hydrogen_kg"] = batch.column("hydrogen_kg").to_numpy(zero_copy_only=False)
+        yield out
+
+def _iter_numpy(path: str):
+    # np.loadtxt parses straight into typed arrays (C parser), CSV_CHUNK rows per call on the same handle
+    header = _header(path)
+    dtype = [("start", "S40"), ("end", "S40"), ("energy_kwh", "f8"), ("hydrogen_kg", "f8")]
+    usecols = [header.index(c) for c in ("start_time_utc", "end_time_utc", "energy_kwh", "hydrogen_kg")]
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        fh.readline()
+        done = 0
+        while True:
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", UserWarning)   # "input contained no data" at EOF
+                    a = np.loadtxt(fh, delimiter=",", quotechar='"', dtype=dtype, usecols=usecols,
+                                   max_rows=CSV_CHUNK, ndmin=1)
+            except ValueError as e:
+                raise ValueError(f"evidence CSV rows {done + 1}-{done + CSV_CHUNK}: {e}") from None
+            if not a.size:
+                return
+            done += a.size
+            out = {k: np.char.rstrip(np.char.strip(a[k]), b"Z").astype("datetime64[us]").astype("int64")
+                   for k in ("start", "end")}
+            out["energy_kwh"], out["hydrogen_kg"] = a["energy_kwh"], a["hydrogen_kg"]
+            yield out
+            if a.size < CSV_CHUNK:
+                return
+
+def iter_columns(path: str):
+    """Yields chunks {"start","end": int64 epoch-us, "energy_kwh","hydrogen_kg": float64}. Raises ValueError."""
+    missing = [c for c in EVIDENCE_COLUMNS if c not in _header(path)]
+    if missing:
+        raise ValueError(f"evidence CSV missing columns: {', '.join(missing)}")
+    return _iter_arrow(path) if pa is not None else _iter_numpy(path)
+
+# ---------- checks ----------
+def _us_iso(us) -> str:
+    return datetime.fromtimestamp(int(us) / 1e6, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+def _issue(rows) -> dict:
+    # rows: 0-based indices -> 1-based row numbers (same numbering as evidence_row on events)
+    return {"count": int(rows.size), "rows": (rows[:SAMPLE_ROWS] + 1).tolist()}
+
+def _add(issues: dict, name: str, rows):
+    """Merges one chunk's 0-based (file) row indices into issues[name]."""
+    it = issues.setdefault(name, {"count": 0, "rows": []})
+    it["count"] += int(rows.size)
+    it["rows"] += (rows[:SAMPLE_ROWS - len(it["rows"])] + 1).tolist()
+
+def _continuity(start, end, gap_tolerance_s: float):
+    """Overlap / gap row indices over whole start / end columns, in any row order."""
+    order = None if bool(np.all(start[1:] >= start[:-1])) else np.argsort(start, kind="stable")
+    s, e = (start, end) if order is None else (start[order], end[order])
+    delta = s[1:] - e[:-1]
+    ov, gp = np.flatnonzero(delta < 0) + 1, np.flatnonzero(delta > int(gap_tolerance_s * 1e6)) + 1
+    if order is not None:
+        ov, gp = np.sort(order[ov]), np.sort(order[gp])
+    return ov, gp
+
+def check_chunks(chunks, eff_min: float = EFF_MIN, eff_max: float = EFF_MAX,
+                 gap_tolerance_s: float = GAP_TOLERANCE_S) -> dict:
+    """Checks a file chunk by chunk; chunks() -> a fresh iterator of column chunks (see iter_columns).
+    Only one chunk is held at a time. Continuity is checked on the fly while rows come in start order (the
+    normal case); a file that is not in start order gets a second pass over its start / end columns only."""
+    n, energy_sum, h2_sum, lo, hi = 0, 0.0, 0.0, None, None
+    issues = {k: {"count": 0, "rows": []} for k in ("non_positive_duration", "negative_values", "overlaps", "gaps",
+                                                    "efficiency_out_of_bounds")}
+    prev_start = prev_end = None
+    in_order = True
+    tol = int(gap_tolerance_s * 1e6)
+    for c in chunks():
+        start, end, energy, h2 = c["start"], c["end"], c["energy_kwh"], c["hydrogen_kg"]
+        if not start.size:
+            continue
+        energy_sum += float(energy.sum())
+        h2_sum += float(h2.sum())
+        lo = start.min() if lo is None else min(lo, start.min())
+        hi = end.max() if hi is None else max(hi, end.max())
+        _add(issues, "non_positive_duration", np.flatnonzero(end <= start) + n)
+        _add(issues, "negative_values", np.flatnonzero((energy < 0) | (h2 < 0)) + n)
+        # efficiency only where H2 was produced; energy with zero H2 is idle/standby load
+        producing = h2 > 0
+        ratio = np.divide(energy, h2, out=np.zeros_like(energy), where=producing)
+        _add(issues, "efficiency_out_of_bounds", np.flatnonzero(producing & ((ratio < eff_min) | (ratio > eff_max))) + n)
+        if in_order:
+            in_order = bool(np.all(start[1:] >= start[:-1])) and (prev_start is None or start[0] >= prev_start)
+        if in_order:
+            if prev_end is None:
+                delta, base = start[1:] - end[:-1], n + 1
+            else:
+                delta, base = start - np.concatenate(([prev_end], end[:-1])), n
+            _add(issues, "overlaps", np.flatnonzero(delta < 0) + base)
+            _add(issues, "gaps", np.flatnonzero(delta > tol) + base)
+            prev_start, prev_end = start[-1], end[-1]
+        n += int(start.size)
+
+    report = {"rows": n, "totals": {"energy_kwh": energy_sum, "hydrogen_kg": h2_sum},
+              "span": None, "kwh_per_kg": None, "issues": {}}
+    if n == 0:
+        report["ok"] = False
+        report["issues"]["empty"] = {"count": 1, "rows": []}
+        return report
+    report["span"] = {"start": _us_iso(lo), "end": _us_iso(hi)}
+    if h2_sum > 0:
+        report["kwh_per_kg"] = energy_sum / h2_sum
+    if not in_order:   # second pass: 16 bytes per row instead of the whole file
+        cols = list(chunks())
+        ov, gp = _continuity(np.concatenate([c["start"] for c in cols]),
+                             np.concatenate([c["end"] for c in cols]), gap_tolerance_s)
+        issues["overlaps"], issues["gaps"] = _issue(ov), _issue(gp)
+    report["issues"] = issues
+    report["efficiency_bounds_kwh_per_kg"] = [eff_min, eff_max]
+
+    # gaps are reported but don't fail the file (plant downtime is legitimate)
+    report["ok"] = all(v["count"] == 0 for k, v in issues.items() if k != "gaps")
+    return report
+
+def check_columns(cols: dict, eff_min: float = EFF_MIN, eff_max: float = EFF_MAX,
+                  gap_tolerance_s: float = GAP_TOLERANCE_S) -> dict:
+    """check_chunks() over columns already in memory."""
+    return check_chunks(lambda: iter([cols]), eff_min, eff_max, gap_tolerance_s)
+
+def compare_claim(report: dict, claimed: dict) -> dict:
+    """claimed: {"events","energy_kwh","hydrogen_kg","start","end"} summed over linked events."""
+    n = max(report["rows"], int(claimed.get("events", 0)), 1)
+    out = {"events": int(claimed.get("events", 0))}
+    for k in ("energy_kwh", "hydrogen_kg"):
+        have, want = report["totals"][k], float(claimed.get(k, 0.0))
+        # each side is rounded to 6 dp per row/event, so allow that much drift
+        tol = n * 1e-6 + 1e-9 * max(abs(have), abs(want))
+        out[k] = {"evidence": have, "claimed": want, "diff": want - have, "ok": abs(want - have) <= tol}
+    span = report.get("span")
+    st, en = claimed.get("start"), claimed.get("end")
+    if span and st and en:
+        st = st if isinstance(st, datetime) else datetime.fromisoformat(str(st))
+        en = en if isinstance(en, datetime) else datetime.fromisoformat(str(en))
+        out["within_span"] = (datetime.fromisoformat(span["start"]) <= st
+                              and en <= datetime.fromisoformat(span["end"]))
+    out["ok"] = out["energy_kwh"]["ok"] and out["hydrogen_kg"]["ok"] and out.get("within_span", True)
+    return out
+
+def reconcile_file(path: str, claimed: dict = None) -> dict:
+    """Full report for one evidence file; never raises (non-CSV evidence -> applicable False)."""
+    if np is None:
+        return {"applicable": False, "reason": "numpy not installed"}
+    try:
+        report = {"applicable": True, **check_chunks(lambda: iter_columns(path))}
+    except (OSError, ValueError) as e:
+        return {"applicable": False, "reason": str(e)}
+    except Exception as e:  # anything else a malformed file makes the CSV readers throw
+        return {"applicable": False, "reason": f"unreadable evidence CSV: {e}"}
+    if claimed is not None:
+        report["claim"] = compare_claim(report, claimed)
+        report["ok"] = report["ok"] and report["claim"]["ok"]
+    report["checked_at"] = datetime.utcnow().isoformat()
+    return report
+
+def claimed_totals(db, evidence_ids=None) -> dict:
+    """{evidence ObjectId -> claimed totals} from production_events, one aggregation."""
+    match = {"evidence_id": {"$ne": None}}
+    if evidence_ids is not None:
+        match = {"evidence_id": {"$in": list(evidence_ids)}}
+    out = {}
+    for row in db.production_events.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$evidence_id", "events": {"$sum": 1},
+                    "energy_kwh": {"$sum": "$energy_kwh"}, "hydrogen_kg": {"$sum": "$hydrogen_kg"},
+                    "start": {"$min": "$start_time"}, "end": {"$max": "$end_time"}}}
+    ]):
+        out[row.pop("_id")] = row
+    return out
+
+# ---------- bulk audit ----------
+def audit_store(db, write: bool = False) -> dict:
+    claims = claimed_totals(db)
+    t0 = time.perf_counter()
+    summary = {"files": 0, "applicable": 0, "ok": 0, "failed": [], "rows": 0}
+    for ev in db.evidence.find({}, {"stored_path": 1, "filename": 1}):
+        rep = reconcile_file(ev["stored_path"], claims.get(ev["_id"]))
+        summary["files"] += 1
+        if write:
+            db.evidence.update_one({"_id": ev["_id"]}, {"$set": {"reconcile": rep}})
+        if not rep.get("applicable"):
+            continue
+        summary["applicable"] += 1
+        summary["rows"] += rep["rows"]
+        if rep["ok"]:
+            summary["ok"] += 1
+        else:
+            summary["failed"].append({"evidence_id": str(ev["_id"]), "filename": ev.get("filename"), "report": rep})
+    dt = time.perf_counter() - t0
+    summary["seconds"] = round(dt, 3)
+    summary["rows_per_sec"] = int(summary["rows"] / dt) if dt > 0 else None
+    return summary
+
+def main():
+    ap = argparse.ArgumentParser(description="Reconcile every evidence file against its linked events")
+    ap.add_argument("--out", default="reconcile_report.json")
+    ap.add_argument("--write", action="store_true", help="store each report on its evidence document")
+    args = ap.parse_args()
+    if np is None:
+        raise SystemExit("numpy is required: pip install numpy")
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "h2_registry")]
+
+    summary = audit_store(db, write=args.write)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, default=str)
+    print(f"files={summary['files']} csv={summary['applicable']} ok={summary['ok']} "
+          f"failed={len(summary['failed'])} rows={summary['rows']} ({summary['rows_per_sec']} rows/s)")
+    print("✔ wrote", args.out)
+    sys.exit(1 if summary["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# fastjson.py
+# One-pass JSON encoding for API responses.
+#   ObjectId -> str
+#   datetime -> str(dt) ("2024-01-01 12:00:00.123000"), exactly what json.dumps(default=str) gave j();
+#               iso=True (j_ok) -> ISO-8601 UTC with "Z" (naive datetimes are UTC, as stored by Mongo), as to_public() did
+# Types are handled inside the encoder, so payloads are never copied first (old to_public walk).
+# Output is compact (no spaces after "," and ":"); only the whitespace differs from the old json.dumps output.
+#
+# Backend: orjson when installed, stdlib json otherwise. Force one with JSON_BACKEND=orjson|stdlib.
+# orjson can't encode ints wider than 64 bits; those payloads fall back to stdlib transparently.
+
+import os, json
+from datetime import datetime, timezone
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:  # optional fast path
+    orjson = None
+
+BACKEND = os.getenv("JSON_BACKEND", "orjson" if orjson else "stdlib")
+if BACKEND == "orjson" and orjson is None:
+    BACKEND = "stdlib"
+
+def iso_z(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def public_default(x):
+    """Encoder hook for everything json/orjson can't do natively: str(), like the old default=str."""
+    return str(x)
+
+def iso_default(x):
+    if isinstance(x, datetime):
+        return iso_z(x)
+    return str(x)
+
+if orjson is not None:
+    # str(dt) needs the default hook; ISO "Z" is orjson's own datetime output (naive = UTC)
+    _OR_OPTS     = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    _OR_OPTS_ISO = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+def dumps_stdlib(data, iso: bool = False) -> bytes:
+    return json.dumps(data, default=iso_default if iso else public_default, separators=(",", ":")).encode("utf-8")
+
+def dumps(data, iso: bool = False) -> bytes:
+    if BACKEND == "orjson":
+        try:
+            if iso:
+                return orjson.dumps(data, default=iso_default, option=_OR_OPTS_ISO)
+            return orjson.dumps(data, default=public_default, option=_OR_OPTS)
+        except TypeError:  # JSONEncodeError: e.g. uint256 ints
+            pass
+    return dumps_stdlib(data, iso)
+
+def to_public(x):
+    """Recursively convert ObjectId and datetime to JSON-safe values (for callers that need the dict)."""
+    if isinstance(x, dict):
+        return {k: to_public(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [to_public(v) for v in x]
+    if isinstance(x, ObjectId):
+        return str(x)
+    if isinstance(x, datetime):
+        return iso_z(x)
+    return x
@@ -0,0 +1,335 @@
+# gen_dataset.py
+# Seedable synthetic registry written straight into Mongo with bulk inserts, for benchmarks.
+#
+# Produces the same document shapes the API writes:
+#   accounts, sensors (one electrolyzer each), production_events (signed, non-overlapping, verified),
+#   credits (minted per event, then split by transfers / partial retirements / market buys),
+#   retirements, market_offers (open and closed), ledger_txs (same tx_hash rule as ledger_doc),
+#   blocks (closed every --block-size txs, Merkle root + chain hash as close_block computes them)
+#
+# Same --seed => same documents, ObjectIds and signatures, so benchmark runs are repeatable.
+# Memory is bounded by --chunk sensors at a time, so it scales to millions of documents.
+#
+# usage:
+#   python gen_dataset.py --db h2_bench --drop --accounts 2000 --sensors 5000 --events-per-sensor 200
+#   python gen_dataset.py --db h2_bench --drop --sensors 20000 --events-per-sensor 100 --block-size 5000 --seed 7
+#
+# Benchmarks then point the app at it:  DB_NAME=h2_bench python app.py
+
+import argparse, os, random, struct, sys, time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives import serialization
+
+from app import (canonical_json, ledger_doc, merkle_root, sha256_hex, kg_to_g, ensure_indexes,
+                 MONGODB_URI, DB_NAME)
+from utils import derive_onchain_block_id
+
+COLLECTIONS = ("accounts", "sensors", "production_events", "credits", "retirements",
+               "market_offers", "ledger_txs", "blocks", "evidence", "idempotency_keys")
+EPOCH = datetime(2024, 1, 1)
+SLOT = timedelta(minutes=15)
+
+class Ids:
+    """Deterministic, increasing ObjectIds: 4-byte synthetic timestamp + 3-byte seed tag + 5-byte counter."""
+    def __init__(self, seed: int):
+        self.tag = struct.pack(">I", seed & 0xFFFFFF)[1:]
+        self.n = 0
+
+    def new(self, at: datetime) -> ObjectId:
+        self.n += 1
+        ts = int((at - datetime(1970, 1, 1)).total_seconds())
+        return ObjectId(struct.pack(">I", ts) + self.tag + self.n.to_bytes(5, "big"))
+
+class Sink:
+    """Per-collection buffers flushed with unordered insert_many."""
+    def __init__(self, db, batch: int):
+        self.db, self.batch = db, batch
+        self.buf = {}
+        self.counts = {}
+
+    def add(self, coll: str, doc: dict):
+        b = self.buf.setdefault(coll, [])
+        b.append(doc)
+        if len(b) >= self.batch:
+            self.flush(coll)
+
+    def flush(self, coll: str = None):
+        for name in ([coll] if coll else list(self.buf)):
+            docs = self.buf.get(name)
+            if docs:
+                self.db[name].insert_many(docs, ordered=False)
+                self.counts[name] = self.counts.get(name, 0) + len(docs)
+                self.buf[name] = []
+
+class Ledger:
+    """Buffers txs of the open block; cut() closes it exactly like close_block() (minus the chain)."""
+    def __init__(self, sink: Sink, ids: Ids, block_size: int, clock):
+        self.sink, self.ids, self.block_size, self.clock = sink, ids, block_size, clock
+        self.open = []          # tx docs not yet in a block
+        self.mints = []         # credit docs minted in the open block
+        self.prev_root = None
+        self.blocks = 0
+
+    def append(self, tx_type: str, payload: dict, minted_credit: dict = None):
+        doc = ledger_doc(tx_type, payload)
+        doc["created_at"] = self.clock()
+        doc["_id"] = self.ids.new(doc["created_at"])
+        self.open.append(doc)
+        if minted_credit is not None:
+            self.mints.append(minted_credit)
+        if len(self.open) >= self.block_size:
+            self.cut()
+
+    def cut(self, note: str = None):
+        if not self.open:
+            return
+        root = merkle_root([t["tx_hash"] for t in self.open])
+        at = self.clock()
+        block_id = self.ids.new(at)
+        self.sink.add("blocks", {
+            "_id": block_id,
+            "prev_hash": self.prev_root,
+            "merkle_root": root,
+            "chain_hash": sha256_hex(((self.prev_root or "") + root).encode("utf-8")),
+            "seq": self.blocks + 1,
+            "tx_count": len(self.open),
+            "note": note,
+            "created_at": at,
+            "anchor_tx": None,
+            "contract_address": os.getenv("ANCHOR_CONTRACT_ADDRESS"),
+            "chain": os.getenv("CHAIN_NAME", "sepolia"),
+            "onchain_block_id": str(derive_onchain_block_id(str(block_id))),
+        })
+        for t in self.open:
+            t["block_id"] = block_id
+            self.sink.add("ledger_txs", t)
+        for c in self.mints:    # close_block flips this block's mints to active
+            c["status"], c["block_id"] = "active", block_id
+        self.prev_root = root
+        self.open, self.mints = [], []
+        self.blocks += 1
+
+def pem(sk) -> str:
+    return sk.public_key().public_bytes(serialization.Encoding.PEM,
+                                        serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+class Generator:
+    def __init__(self, db, args):
+        self.a = args
+        self.rng = random.Random(args.seed)
+        self.ids = Ids(args.seed)
+        self.sink = Sink(db, args.batch)
+        self.t = EPOCH
+        self.ledger = Ledger(self.sink, self.ids, args.block_size, self.tick)
+        self.producers, self.buyers = [], []
+
+    def tick(self) -> datetime:
+        self.t += timedelta(milliseconds=1)
+        return self.t
+
+    def key(self):
+        return Ed25519PrivateKey.from_private_bytes(self.rng.randbytes(32))
+
+    # ---- accounts / sensors ----
+    def accounts(self):
+        n_prod = max(1, int(self.a.accounts * self.a.producer_share))
+        for i in range(max(2, self.a.accounts)):
+            role = "producer" if i < n_prod else "buyer"
+            oid = self.ids.new(self.tick())
+            self.sink.add("accounts", {"_id": oid, "name": f"syn-{role}-{i}", "role": role,
+                                       "public_key_pem": pem(self.key())})
+            self.ledger.append("account_create", {"account_id": str(oid), "role": role})
+            (self.producers if role == "producer" else self.buyers).append(oid)
+
+    def sensor(self, i: int):
+        sk = self.key()
+        oid = self.ids.new(self.tick())
+        owner = self.producers[i % len(self.producers)]
+        elx = f"SYN-E{i:07d}"
+        self.sink.add("sensors", {"_id": oid, "name": f"syn-meter-{i}", "electrolyzer_id": elx,
+                                  "owner_account_id": owner, "public_key_pem": pem(sk)})
+        self.ledger.append("sensor_register", {"sensor_id": str(oid), "electrolyzer_id": elx})
+        return {"_id": oid, "sk": sk, "owner": owner, "elx": elx}
+
+    # ---- events + mints ----
+    def events_and_mints(self, s: dict) -> list:
+        credits = []
+        st = EPOCH + SLOT * self.rng.randrange(0, 96)
+        for _ in range(self.a.events_per_sensor):
+            en = st + SLOT
+            kwh = round(self.rng.uniform(200, 800), 3)
+            kg = round(kwh / self.rng.uniform(48, 56), 6)
+            payload = {"sensor_id": str(s["_id"]), "start_time": st.isoformat(), "end_time": en.isoformat(),
+                       "energy_kwh": round(kwh, 6), "hydrogen_kg": round(kg, 6), "evidence_id": None}
+            canonical = canonical_json(payload)
+            created = self.tick()
+            ev_id, cred_id = self.ids.new(created), self.ids.new(created)
+            self.sink.add("production_events", {
+                "_id": ev_id, "sensor_id": s["_id"], "electrolyzer_id": s["elx"],
+                "start_time": st, "end_time": en, "energy_kwh": kwh, "hydrogen_kg": kg,
+                "evidence_id": None, "payload_canonical": canonical,
+                "sensor_signature_hex": s["sk"].sign(canonical.encode("utf-8")).hex(),
+                "signature_valid": True, "overlap_ok": True, "verified": True,
+                "created_at": created, "minted_credit_id": cred_id})
+            self.ledger.append("event", {"event_id": str(ev_id), "electrolyzer_id": s["elx"],
+                                         "start_time": payload["start_time"], "end_time": payload["end_time"],
+                                         "hydrogen_kg": payload["hydrogen_kg"]})
+            amount_g = kg_to_g(kg)
+            cred = {"_id": cred_id, "amount_g": amount_g, "status": "pending",
+                    "producer_account_id": s["owner"], "owner_account_id": s["owner"], "event_id": ev_id,
+                    "block_id": None, "anchor_tx": None, "created_at": self.tick()}
+            credits.append(cred)
+            self.ledger.append("mint", {"credit_id": str(cred_id), "event_id": str(ev_id), "amount_g": amount_g,
+                                        "owner_account_id": str(s["owner"])}, minted_credit=cred)
+            # small random gap; slots never overlap on one electrolyzer
+            st = en + SLOT * self.rng.randrange(0, 3)
+        return credits
+
+    # ---- secondary activity on active credits ----
+    def transfer(self, cred: dict, credits: list, depth: int = 0):
+        to = self.rng.choice(self.buyers + self.producers)
+        if to == cred["owner_account_id"] or cred["amount_g"] < 2:
+            return
+        whole = self.rng.random() < 0.2
+        amount = cred["amount_g"] if whole else self.rng.randint(1, cred["amount_g"] - 1)
+        payload = {"credit_id": str(cred["_id"]), "from_account_id": str(cred["owner_account_id"]),
+                   "to_account_id": str(to), "amount_g": amount}
+        if whole:
+            cred["owner_account_id"] = to
+            new = cred
+        else:
+            cred["amount_g"] -= amount
+            new = {"_id": self.ids.new(self.t), "amount_g": amount, "status": cred["status"],
+                   "producer_account_id": cred["producer_account_id"], "owner_account_id": to,
+                   "event_id": cred["event_id"], "block_id": cred.get("block_id"),
+                   "anchor_tx": cred.get("anchor_tx"), "created_at": self.tick()}
+            credits.append(new)
+        self.ledger.append("transfer", {**payload, "new_credit_id": str(new["_id"])})
+        # split histories: received credits are sometimes passed on again
+        if depth < self.a.max_split_depth and self.rng.random() < self.a.transfer_ratio:
+            self.transfer(new, credits, depth + 1)
+
+    def retire(self, cred: dict):
+        if cred["amount_g"] < 1 or cred["status"] == "retired":
+            return
+        full = self.rng.random() < 0.3
+        amount = cred["amount_g"] if full else self.rng.randint(1, max(1, cred["amount_g"] // 2))
+        reason = self.rng.choice(["green steel batch", "ammonia offtake", "refinery scope 2", "voluntary"])
+        if amount == cred["amount_g"]:
+            cred["status"] = "retired"
+        else:
+            cred["amount_g"] -= amount
+            self.sink.add("retirements", {"_id": self.ids.new(self.t), "credit_id": cred["_id"],
+                                          "owner_account_id": cred["owner_account_id"], "amount_g": amount,
+                                          "reason": reason, "timestamp": self.tick()})
+        self.ledger.append("retire", {"credit_id": str(cred["_id"]), "owner_account_id": str(cred["owner_account_id"]),
+                                      "amount_g": amount, "reason": reason})
+
+    def offer(self, cred: dict, credits: list):
+        available = cred["amount_g"] - cred.get("locked_g", 0)
+        if available < 10 or cred["owner_account_id"] not in self._producer_set:
+            return
+        amount = self.rng.randint(1, available // 2)
+        price = round(self.rng.uniform(0.05, 0.25), 4)
+        cred["locked_g"] = cred.get("locked_g", 0) + amount
+        producer_id = str(cred["owner_account_id"])
+        offer = {"_id": self.ids.new(self.t), "producer_id": producer_id, "credit_id": str(cred["_id"]),
+                 "amount_g": amount, "price_per_g": price, "created_at": self.tick(), "status": "open"}
+        self.ledger.append("market_list", {"offer_id": str(offer["_id"]), "producer_id": producer_id,
+                                           "credit_id": str(cred["_id"]), "amount_g": amount, "price_per_g": price})
+        if self.rng.random() < self.a.buy_ratio:
+            buyer = self.rng.choice(self.buyers)
+            take = offer["amount_g"] if self.rng.random() < 0.5 else self.rng.randint(1, offer["amount_g"])
+            cred["amount_g"] -= take
+            cred["locked_g"] -= take
+            bought = {"_id": self.ids.new(self.t), "amount_g": take, "owner_account_id": buyer, "status": "issued",
+                      "from_offer": str(offer["_id"]), "source_credit_id": str(cred["_id"]), "created_at": self.tick()}
+            credits.append(bought)
+            offer["amount_g"] -= take
+            offer["status"] = "closed" if offer["amount_g"] == 0 else "open"
+            self.ledger.append("market_buy", {"buyer_id": str(buyer), "producer_id": producer_id,
+                                              "offer_id": str(offer["_id"]), "new_credit_id": str(bought["_id"]),
+                                              "amount_g": take, "price_per_g": price})
+        self.sink.add("market_offers", offer)
+
+    def run(self):
+        a = self.a
+        t0 = time.perf_counter()
+        self.accounts()
+        self._producer_set = set(self.producers)
+        for lo in range(0, a.sensors, a.chunk):
+            credits = []
+            for i in range(lo, min(a.sensors, lo + a.chunk)):
+                credits += self.events_and_mints(self.sensor(i))
+            self.ledger.cut()   # mints must be in a closed block (active) before they move
+            for cred in list(credits):
+                r = self.rng.random()
+                if r < a.transfer_ratio:
+                    self.transfer(cred, credits)
+                elif r < a.transfer_ratio + a.retire_ratio:
+                    self.retire(cred)
+                elif r < a.transfer_ratio + a.retire_ratio + a.offer_ratio:
+                    self.offer(cred, credits)
+            for cred in credits:
+                self.sink.add("credits", cred)
+            done = min(a.sensors, lo + a.chunk)
+            n = sum(self.sink.counts.values()) + sum(len(v) for v in self.sink.buf.values())
+            print(f"  sensors {done}/{a.sensors}  docs {n:,}  blocks {self.ledger.blocks}  "
+                  f"{n / max(1e-9, time.perf_counter() - t0):,.0f} docs/s", file=sys.stderr)
+        if a.open_tail:
+            # leave the last txs pending so close_block has real work in benchmarks
+            tail, self.ledger.open = self.ledger.open, []
+            for t in tail:
+                self.sink.add("ledger_txs", t)
+        else:
+            self.ledger.cut()
+        self.sink.flush()
+        return time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a consistent synthetic registry in Mongo")
+    ap.add_argument("--uri", default=MONGODB_URI)
+    ap.add_argument("--db", default=DB_NAME)
+    ap.add_argument("--drop", action="store_true", help="drop registry collections first")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--accounts", type=int, default=200)
+    ap.add_argument("--producer-share", type=float, default=0.3)
+    ap.add_argument("--sensors", type=int, default=500)
+    ap.add_argument("--events-per-sensor", type=int, default=50)
+    ap.add_argument("--transfer-ratio", type=float, default=0.3, help="share of credits transferred (partial or whole)")
+    ap.add_argument("--max-split-depth", type=int, default=3)
+    ap.add_argument("--retire-ratio", type=float, default=0.15)
+    ap.add_argument("--offer-ratio", type=float, default=0.1)
+    ap.add_argument("--buy-ratio", type=float, default=0.5, help="share of offers (partly) bought")
+    ap.add_argument("--block-size", type=int, default=2000, help="txs per closed block")
+    ap.add_argument("--open-tail", action="store_true", help="leave the last partial block's txs pending")
+    ap.add_argument("--chunk", type=int, default=200, help="sensors held in memory at once")
+    ap.add_argument("--batch", type=int, default=5000, help="docs per insert_many")
+    ap.add_argument("--no-indexes", action="store_true", help="skip ensure_indexes() after loading")
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri)[args.db]
+    if args.drop:
+        for c in COLLECTIONS:
+            db[c].drop()
+    elif any(db[c].estimated_document_count() for c in ("ledger_txs", "blocks", "credits")):
+        sys.exit(f"❌ {args.db} already has registry data; use --drop or another --db")
+
+    print(f"== generating into {args.db} (seed {args.seed}) ==", file=sys.stderr)
+    gen = Generator(db, args)
+    elapsed = gen.run()
+    if not args.no_indexes:
+        t = time.perf_counter()
+        ensure_indexes(db)
+        print(f"  indexes built in {time.perf_counter() - t:.1f}s", file=sys.stderr)
+    total = sum(gen.sink.counts.values())
+    for c in sorted(gen.sink.counts):
+        print(f"{c:<20}{gen.sink.counts[c]:>12,}")
+    print(f"{'total':<20}{total:>12,}  in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} docs/s), "
+          f"{gen.ledger.blocks} blocks")
+
+if __name__ == "__main__":
+    main()
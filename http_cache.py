@@ -0,0 +1,83 @@
+# http_cache.py
+# Strong ETags + an in-process LRU for closed-block resources.
+#
+# A closed block's header, tx list and per-tx Merkle proofs only change when anchor_tx is set,
+# so every response is keyed on (route, id, block_id, anchor_tx):
+#   anchored      -> Cache-Control: public, max-age=31536000, immutable   (served without Mongo)
+#   not anchored  -> Cache-Control: public, no-cache                      (revalidated with one point read)
+# Conditional GETs (If-None-Match) get 304 with no body.
+#
+#   BLOCK_CACHE_ENTRIES=4096      max cached responses per process
+#   BLOCK_CACHE_BYTES=67108864    max cached body bytes per process
+
+import os, hashlib, threading
+from collections import OrderedDict
+
+import metrics
+
+MAX_ENTRIES = int(os.getenv("BLOCK_CACHE_ENTRIES", "4096"))
+MAX_BYTES   = int(os.getenv("BLOCK_CACHE_BYTES", str(64 << 20)))
+
+IMMUTABLE   = "public, max-age=31536000, immutable"
+REVALIDATE  = "public, no-cache"
+
+CACHE_EVENTS = metrics.Counter("block_cache_total", "Closed-block response cache lookups", ("kind", "result"))
+
+class Entry:
+    __slots__ = ("etag", "body", "block_id", "anchor_tx")
+
+    def __init__(self, etag: str, body: bytes, block_id, anchor_tx):
+        self.etag, self.body, self.block_id, self.anchor_tx = etag, body, block_id, anchor_tx
+
+    @property
+    def immutable(self) -> bool:
+        return self.anchor_tx is not None
+
+class LRUCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self._d = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            ent = self._d.get(key)
+            if ent is not None:
+                self._d.move_to_end(key)
+            return ent
+
+    def put(self, key, ent: Entry):
+        if len(ent.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._d.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._d[key] = ent
+            self._bytes += len(ent.body)
+            while len(self._d) > self.max_entries or self._bytes > self.max_bytes:
+                _, ev = self._d.popitem(last=False)
+                self._bytes -= len(ev.body)
+
+    def pop(self, key):
+        with self._lock:
+            ent = self._d.pop(key, None)
+            if ent is not None:
+                self._bytes -= len(ent.body)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+            self._bytes = 0
+
+def etag_for(kind: str, key: str, block_id, anchor_tx) -> str:
+    return hashlib.sha256(f"{kind}|{key}|{block_id}|{anchor_tx or ''}".encode()).hexdigest()[:32]
+
+def respond(ent: Entry, request):
+    """200 with the cached body, or 304 if the client's If-None-Match already has it."""
+    from flask import Response
+    resp = Response(ent.body, mimetype="application/json")
+    resp.set_etag(ent.etag)
+    resp.headers["Cache-Control"] = IMMUTABLE if ent.immutable else REVALIDATE
+    return resp.make_conditional(request)
@@ -0,0 +1,95 @@
+# idempotency.py
+# Idempotency-Key support for mutating POSTs (field gateways retry after timeouts).
+#
+#   POST /api/v1/events   Idempotency-Key: <client-chosen, <= 255 printable chars>
+#
+# First request with a key claims it (insert of {_id: "<scope>:<key>", state: "pending"}), runs
+# the view, and stores status + body. Retries with the same key and same body get the stored
+# response back (header Idempotent-Replayed: true) without re-running signature checks or writes.
+#   same key, different body       -> 422
+#   same key, first still running  -> 409 + Retry-After
+#   view raised / returned 5xx     -> key released so the retry runs for real
+#
+# Records live in db.idempotency_keys; a TTL index on created_at drops them after
+# IDEMPOTENCY_TTL_S (default 24h). A "pending" claim older than IDEMPOTENCY_LOCK_S (default 60s)
+# is treated as abandoned (worker died) and may be taken over.
+
+import os, hashlib, functools
+from datetime import datetime, timedelta
+
+TTL_S  = int(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 3600)))
+LOCK_S = int(os.getenv("IDEMPOTENCY_LOCK_S", "60"))
+HEADER = "Idempotency-Key"
+MAX_KEY_LEN = 255
+
+INDEX = ("idempotency_keys", "created_at", {"expireAfterSeconds": TTL_S})
+
+def _fingerprint(request) -> str:
+    h = hashlib.sha256()
+    h.update(request.method.encode() + b" " + request.path.encode() + b"\n")
+    h.update(request.get_data(cache=True))
+    return h.hexdigest()
+
+def _err(msg: str, code: int, **headers):
+    from flask import Response
+    from fastjson import dumps
+    return Response(dumps({"error": msg}), status=code, mimetype="application/json", headers=headers)
+
+def _replay(rec):
+    from flask import Response
+    return Response(rec["body"], status=rec["status"], mimetype=rec.get("mimetype", "application/json"),
+                    headers={"Idempotent-Replayed": "true"})
+
+def _claim(coll, rid: str, fp: str):
+    """None if we own the key now, else the existing record."""
+    from pymongo.errors import DuplicateKeyError
+    now = datetime.utcnow()
+    try:
+        coll.insert_one({"_id": rid, "fingerprint": fp, "state": "pending", "created_at": now})
+        return None
+    except DuplicateKeyError:
+        pass
+    # take over an abandoned claim (same request only)
+    stale = coll.find_one_and_update(
+        {"_id": rid, "fingerprint": fp, "state": "pending", "created_at": {"$lt": now - timedelta(seconds=LOCK_S)}},
+        {"$set": {"created_at": now}})
+    if stale is not None:
+        return None
+    return coll.find_one({"_id": rid}) or {"state": "pending", "fingerprint": fp}
+
+def idempotent(db, scope: str):
+    """Decorator for a Flask view; db is the (lazy) registry database."""
+    def deco(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request, current_app
+            key = request.headers.get(HEADER)
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LEN or not key.isprintable():
+                return _err(f"{HEADER} must be 1-{MAX_KEY_LEN} printable characters", 400)
+
+            coll = db.idempotency_keys
+            rid, fp = f"{scope}:{key}", _fingerprint(request)
+            rec = _claim(coll, rid, fp)
+            if rec is not None:
+                if rec.get("fingerprint") != fp:
+                    return _err(f"{HEADER} was already used with a different request", 422)
+                if rec.get("state") != "done":
+                    return _err(f"a request with this {HEADER} is still in progress", 409, **{"Retry-After": "1"})
+                return _replay(rec)
+
+            try:
+                resp = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                coll.delete_one({"_id": rid, "state": "pending"})
+                raise
+            if resp.status_code >= 500:
+                coll.delete_one({"_id": rid, "state": "pending"})
+                return resp
+            coll.update_one({"_id": rid}, {"$set": {
+                "state": "done", "status": resp.status_code, "body": resp.get_data(),
+                "mimetype": resp.mimetype, "completed_at": datetime.utcnow()}})
+            return resp
+        return wrapper
+    return deco
@@ -0,0 +1,38 @@
+# lazy_mongo.py
+# Drop-in stand-in for a pymongo Database that connects on first use.
+#
+# Importing app.py therefore opens no sockets, and each gunicorn worker builds its own
+# MongoClient after fork (a client created in the master is not fork-safe).
+#
+#   db = LazyDatabase(MONGODB_URI, DB_NAME, event_listeners=[...])
+#   db.credits.find_one(...)     # first access in this process connects
+
+import os, threading
+
+class LazyDatabase:
+    def __init__(self, uri: str, name: str, **client_kwargs):
+        self._uri, self._name, self._kw = uri, name, client_kwargs
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The real pymongo Database for this process (created on first call / after fork)."""
+        pid = os.getpid()
+        if self._db is None or self._pid != pid:
+            with self._lock:
+                if self._db is None or self._pid != pid:
+                    from pymongo import MongoClient
+                    self._db = MongoClient(self._uri, **self._kw)[self._name]
+                    self._pid = pid
+        return self._db
+
+    @property
+    def connected(self) -> bool:
+        return self._db is not None and self._pid == os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        return self.get()[name]
@@ -0,0 +1,302 @@
+# ledger_replay.py
+# Rebuilds credit state and balances from the append-only ledger_txs alone (no reads of db.credits).
+#
+# mint / transfer / retire / multi_transfer / multi_retire / market_list / market_buy / merge payloads are applied block by block (_id order)
+# and, inside a block, in created_at order: the order close_block() hashed them in. Every K blocks the
+# whole state is written to db.ledger_checkpoints (zlib'd canonical JSON, split into chunks in
+# db.ledger_checkpoint_chunks), so the state at any block = nearest checkpoint at or before it + at
+# most K-1 replayed blocks.
+#
+#   python ledger_replay.py build --every 100             # extend checkpoints up to the newest block
+#   python ledger_replay.py state --at-block <block_id>   # balances + SMT root after that block
+#   python ledger_replay.py state --account <id>          # one account at the tip
+#   python ledger_replay.py verify                        # tip + pending txs vs db.credits
+#
+# Replay is deterministic: the same ledger always gives the same state digest and state root.
+#
+# env: MONGODB_URI, DB_NAME, LEDGER_CHECKPOINT_EVERY=100
+
+import os, sys, json, zlib, time, hashlib, argparse
+from datetime import datetime
+
+EVERY = int(os.getenv("LEDGER_CHECKPOINT_EVERY", "100"))
+CHUNK_BYTES = 8 << 20
+REPLAY_TYPES = ("mint", "transfer", "retire", "multi_transfer", "multi_retire", "market_list", "market_buy", "merge")
+
+CHECKPOINTS = "ledger_checkpoints"
+CHUNKS = "ledger_checkpoint_chunks"
+INDEXES = [
+    (CHUNKS, [("checkpoint", 1), ("i", 1)], {}),
+]
+
+class LedgerState:
+    """Credits as the ledger says they are: credit_id -> [owner_account_id, amount_g, retired]."""
+
+    def __init__(self, credits: dict = None, offers: dict = None):
+        self.credits = credits if credits is not None else {}
+        self.offers = offers if offers is not None else {}   # offer_id -> credit_id (for market_buy)
+
+    def apply(self, typ: str, p: dict):
+        """Apply one tx payload; returns None, or the reason it could not apply (state unchanged)."""
+        c = self.credits
+        if typ == "mint":
+            c[p["credit_id"]] = [str(p["owner_account_id"]), int(p["amount_g"]), False]
+            return None
+        if typ == "market_list":
+            self.offers[p["offer_id"]] = p["credit_id"]
+            return None
+        if typ == "merge":
+            return self._merge(p)
+        if typ in ("multi_transfer", "multi_retire"):
+            return self._multi(typ, p)
+        if typ not in REPLAY_TYPES:
+            return None
+        src_id = self.offers.get(p["offer_id"]) if typ == "market_buy" else p["credit_id"]
+        src, amt = c.get(src_id), int(p["amount_g"])
+        owner = p.get("from_account_id") if typ == "transfer" else p.get("owner_account_id")
+        why = self._check(src, amt, None if typ == "market_buy" else owner)
+        if why:
+            return why
+        # same transitions as the transfer / retire / market buy routes
+        if typ == "transfer" and p.get("new_credit_id") == src_id:
+            src[0] = str(p["to_account_id"])
+        elif typ == "retire" and amt == src[1]:
+            src[2] = True
+        else:
+            src[1] -= amt
+            if typ == "transfer":
+                c[p["new_credit_id"]] = [str(p["to_account_id"]), amt, False]
+            elif typ == "market_buy":
+                c[p["new_credit_id"]] = [str(p["buyer_id"]), amt, False]
+        return None
+
+    @staticmethod
+    def _check(src, amt: int, owner):
+        if src is None:
+            return "unknown_credit"
+        if src[2]:
+            return "credit_retired"
+        if amt <= 0 or amt > src[1]:
+            return "amount_exceeds_credit"
+        if owner is not None and src[0] != str(owner):
+            return "not_owner"
+        return None
+
+    def _multi(self, typ: str, p: dict):
+        # multi_credit.py: one signed amount spread over several credits; all parts apply or none
+        one = "transfer" if typ == "multi_transfer" else "retire"
+        owner = p["from_account_id"] if one == "transfer" else p["owner_account_id"]
+        if len({x["credit_id"] for x in p["parts"]}) != len(p["parts"]):
+            return "duplicate_part"
+        for x in p["parts"]:
+            why = self._check(self.credits.get(x["credit_id"]), int(x["amount_g"]), owner)
+            if why:
+                return why
+        for x in p["parts"]:
+            if one == "transfer":
+                self.apply("transfer", {"credit_id": x["credit_id"], "from_account_id": owner,
+                                        "to_account_id": p["to_account_id"], "amount_g": x["amount_g"],
+                                        "new_credit_id": x["new_credit_id"]})
+            else:
+                self.apply("retire", {"credit_id": x["credit_id"], "owner_account_id": owner, "amount_g": x["amount_g"]})
+        return None
+
+    def _merge(self, p: dict):
+        # credit_compaction.py: fragments folded into one credit of the same owner; the fragments are gone
+        c, owner = self.credits, str(p["owner_account_id"])
+        tgt = c.get(p["credit_id"])
+        if tgt is None:
+            return "unknown_credit"
+        if tgt[2]:
+            return "credit_retired"
+        if tgt[0] != owner:
+            return "not_owner"
+        for m in p["merged_from"]:
+            src = c.get(m["credit_id"])
+            if src is None or src[2] or src[0] != owner or src[1] != int(m["amount_g"]) or m["credit_id"] == p["credit_id"]:
+                return "merge_source_mismatch"
+        for m in p["merged_from"]:
+            del c[m["credit_id"]]
+            tgt[1] += int(m["amount_g"])
+        return None
+
+    def balances(self) -> dict:
+        """account_id -> grams over credits that are not retired (same rule as app._fetch_balances)."""
+        out = {}
+        for owner, amount, retired in self.credits.values():
+            if not retired and amount:
+                out[owner] = out.get(owner, 0) + amount
+        return {k: v for k, v in out.items() if v}
+
+    def dumps(self) -> bytes:
+        return json.dumps({"credits": self.credits, "offers": self.offers},
+                          separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data: bytes) -> "LedgerState":
+        d = json.loads(data)
+        return cls(d["credits"], d["offers"])
+
+# ---------------- reading the ledger ----------------
+
+def iter_block_txs(db, blocks: list, group: int = 64):
+    """(block, [tx...]) for each block, txs in hashing order; one query per `group` blocks."""
+    for i in range(0, len(blocks), group):
+        part = blocks[i:i + group]
+        by_block = {b["_id"]: [] for b in part}
+        for t in db.ledger_txs.find({"block_id": {"$in": list(by_block)}, "type": {"$in": list(REPLAY_TYPES)}},
+                                    {"type": 1, "payload": 1, "tx_hash": 1, "block_id": 1, "created_at": 1}):
+            by_block[t["block_id"]].append(t)
+        for b in part:
+            yield b, sorted(by_block[b["_id"]], key=lambda t: (t["created_at"], t["_id"]))
+
+def replay(db, state: LedgerState, blocks: list, on_block=None) -> list:
+    """Applies blocks in order; returns [(tx_hash, type, reason)] for txs that could not apply."""
+    errors = []
+    for b, txs in iter_block_txs(db, blocks):
+        for t in txs:
+            why = state.apply(t["type"], t["payload"])
+            if why:
+                errors.append((t["tx_hash"], t["type"], why))
+        if on_block:
+            on_block(b)
+    return errors
+
+def replay_pending(db, state: LedgerState) -> list:
+    errors = []
+    q = {"$or": [{"block_id": None}, {"block_id": {"$exists": False}}], "type": {"$in": list(REPLAY_TYPES)}}
+    for t in db.ledger_txs.find(q, {"type": 1, "payload": 1, "tx_hash": 1}).sort([("created_at", 1), ("_id", 1)]):
+        why = state.apply(t["type"], t["payload"])
+        if why:
+            errors.append((t["tx_hash"], t["type"], why))
+    return errors
+
+# ---------------- checkpoints ----------------
+
+def state_root(state: LedgerState) -> str:
+    from phase2.smt_state import build_state_root
+    return build_state_root(state.balances())
+
+def save_checkpoint(db, block: dict, height: int, state: LedgerState) -> dict:
+    from bson import Binary
+    raw = state.dumps()
+    blob = zlib.compress(raw, 6)
+    parts = [blob[i:i + CHUNK_BYTES] for i in range(0, len(blob), CHUNK_BYTES)] or [b""]
+    db[CHUNKS].delete_many({"checkpoint": block["_id"]})
+    db[CHUNKS].insert_many([{"checkpoint": block["_id"], "i": i, "data": Binary(p)} for i, p in enumerate(parts)])
+    doc = {
+        "_id": block["_id"], "height": height, "merkle_root": block.get("merkle_root"),
+        "state_sha256": hashlib.sha256(raw).hexdigest(),
+        "credits": len(state.credits), "chunks": len(parts), "bytes": len(blob),
+        "created_at": datetime.utcnow(),
+    }
+    # written last: a checkpoint exists only once all of its chunks do
+    db[CHECKPOINTS].replace_one({"_id": block["_id"]}, doc, upsert=True)
+    return doc
+
+def load_checkpoint(db, ckpt: dict) -> LedgerState:
+    parts = list(db[CHUNKS].find({"checkpoint": ckpt["_id"]}).sort("i", 1))
+    if len(parts) != ckpt["chunks"]:
+        raise ValueError(f"checkpoint {ckpt['_id']} is missing chunks")
+    raw = zlib.decompress(b"".join(bytes(p["data"]) for p in parts))
+    if hashlib.sha256(raw).hexdigest() != ckpt["state_sha256"]:
+        raise ValueError(f"checkpoint {ckpt['_id']} is corrupt (digest mismatch)")
+    return LedgerState.loads(raw)
+
+def nearest_checkpoint(db, block_id=None):
+    q = {"_id": {"$lte": block_id}} if block_id is not None else {}
+    return db[CHECKPOINTS].find_one(q, sort=[("_id", -1)])
+
+def state_at(db, block_id=None):
+    """(state, height, last block) after `block_id` (None = newest closed block)."""
+    ckpt = nearest_checkpoint(db, block_id)
+    state, height, after = (load_checkpoint(db, ckpt), ckpt["height"], ckpt["_id"]) if ckpt else (LedgerState(), 0, None)
+    q = {}
+    if after is not None:
+        q["_id"] = {"$gt": after}
+    if block_id is not None:
+        q.setdefault("_id", {})["$lte"] = block_id
+    blocks = list(db.blocks.find(q, {"merkle_root": 1}).sort("_id", 1))
+    replay(db, state, blocks)
+    last = blocks[-1]["_id"] if blocks else after
+    return state, height + len(blocks), last
+
+def build(db, every: int = EVERY, log=print) -> dict:
+    """Replay from the newest checkpoint to the newest block, checkpointing every `every` blocks."""
+    ckpt = nearest_checkpoint(db)
+    state, height = (load_checkpoint(db, ckpt), ckpt["height"]) if ckpt else (LedgerState(), 0)
+    q = {"_id": {"$gt": ckpt["_id"]}} if ckpt else {}
+    blocks = list(db.blocks.find(q, {"merkle_root": 1}).sort("_id", 1))
+    stats = {"from_height": height, "blocks": len(blocks), "checkpoints": 0, "errors": 0}
+    t0 = time.perf_counter()
+
+    def on_block(b):
+        nonlocal height
+        height += 1
+        if height % every == 0:
+            save_checkpoint(db, b, height, state)
+            stats["checkpoints"] += 1
+            log(f"  checkpoint at height {height} ({len(state.credits):,} credits, {time.perf_counter() - t0:.1f}s)")
+    errs = replay(db, state, blocks, on_block)
+    stats.update(errors=len(errs), height=height, error_sample=errs[:20])
+    return stats
+
+# ---------------- CLI ----------------
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild balances from ledger_txs with periodic checkpoints")
+    ap.add_argument("--uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default=os.getenv("DB_NAME", "h2_registry"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="extend checkpoints to the newest block")
+    b.add_argument("--every", type=int, default=EVERY, help="blocks between checkpoints")
+    s = sub.add_parser("state", help="state after a block (default: newest)")
+    s.add_argument("--at-block", help="block _id")
+    s.add_argument("--account", help="print one account only")
+    sub.add_parser("verify", help="compare the replayed tip (+ pending txs) with db.credits")
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    from bson import ObjectId
+    db = MongoClient(args.uri)[args.db]
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+
+    if args.cmd == "build":
+        print(json.dumps(build(db, args.every), indent=2))
+        return
+    if args.cmd == "state":
+        t0 = time.perf_counter()
+        at = ObjectId(args.at_block) if args.at_block else None
+        if at is not None and not db.blocks.find_one({"_id": at}, {"_id": 1}):
+            sys.exit("❌ block not found")
+        state, height, last = state_at(db, at)
+        bal = state.balances()
+        out = {"block_id": str(last) if last else None, "height": height, "credits": len(state.credits),
+               "accounts": len(bal), "state_root": state_root(state),
+               "elapsed_s": round(time.perf_counter() - t0, 3)}
+        if args.account:
+            out["account_id"], out["balance_g"] = args.account, bal.get(args.account, 0)
+        else:
+            out["balances"] = bal
+        print(json.dumps(out, indent=2))
+        return
+
+    state, height, last = state_at(db)
+    errs = replay_pending(db, state)
+    stored = {}
+    for cr in db.credits.find({}, {"owner_account_id": 1, "amount_g": 1, "status": 1}):
+        stored[str(cr["_id"])] = [str(cr.get("owner_account_id")), int(cr.get("amount_g") or 0), cr.get("status") == "retired"]
+    diff = []
+    for cid in stored.keys() | state.credits.keys():
+        a, b = stored.get(cid), state.credits.get(cid)
+        if a is None or b is None or a[0] != b[0] or a[2] != b[2] or (not a[2] and a[1] != b[1]):
+            diff.append({"credit_id": cid, "credits": a, "ledger": b})
+    ok = not diff and not errs
+    print(json.dumps({"height": height, "credits_ledger": len(state.credits), "credits_db": len(stored),
+                      "replay_errors": len(errs), "credit_mismatches": len(diff), "sample": diff[:20],
+                      "ok": ok}, indent=2))
+    sys.exit(0 if ok else 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+loadgen.py — Load generator for the registry API (reuses api_tester.py signing helpers)
+--------------------------------------------------------------------------------------
+- Simulates N sensors and M accounts (half producers, half buyers)
+- Open-loop request mix at a target rate: signed events, mints, transfers, retirements,
+  market offers/buys, balance reads, plus a periodic block close (activates minted credits)
+- Reports throughput and p50/p95/p99 latency per endpoint
+- No chain needed: run against the local app + local Mongo
+
+Run:
+  python app.py            # or: gunicorn -w 4 "app:create_app()"
+  python loadgen.py --base http://127.0.0.1:5000 --sensors 20 --accounts 10 --rate 50 --duration 60
+  python loadgen.py --mix event=50,mint=25,transfer=10,retire=5,offer=5,buy=5 --json out.json
+"""
+from __future__ import annotations
+
+import argparse, json, random, threading, time, uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+
+# Same signing/canonicalization helpers as the E2E tester
+import importlib.util, pathlib
+API_TESTER_PATH = pathlib.Path(__file__).with_name("api_tester.py")
+spec = importlib.util.spec_from_file_location("api_tester", str(API_TESTER_PATH))
+api = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(api)  # type: ignore
+
+DEFAULT_MIX = "event=35,mint=20,transfer=12,retire=8,offer=5,buy=10,balance=10"
+SLOT = timedelta(minutes=5)   # each event covers one 5-minute slot; slots never overlap per sensor
+
+# ---- stats ------------------------------------------------------------------
+
+class Stats:
+    def __init__(self):
+        self.lat = defaultdict(list)      # endpoint -> [ms]
+        self.codes = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def add(self, endpoint: str, ms: float, code: int):
+        with self.lock:
+            self.lat[endpoint].append(ms)
+            self.codes[endpoint][code] += 1
+
+    @staticmethod
+    def pct(sorted_ms: list, p: float) -> float:
+        if not sorted_ms:
+            return 0.0
+        k = max(0, min(len(sorted_ms) - 1, int(round(p / 100.0 * len(sorted_ms) + 0.5)) - 1))
+        return sorted_ms[k]
+
+    def report(self, elapsed_s: float) -> dict:
+        out = {}
+        with self.lock:
+            for ep, ms in sorted(self.lat.items()):
+                s = sorted(ms)
+                errors = sum(n for c, n in self.codes[ep].items() if c >= 400 or c == 0)
+                out[ep] = {"count": len(s), "errors": errors, "rps": len(s) / elapsed_s if elapsed_s else 0.0,
+                           "p50_ms": self.pct(s, 50), "p95_ms": self.pct(s, 95), "p99_ms": self.pct(s, 99),
+                           "max_ms": s[-1], "codes": dict(self.codes[ep])}
+        return out
+
+# ---- simulated registry state ---------------------------------------------------
+
+class World:
+    """Client-side view of what exists, so each op sends a request the server should accept."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts = {}                 # id -> {"sk", "role"}
+        self.producers, self.buyers = [], []
+        self.sensors = []                  # {"id", "sk", "cursor"}
+        self.evidence_id = None
+        self.verified = deque()            # event ids ready to mint
+        self.pending = {}                  # credit_id -> (owner, amount_g), active after next close
+        self.active = {}                   # credit_id -> [owner, amount_g]   (transferable)
+        self.issued = {}                   # credit_id -> [owner, amount_g]   (bought; retire only)
+        self.offers = deque()              # [offer_id, remaining_g]
+
+    def pick_credit(self, pool: dict, owners=None, min_g=2):
+        with self.lock:
+            keys = [k for k, (o, g) in pool.items() if g >= min_g and (owners is None or o in owners)]
+            if not keys:
+                return None
+            k = random.choice(keys)
+            return k, pool[k][0], pool[k][1]
+
+class Client:
+    def __init__(self, base: str, stats: Stats, timeout: float):
+        self.base, self.stats, self.timeout = base, stats, timeout
+        self.local = threading.local()
+
+    def session(self) -> requests.Session:
+        s = getattr(self.local, "s", None)
+        if s is None:
+            s = self.local.s = requests.Session()
+        return s
+
+    def call(self, endpoint: str, method: str, path: str, payload=None, files=None):
+        t = time.perf_counter()
+        try:
+            r = self.session().request(method, self.base + path, json=payload, files=files, timeout=self.timeout)
+            code = r.status_code
+        except requests.RequestException:
+            r, code = None, 0
+        self.stats.add(endpoint, (time.perf_counter() - t) * 1000.0, code)
+        if r is None or code >= 400:
+            return None
+        try:
+            return r.json()
+        except ValueError:
+            return None
+
+# ---- operations ---------------------------------------------------------------
+
+def op_event(w: World, c: Client):
+    with w.lock:
+        s = random.choice(w.sensors)
+        st = s["cursor"]
+        s["cursor"] = st + SLOT
+    start, end = st.isoformat(), (st + SLOT).isoformat()
+    kwh = round(random.uniform(50, 120), 3)
+    kg = round(kwh / random.uniform(48, 55), 3)
+    canon = api.canonical_event_payload(s["id"], start, end, kwh, kg, w.evidence_id)
+    ev = c.call("POST /events", "POST", "/api/v1/events", {
+        "sensor_id": s["id"], "start_time": start, "end_time": end, "energy_kwh": kwh, "hydrogen_kg": kg,
+        "evidence_id": w.evidence_id, "sensor_signature_hex": api.ed25519_sign_hex(s["sk"], canon.encode())})
+    if ev and ev.get("verified"):
+        with w.lock:
+            w.verified.append(ev["id"])
+
+def op_mint(w: World, c: Client):
+    with w.lock:
+        eid = w.verified.popleft() if w.verified else None
+    if eid is None:
+        return op_event(w, c)
+    m = c.call("POST /credits/mint", "POST", "/api/v1/credits/mint", {"event_id": eid})
+    if m:
+        with w.lock:
+            w.pending[m["credit_id"]] = (m["owner_account_id"], int(m["amount_g"]))
+
+def op_transfer(w: World, c: Client):
+    got = w.pick_credit(w.active)
+    if got is None:
+        return op_event(w, c)
+    cid, owner, have = got
+    to = random.choice([a for a in w.accounts if a != owner] or [owner])
+    amount = max(1, have // 10)
+    with w.lock:
+        w.active[cid][1] -= amount     # reserve locally before the call
+    canon = json.dumps({"credit_id": cid, "from_account_id": owner, "to_account_id": to, "amount_g": amount},
+                       sort_keys=True, separators=(",", ":"))
+    r = c.call("POST /credits/transfer", "POST", "/api/v1/credits/transfer", {
+        "credit_id": cid, "from_account_id": owner, "to_account_id": to, "amount_g": amount,
+        "owner_signature_hex": api.ed25519_sign_hex(w.accounts[owner]["sk"], canon.encode())})
+    with w.lock:
+        if r is None:
+            w.active[cid][1] += amount
+        elif r.get("to_credit_id") and r["to_credit_id"] != cid:
+            w.active[r["to_credit_id"]] = [to, amount]
+
+def op_retire(w: World, c: Client):
+    pool = w.issued if (w.issued and random.random() < 0.5) else w.active
+    got = w.pick_credit(pool)
+    if got is None:
+        return op_event(w, c)
+    cid, owner, have = got
+    amount = max(1, have // 20)
+    reason = "loadgen"
+    with w.lock:
+        pool[cid][1] -= amount
+    canon = json.dumps({"credit_id": cid, "owner_account_id": owner, "amount_g": amount, "reason": reason},
+                       sort_keys=True, separators=(",", ":"))
+    r = c.call("POST /credits/retire", "POST", "/api/v1/credits/retire", {
+        "credit_id": cid, "owner_account_id": owner, "amount_g": amount, "reason": reason,
+        "owner_signature_hex": api.ed25519_sign_hex(w.accounts[owner]["sk"], canon.encode())})
+    if r is None:
+        with w.lock:
+            pool[cid][1] += amount
+
+def op_offer(w: World, c: Client):
+    got = w.pick_credit(w.active, owners=set(w.producers), min_g=20)
+    if got is None:
+        return op_event(w, c)
+    cid, owner, have = got
+    amount = max(1, have // 10)
+    with w.lock:
+        w.active[cid][1] -= amount     # locked grams are not transferred/retired by the generator
+    o = c.call("POST /market/offers", "POST", "/api/v1/market/offers", {
+        "producer_id": owner, "credit_id": cid, "amount_g": amount, "price_per_g": round(random.uniform(0.05, 0.2), 4)})
+    with w.lock:
+        if o is None:
+            w.active[cid][1] += amount
+        else:
+            w.offers.append([o["id"], amount])
+
+def op_buy(w: World, c: Client):
+    with w.lock:
+        offer = w.offers.popleft() if w.offers else None
+    if offer is None:
+        return op_offer(w, c)
+    buyer = random.choice(w.buyers)
+    amount = max(1, min(offer[1], random.randint(1, max(1, offer[1] // 2))))
+    r = c.call("POST /market/buy", "POST", "/api/v1/market/buy",
+               {"buyer_id": buyer, "offer_id": offer[0], "amount_g": amount})
+    with w.lock:
+        if r is not None:
+            offer[1] -= amount
+            w.issued[r["new_credit_id"]] = [buyer, amount]
+        if offer[1] > 0:
+            w.offers.append(offer)
+
+def op_balance(w: World, c: Client):
+    aid = random.choice(list(w.accounts))
+    c.call("GET /accounts/<id>/balance", "GET", f"/api/v1/accounts/{aid}/balance")
+
+def close_block(w: World, c: Client):
+    with w.lock:
+        minted = dict(w.pending)
+    blk = c.call("POST /blocks/close", "POST", "/api/v1/blocks/close", {})
+    if not blk:
+        return
+    with w.lock:
+        for cid in blk.get("activated_mints", []):
+            owner, g = minted.get(cid) or w.pending.get(cid, (None, 0))
+            w.pending.pop(cid, None)
+            if owner:
+                w.active[cid] = [owner, g]
+
+OPS = {"event": op_event, "mint": op_mint, "transfer": op_transfer, "retire": op_retire,
+       "offer": op_offer, "buy": op_buy, "balance": op_balance}
+
+# ---- setup / run ----------------------------------------------------------------
+
+def setup(w: World, c: Client, sensors: int, accounts: int, seed_events: int, run_id: str):
+    producers = max(1, accounts // 2)
+    for i in range(max(2, accounts)):
+        sk, _, pub_pem, _ = api.ed25519_keypair_pem()
+        role = "producer" if i < producers else "buyer"
+        acc = c.call("setup", "POST", "/api/v1/accounts",
+                     {"name": f"lg-{run_id}-{role}-{i}", "role": role, "public_key_pem": pub_pem})
+        if not acc:
+            api.die("could not create accounts (is the app running?)")
+        w.accounts[acc["id"]] = {"sk": sk, "role": role}
+        (w.producers if role == "producer" else w.buyers).append(acc["id"])
+
+    base_t = datetime(2020, 1, 1)
+    for i in range(sensors):
+        sk, _, pub_pem, _ = api.ed25519_keypair_pem()
+        s = c.call("setup", "POST", "/api/v1/sensors", {
+            "name": f"lg-{run_id}-meter-{i}", "electrolyzer_id": f"LG-{run_id}-{i}",
+            "owner_account_id": w.producers[i % len(w.producers)], "public_key_pem": pub_pem})
+        if not s:
+            api.die("could not create sensors")
+        w.sensors.append({"id": s["id"], "sk": sk, "cursor": base_t})
+
+    ev = c.call("setup", "POST", "/api/v1/evidence/upload",
+                files={"file": (f"loadgen_{run_id}.csv", f"run,{run_id}\n".encode(), "text/csv")})
+    if not ev:
+        api.die("evidence upload failed")
+    w.evidence_id = ev["id"]
+
+    # seed: some events -> mints -> close, so transfers/offers have active credits from the start
+    for _ in range(seed_events):
+        op_event(w, c)
+    while w.verified:
+        op_mint(w, c)
+    close_block(w, c)
+    for _ in range(max(1, len(w.producers))):
+        op_offer(w, c)
+
+def parse_mix(s: str) -> list:
+    mix = []
+    for part in s.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPS:
+            api.die(f"unknown op in --mix: {name} (known: {', '.join(OPS)})")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+def run(w: World, c: Client, mix: list, rate: float, duration: float, threads: int, close_every: float) -> dict:
+    names, weights = zip(*mix)
+    slots = threading.Semaphore(threads * 4)   # bounded backlog; beyond it requests are dropped, not queued
+    dropped, lags = 0, []
+    stop = threading.Event()
+
+    def closer():
+        while not stop.wait(close_every):
+            close_block(w, c)
+
+    def task(name):
+        try:
+            OPS[name](w, c)
+        finally:
+            slots.release()
+
+    bg = threading.Thread(target=closer, daemon=True) if close_every > 0 else None
+    if bg: bg.start()
+    t0 = time.perf_counter()
+    i = 0
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        while True:
+            due = t0 + i / rate
+            now = time.perf_counter()
+            if due - t0 >= duration:
+                break
+            if due > now:
+                time.sleep(due - now)
+            else:
+                lags.append((now - due) * 1000.0)
+            if slots.acquire(blocking=False):
+                ex.submit(task, random.choices(names, weights)[0])
+            else:
+                dropped += 1
+            i += 1
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    return {"elapsed_s": elapsed, "scheduled": i, "dropped": dropped, "target_rps": rate,
+            "achieved_rps": sum(len(v) for k, v in c.stats.lat.items() if k != "setup") / elapsed,
+            "max_schedule_lag_ms": max(lags) if lags else 0.0}
+
+def print_report(summary: dict, per_ep: dict):
+    print(f"\n{'endpoint':<30}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for ep, r in per_ep.items():
+        if ep == "setup":
+            continue
+        print(f"{ep:<30}{r['count']:>8}{r['errors']:>6}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+    print(f"\ntarget {summary['target_rps']:.1f} req/s  achieved {summary['achieved_rps']:.1f} req/s  "
+          f"over {summary['elapsed_s']:.1f}s  (dropped {summary['dropped']}, "
+          f"max schedule lag {summary['max_schedule_lag_ms']:.0f} ms)")
+
+def main():
+    ap = argparse.ArgumentParser(description="Registry API load generator (reuses api_tester helpers)")
+    ap.add_argument("--base", default="http://127.0.0.1:5000")
+    ap.add_argument("--sensors", type=int, default=10)
+    ap.add_argument("--accounts", type=int, default=10, help="half producers, half buyers")
+    ap.add_argument("--rate", type=float, default=20.0, help="target requests/second (open loop)")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="op=weight,... ops: " + ",".join(OPS))
+    ap.add_argument("--close-every", type=float, default=5.0, help="seconds between block closes (0 = never)")
+    ap.add_argument("--seed-events", type=int, default=20)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=None, help="random seed for the op mix")
+    ap.add_argument("--json", default="", help="also write the report to this file")
+    args = ap.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    base = args.base.rstrip("/")
+    run_id = uuid.uuid4().hex[:8]
+    stats = Stats()
+    c, w = Client(base, stats, args.timeout), World()
+
+    print(f"== loadgen {run_id} → {base}: {args.sensors} sensors, {args.accounts} accounts, "
+          f"{args.rate}/s for {args.duration}s ==")
+    if not c.call("setup", "GET", "/api/v1/health"):
+        api.die(f"{base} is not reachable")
+    setup(w, c, args.sensors, args.accounts, args.seed_events, run_id)
+    print(f"setup: {len(w.accounts)} accounts, {len(w.sensors)} sensors, {len(w.active)} active credits, "
+          f"{len(w.offers)} offers")
+
+    c.stats = stats = Stats()   # measure the run only
+    summary = run(w, c, parse_mix(args.mix), args.rate, args.duration, args.threads, args.close_every)
+    per_ep = stats.report(summary["elapsed_s"])
+    print_report(summary, per_ep)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"run_id": run_id, "args": vars(args), "summary": summary, "endpoints": per_ep}, f, indent=2)
+        print("report written to", args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# metrics.py
+# In-process instrumentation exposed as Prometheus text on GET /metrics.
+#
+#   http_request_duration_seconds{route,method,status}   latency per Flask route (recorded at teardown, 500s included)
+#   http_request_mongo_commands{route}                   Mongo commands issued per request
+#   http_request_mongo_seconds{route}                    time spent in Mongo per request
+#   mongo_command_duration_seconds{command}              every command (pymongo monitoring)
+#   mongo_command_failures_total{command}
+#   op_duration_seconds{op}                              timed() / timer() sections (ed25519, merkle, SMT, anchor)
+#
+# Wiring (see app.py):
+#   MongoClient(uri, event_listeners=[metrics.MongoCommandListener()])
+#   metrics.init_app(app)
+#
+# env: METRICS_ENABLED=1 (set 0 to skip the request hooks and /metrics route)
+
+import os, time, threading, functools
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from pymongo import monitoring
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+OP_BUCKETS      = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1, 5, 30)
+COUNT_BUCKETS   = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+INF_LE = 'le="+Inf"'
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, tuple(labelnames), tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for lv, s in sorted(series.items()):
+            for i, b in enumerate(self.buckets):
+                le = 'le="%s"' % b
+                yield f"{self.name}_bucket{_labels(self.labelnames, lv, le)} {s[i]}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, lv, INF_LE)} {s[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, lv)} {s[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, lv)} {s[-1]}"
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, n=1):
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + n
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            series = dict(self._series)
+        for lv, v in sorted(series.items()):
+            yield f"{self.name}{_labels(self.labelnames, lv)} {v}"
+
+REGISTRY = []
+
+HTTP_LATENCY  = Histogram("http_request_duration_seconds", "Request latency by route",
+                          ("route", "method", "status"))
+HTTP_MONGO_N  = Histogram("http_request_mongo_commands", "Mongo commands issued per request",
+                          ("route",), COUNT_BUCKETS)
+HTTP_MONGO_S  = Histogram("http_request_mongo_seconds", "Time spent in Mongo per request",
+                          ("route",), OP_BUCKETS)
+MONGO_CMD     = Histogram("mongo_command_duration_seconds", "Mongo command latency (driver-measured)",
+                          ("command",), OP_BUCKETS)
+MONGO_FAIL    = Counter("mongo_command_failures_total", "Mongo commands that returned an error", ("command",))
+OP_LATENCY    = Histogram("op_duration_seconds", "Latency of instrumented hot sections", ("op",), OP_BUCKETS)
+
+# per-request Mongo tally: [commands, seconds]; None outside a request
+_request_mongo: ContextVar = ContextVar("request_mongo", default=None)
+TALLY_ENVIRON = "metrics.mongo_tally"   # WSGI environ key: a tally started before the Flask request (asgi.py)
+
+def mongo_tally_context():
+    """-> (Context, tally): work run with Context.run() counts its Mongo commands into tally; pass the tally to the
+    request as environ[TALLY_ENVIRON] and the request's metrics include that work."""
+    ctx, tally = copy_context(), [0, 0.0]
+    ctx.run(_request_mongo.set, tally)
+    return ctx, tally
+
+class MongoCommandListener(monitoring.CommandListener):
+    """pymongo calls these synchronously on the thread that ran the command."""
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, ok=True)
+
+    def failed(self, event):
+        self._record(event, ok=False)
+
+    def _record(self, event, ok: bool):
+        secs = event.duration_micros / 1e6
+        MONGO_CMD.observe(secs, event.command_name)
+        if not ok:
+            MONGO_FAIL.inc(event.command_name)
+        tally = _request_mongo.get()
+        if tally is not None:
+            tally[0] += 1
+            tally[1] += secs
+
+@contextmanager
+def timer(op: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        OP_LATENCY.observe(time.perf_counter() - t, op)
+
+def timed(op: str):
+    """Decorator form of timer()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            with timer(op):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+def render() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+def init_app(app):
+    """Register request hooks and GET /metrics on a Flask app."""
+    if not ENABLED:
+        return
+    from flask import g, request, Response
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_t0 = time.perf_counter()
+        g._metrics_token = _request_mongo.set(request.environ.get(TALLY_ENVIRON) or [0, 0.0])
+
+    @app.after_request
+    def _metrics_headers(resp):
+        g._metrics_status = resp.status_code
+        tally = _request_mongo.get()
+        if tally is not None and "_metrics_t0" in g:
+            resp.headers["X-Mongo-Commands"] = str(tally[0])
+            resp.headers["X-Mongo-Time-Ms"] = f"{tally[1] * 1000:.2f}"
+        return resp
+
+    @app.teardown_request
+    def _metrics_stop(exc):
+        # teardown runs even when the view raised (after_request does not), so 500s are observed too
+        t0 = g.pop("_metrics_t0", None)
+        token = g.pop("_metrics_token", None)
+        if t0 is None:
+            return
+        status = 500 if exc is not None else g.pop("_metrics_status", 500)
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        HTTP_LATENCY.observe(time.perf_counter() - t0, route, request.method, status)
+        tally = _request_mongo.get()
+        if tally is not None:
+            HTTP_MONGO_N.observe(tally[0], route)
+            HTTP_MONGO_S.observe(tally[1], route)
+        if token is not None:
+            _request_mongo.reset(token)
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,229 @@
+# multi_credit.py
+# Transfer / retire an amount spread over several credits with a single owner signature.
+#
+#   POST /api/v1/credits/transfer_amount  {from_account_id, to_account_id, amount_g, nonce, order?, owner_signature_hex}
+#        signed: canonical({from_account_id, to_account_id, amount_g, nonce})
+#   POST /api/v1/credits/retire_amount    {owner_account_id, amount_g, reason, nonce, order?, owner_signature_hex}
+#        signed: canonical({owner_account_id, amount_g, reason, nonce})
+#
+# order: "fifo" (oldest credit first, default) or "vintage" (earliest production start first). Only
+# active / issued credits are spent, and never the part of one reserved by an open offer (locked_g).
+# A nonce can be used once per account, so a signed request cannot be replayed.
+#
+# Each request is one op, journaled in db.multi_credit_ops before any credit changes. The op record holds
+# everything the request will write: the credit updates, the receiver credits / retirement rows and the
+# ledger tx (multi_transfer / multi_retire), all with fixed ids. Then:
+#
+#   pending -> one bulk_write of credit updates, each conditional on the amount / owner / status / locked_g
+#              read at selection time, each adding the op id to the credit's `ops` ($addToSet)
+#   applied -> every update landed: receiver credits, retirements and the ledger tx are inserted (skipping
+#              what already exists), the op id is pulled from the credits -> done
+#   aborting -> some update missed (a concurrent write got there first): the ones that landed are reverted,
+#              the nonce is released (-> aborted) and the request fails with 409
+#
+# A credit with an op in flight (non-empty `ops`) is not selected and not matched by as_read(), so the
+# single-credit routes, compaction and other multi-credit requests leave it alone until the op is done
+# and a revert always finds the credit as the op left it. recover() finishes ops a crashed process left
+# behind (rolled forward if every credit update landed, else rolled back); every amount request runs it
+# for ops older than MULTI_CREDIT_STALE_S, and `python multi_credit.py recover` does it by hand.
+#
+# env: MULTI_CREDIT_MAX_PARTS=1000   credits one request may consume (compact fragments beyond that)
+#      MULTI_CREDIT_STALE_S=60       age after which an unfinished op is recovered
+
+import os, argparse
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+SPENDABLE = ("active", "issued")
+ORDERS    = ("fifo", "vintage")
+MAX_PARTS = int(os.getenv("MULTI_CREDIT_MAX_PARTS", "1000"))
+STALE_S   = float(os.getenv("MULTI_CREDIT_STALE_S", "60"))
+NONCES    = "signed_nonces"
+OPS       = "multi_credit_ops"
+IDLE      = {"ops.0": {"$exists": False}}   # no multi-credit op in flight on the credit
+
+INDEXES = [
+    (OPS, [("state", 1), ("created_at", 1)], {}),   # recover(): unfinished ops by age
+]
+
+def claim_nonce(db, account_id: str, nonce: str) -> bool:
+    from pymongo.errors import DuplicateKeyError
+    try:
+        db[NONCES].insert_one({"_id": f"{account_id}:{nonce}", "created_at": datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False
+
+def _available(c: dict) -> int:
+    return int(c.get("amount_g") or 0) - max(int(c.get("locked_g") or 0), 0)
+
+def select(db, owner_id: str, amount_g: int, order: str = "fifo"):
+    """-> ([(credit, take_g)], available_g seen); the list is None when the owner holds less than amount_g."""
+    q = {"owner_account_id": {"$in": [owner_id, ObjectId(owner_id)]}, "status": {"$in": list(SPENDABLE)},
+         "amount_g": {"$gt": 0}, **IDLE}
+    proj = {"amount_g": 1, "locked_g": 1, "owner_account_id": 1, "status": 1, "event_id": 1,
+            "producer_account_id": 1, "source_credit_id": 1, "block_id": 1, "anchor_tx": 1, "created_at": 1}
+    if order == "vintage":
+        creds = list(db.credits.find(q, proj))
+        ev_ids = list({c["event_id"] for c in creds if c.get("event_id")})
+        starts = {e["_id"]: e.get("start_time") for e in db.production_events.find({"_id": {"$in": ev_ids}}, {"start_time": 1})}
+        creds.sort(key=lambda c: (starts.get(c.get("event_id")) or c.get("created_at") or datetime.max, c["_id"]))
+    else:
+        creds = db.credits.find(q, proj).sort("_id", 1)
+    parts, left, seen = [], amount_g, 0
+    for c in creds:
+        avail = _available(c)
+        if avail <= 0:
+            continue
+        seen += avail
+        take = min(avail, left)
+        parts.append((c, take))
+        left -= take
+        if not left:
+            return parts, seen
+    return None, seen
+
+def _whole(c: dict, take: int) -> bool:
+    return take == int(c["amount_g"])
+
+def as_read(c: dict) -> dict:
+    """Filter matching the credit only while it still holds the amount / owner / status / locked_g it was read
+    with and no multi-credit op is in flight on it."""
+    f = {"_id": c["_id"], "amount_g": c["amount_g"], "owner_account_id": c["owner_account_id"], "status": c["status"]}
+    f["locked_g"] = c["locked_g"] if "locked_g" in c else {"$exists": False}
+    return {**f, **IDLE}
+
+def receiver_credits(parts: list, to_oid: ObjectId) -> dict:
+    """credit_id -> new credit doc for every partially consumed credit (whole ones change owner in place)."""
+    now, out = datetime.utcnow(), {}
+    for c, take in parts:
+        if _whole(c, take):
+            continue
+        doc = {"_id": ObjectId(), "amount_g": take, "status": c["status"], "owner_account_id": to_oid,
+               "event_id": c.get("event_id"), "block_id": c.get("block_id"), "anchor_tx": c.get("anchor_tx"),
+               "created_at": now}
+        for k in ("producer_account_id", "source_credit_id"):
+            if c.get(k) is not None:
+                doc[k] = c[k]
+        out[c["_id"]] = doc
+    return out
+
+# ---------------- ops ----------------
+def _snapshot(c: dict, take: int) -> dict:
+    snap = {k: c[k] for k in ("_id", "amount_g", "owner_account_id", "status", "locked_g") if k in c}
+    return {**snap, "take": int(take)}
+
+def plan_transfer(parts: list, to_oid: ObjectId, signed: dict, order: str, nonce_id: str) -> dict:
+    from app import ledger_doc
+    new_docs = receiver_credits(parts, to_oid)
+    out = [{"credit_id": str(c["_id"]), "amount_g": take,
+            "new_credit_id": str(new_docs[c["_id"]]["_id"]) if c["_id"] in new_docs else str(c["_id"])}
+           for c, take in parts]
+    return {"_id": ObjectId(), "kind": "transfer", "to_account_id": to_oid, "nonce_id": nonce_id,
+            "parts": [_snapshot(c, take) for c, take in parts], "credits": list(new_docs.values()),
+            "retirements": [], "out": out,
+            "ledger": {"_id": ObjectId(), **ledger_doc("multi_transfer", {**signed, "order": order, "parts": out})}}
+
+def plan_retire(parts: list, owner_oid: ObjectId, signed: dict, order: str, nonce_id: str) -> dict:
+    from app import ledger_doc
+    now = datetime.utcnow()
+    # same records as /credits/retire: a retirements row for each partly retired credit
+    rows = [{"_id": ObjectId(), "credit_id": c["_id"], "owner_account_id": owner_oid, "amount_g": take,
+             "reason": signed.get("reason", ""), "timestamp": now} for c, take in parts if not _whole(c, take)]
+    out = [{"credit_id": str(c["_id"]), "amount_g": take} for c, take in parts]
+    return {"_id": ObjectId(), "kind": "retire", "to_account_id": None, "nonce_id": nonce_id,
+            "parts": [_snapshot(c, take) for c, take in parts], "credits": [], "retirements": rows, "out": out,
+            "ledger": {"_id": ObjectId(), **ledger_doc("multi_retire", {**signed, "order": order, "parts": out})}}
+
+def _changes(op: dict, p: dict):
+    """-> (update applying part p, update undoing it)."""
+    if not _whole(p, p["take"]):
+        return {"$inc": {"amount_g": -p["take"]}}, {"$inc": {"amount_g": p["take"]}}
+    if op["kind"] == "transfer":
+        return {"$set": {"owner_account_id": op["to_account_id"]}}, {"$set": {"owner_account_id": p["owner_account_id"]}}
+    return {"$set": {"status": "retired"}}, {"$set": {"status": p["status"]}}
+
+def _apply(db, op: dict) -> bool:
+    from pymongo import UpdateOne
+    ops = [UpdateOne(as_read(p), {**_changes(op, p)[0], "$addToSet": {"ops": op["_id"]}}) for p in op["parts"]]
+    return db.credits.bulk_write(ops, ordered=False).modified_count == len(ops)
+
+def _abort(db, op: dict):
+    """Reverts the credit updates of `op` that landed; they cannot have moved since (as_read skips them)."""
+    from pymongo import UpdateOne
+    claimed = db[OPS].update_one({"_id": op["_id"], "state": "pending"}, {"$set": {"state": "aborting"}}).modified_count
+    if not claimed and op.get("state") != "aborting":
+        return   # already applied / aborted by someone else
+    undo = [UpdateOne({"_id": p["_id"], "ops": op["_id"]}, {**_changes(op, p)[1], "$pull": {"ops": op["_id"]}})
+            for p in op["parts"]]
+    db.credits.bulk_write(undo, ordered=False)
+    db[NONCES].delete_one({"_id": op["nonce_id"]})
+    db[OPS].update_one({"_id": op["_id"]}, {"$set": {"state": "aborted", "finished_at": datetime.utcnow()}})
+
+def _insert_missing(coll, docs: list):
+    from pymongo.errors import BulkWriteError
+    if not docs:
+        return
+    have = {d["_id"] for d in coll.find({"_id": {"$in": [d["_id"] for d in docs]}}, {"_id": 1})}
+    todo = [d for d in docs if d["_id"] not in have]
+    try:
+        if todo:
+            coll.insert_many(todo, ordered=False)
+    except BulkWriteError as e:   # a concurrent _finish (recover) inserted some of them first
+        if any(w.get("code") != 11000 for w in e.details.get("writeErrors", [])):
+            raise
+
+def _finish(db, op: dict):
+    """Rolls an applied op forward; every step skips what an earlier (interrupted) run already wrote."""
+    _insert_missing(db.credits, op["credits"])
+    _insert_missing(db.retirements, op["retirements"])
+    _insert_missing(db.ledger_txs, [op["ledger"]])
+    db.credits.update_many({"_id": {"$in": [p["_id"] for p in op["parts"]]}}, {"$pull": {"ops": op["_id"]}})
+    db[OPS].update_one({"_id": op["_id"]}, {"$set": {"state": "done", "finished_at": datetime.utcnow()}})
+
+def run(db, op: dict) -> bool:
+    """Journals and executes a planned op -> True when done, False when aborted (nothing changed)."""
+    db[OPS].insert_one({**op, "state": "pending", "created_at": datetime.utcnow()})
+    if not _apply(db, op):
+        _abort(db, op)
+        return False
+    if not db[OPS].update_one({"_id": op["_id"], "state": "pending"}, {"$set": {"state": "applied"}}).modified_count:
+        return False   # taken for stale and rolled back by recover() meanwhile
+    _finish(db, op)
+    return True
+
+def recover(db, stale_s: float = STALE_S) -> dict:
+    """Finishes ops older than stale_s that never reached done / aborted."""
+    stats = {"rolled_forward": 0, "rolled_back": 0}
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_s)
+    for op in db[OPS].find({"state": {"$in": ["pending", "applied", "aborting"]}, "created_at": {"$lt": cutoff}}):
+        if op["state"] != "applied":
+            landed = db.credits.count_documents({"_id": {"$in": [p["_id"] for p in op["parts"]]}, "ops": op["_id"]})
+            if op["state"] == "aborting" or landed != len(op["parts"]):
+                _abort(db, op)
+                stats["rolled_back"] += 1
+                continue
+            if not db[OPS].update_one({"_id": op["_id"], "state": "pending"}, {"$set": {"state": "applied"}}).modified_count:
+                continue   # its own request moved it on meanwhile
+        _finish(db, op)
+        stats["rolled_forward"] += 1
+    return stats
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Multi-credit ops")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("recover", help="finish ops a crashed process left behind")
+    rec.add_argument("--stale-s", type=float, default=STALE_S, help="only ops older than this")
+    args = ap.parse_args()
+
+    from app import db
+    for coll, keys, opts in INDEXES:
+        db[coll].create_index(keys, **opts)
+    st = recover(db, args.stale_s)
+    print(f"rolled forward {st['rolled_forward']}, rolled back {st['rolled_back']} unfinished ops")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+# order_book.py
+# Price-time priority order book and matching engine for the credit market.
+#
+# Asks are market_offers (a sell order is an offer, with the same locked_g reservation on its credit);
+# bids live in market_bids. Both sides are kept in memory as price levels (one FIFO queue per price,
+# best price first) and rebuilt from Mongo the first time a process uses the engine. Every fill is
+# settled like POST /market/buy: the credit's amount_g and locked_g drop together (conditional update),
+# the buyer gets a new "issued" credit, the offer shrinks / closes, and a "market_buy" ledger tx is
+# appended. market_trades records each fill with both order ids. Fills execute at the resting order's price.
+#
+#   POST   /api/v1/market/orders        {side: buy|sell, type: limit|market, account_id, amount_g,
+#                                        price_per_g (limit), credit_id (sell)}
+#   DELETE /api/v1/market/orders/<id>?account_id=
+#   GET    /api/v1/market/book?depth=20
+#   GET    /api/v1/market/trades
+#
+# limit : fills whatever crosses, the rest rests in the book.
+# market: fills what it can at any price, the rest is cancelled (a market sell releases its unsold reservation).
+# An order that reaches a resting order of its own account stops there and its remainder is cancelled.
+#
+# Every fill is claimed in Mongo before it settles: the offer's amount_g and the resting bid's left_g drop
+# with a conditional $inc (status open, enough left), then the credit update. The fills an incoming order
+# makes are claimed together, one unordered bulk per collection (offers, bids, credits), so an order costs
+# the same ~7 round trips whether it fills against 1 resting order or 1000. Each claim is an upsert on the
+# order's _id: one that misses fails with a duplicate key error naming it. A miss means another worker (or a
+# cancel) got there first: the engine gives back what that fill's other claims took, re-reads the order and
+# matches the rest again, so a bid / offer is never filled past its size whatever number of workers serve
+# the market. New credits, trades and ledger txs are then written with one bulk call each.
+#
+# One engine per process, matching under its lock. Its book is reloaded from Mongo in place, under the same
+# lock, every ORDER_BOOK_REFRESH_S; a worker's book only sees orders placed through other workers after that,
+# so with several workers two crossing orders can rest side by side until then; nothing is ever over-filled.
+#
+# env: ORDER_BOOK_REFRESH_S=5   reload the book from Mongo when older than this (0 = only on first use)
+
+import os, time, threading
+from bisect import insort
+from collections import deque
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+BIDS   = "market_bids"
+TRADES = "market_trades"
+SIDES  = ("buy", "sell")
+TYPES  = ("limit", "market")
+REFRESH_S = float(os.getenv("ORDER_BOOK_REFRESH_S", "5"))
+
+INDEXES = [
+    (BIDS,   [("status", 1), ("_id", 1)], {}),                    # book rebuild
+    (BIDS,   [("buyer_id", 1), ("status", 1), ("_id", -1)], {}),
+    (TRADES, "offer_id", {}),
+    (TRADES, "bid_id", {}),
+]
+
+class OrderError(ValueError):
+    def __init__(self, msg: str, code: int = 400):
+        super().__init__(msg)
+        self.code = code
+
+class Order:
+    __slots__ = ("id", "side", "price", "left", "owner", "credit_id")
+
+    def __init__(self, oid, side, price, left, owner, credit_id=None):
+        self.id, self.side, self.price, self.left, self.owner, self.credit_id = oid, side, price, left, owner, credit_id
+
+class Book:
+    """price -> deque of resting orders per side. Prices are kept sorted by key() so the best is last."""
+
+    def __init__(self):
+        self.levels = {"buy": {}, "sell": {}}
+        self.keys = {"buy": [], "sell": []}
+        self.orders = {}
+
+    @staticmethod
+    def key(side: str, price: float) -> float:
+        return price if side == "buy" else -price   # highest bid / lowest ask sorts last
+
+    def add(self, o: Order):
+        lv = self.levels[o.side]
+        if o.price not in lv:
+            lv[o.price] = deque()
+            insort(self.keys[o.side], self.key(o.side, o.price))
+        lv[o.price].append(o)
+        self.orders[o.id] = o
+
+    def best(self, side: str):
+        """Head order of the best price level, or None; skips orders cancelled in place."""
+        ks, lv = self.keys[side], self.levels[side]
+        while ks:
+            price = ks[-1] if side == "buy" else -ks[-1]
+            q = lv[price]
+            while q and q[0].left <= 0:
+                q.popleft()
+            if q:
+                return q[0]
+            del lv[price]
+            ks.pop()
+        return None
+
+    def walk(self, side: str):
+        """Live orders of one side, best price first and oldest first within a price."""
+        self.best(side)   # drops used-up heads / levels first
+        for k in reversed(self.keys[side]):
+            for o in self.levels[side][k if side == "buy" else -k]:
+                if o.left > 0:
+                    yield o
+
+    def cancel(self, oid):
+        o = self.orders.pop(oid, None)
+        if o is not None:
+            o.left = 0          # dropped from its level lazily, by best() / depth()
+        return o
+
+    def depth(self, side: str, n: int) -> list:
+        out = []
+        for k in reversed(self.keys[side]):
+            price = k if side == "buy" else -k
+            live = [o.left for o in self.levels[side][price] if o.left > 0]
+            if live:
+                out.append({"price_per_g": price, "amount_g": sum(live), "orders": len(live)})
+                if len(out) >= n:
+                    break
+        return out
+
+class Fills:
+    """Writes collected while one incoming order matches; flushed with one bulk call per collection."""
+
+    def __init__(self):
+        self.credits, self.trades, self.ledger = [], [], []
+        self.offers, self.bids = set(), set()   # orders claimed from; flush closes the ones at 0
+
+    def flush(self, db):
+        from app import ledger_append_many
+        if self.credits:
+            db.credits.insert_many(self.credits, ordered=False)
+        # amounts already moved with the claims; only close what is used up (and nobody cancelled first)
+        if self.offers:
+            db.market_offers.update_many({"_id": {"$in": list(self.offers)}, "amount_g": 0, "status": "open"},
+                                         {"$set": {"status": "closed"}})
+        if self.bids:
+            db[BIDS].update_many({"_id": {"$in": list(self.bids)}, "left_g": 0, "status": "open"},
+                                 {"$set": {"status": "filled"}})
+        if self.trades:
+            db[TRADES].insert_many(self.trades, ordered=False)
+        ledger_append_many(self.ledger)
+
+class MatchingEngine:
+    def __init__(self, db):
+        self.db = db
+        self.book = Book()
+        self.lock = threading.RLock()
+        self.loaded_at = None
+
+    def load(self) -> "MatchingEngine":
+        """Rebuilds both sides from Mongo, in _id (arrival) order, in place under the engine lock."""
+        with self.lock:
+            self.book = Book()
+            self._load_book()
+            self.loaded_at = time.monotonic()
+        return self
+
+    def refresh(self, max_age: float) -> "MatchingEngine":
+        """load() on first use and when the book is older than max_age (0 = first use only)."""
+        stale = lambda: self.loaded_at is None or (max_age and time.monotonic() - self.loaded_at > max_age)
+        if stale():
+            with self.lock:
+                if stale():
+                    self.load()
+        return self
+
+    def _load_book(self):
+        for o in self.db.market_offers.find({"status": "open", "amount_g": {"$gt": 0}, "price_per_g": {"$gt": 0}},
+                                            {"producer_id": 1, "credit_id": 1, "amount_g": 1, "price_per_g": 1}).sort("_id", 1):
+            self.book.add(Order(o["_id"], "sell", float(o["price_per_g"]), int(o["amount_g"]), str(o["producer_id"]),
+                                ObjectId(o["credit_id"])))
+        for b in self.db[BIDS].find({"status": "open", "left_g": {"$gt": 0}},
+                                    {"buyer_id": 1, "left_g": 1, "price_per_g": 1}).sort("_id", 1):
+            self.book.add(Order(b["_id"], "buy", float(b["price_per_g"]), int(b["left_g"]), str(b["buyer_id"])))
+
+    # ---------------- settlement (same steps as POST /market/buy) ----------------
+    def _claims(self, coll: str, ops: list) -> set:
+        """One unordered bulk of conditional updates -> positions of the ones that missed. Each update is an
+        upsert on its _id: a miss tries to insert an _id that exists and fails with a duplicate key error naming
+        it, so a single round trip tells exactly which claims landed."""
+        from pymongo.errors import BulkWriteError
+        if not ops:
+            return set()
+        try:
+            res = self.db[coll].bulk_write(ops, ordered=False)
+            missed, upserted = set(), res.upserted_ids or {}
+        except BulkWriteError as e:
+            errs = e.details.get("writeErrors", [])
+            if any(w.get("code") != 11000 for w in errs):
+                raise
+            missed = {w["index"] for w in errs}
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        if upserted:   # the order / credit is gone altogether: drop the stub the upsert created
+            self.db[coll].delete_many({"_id": {"$in": list(upserted.values())}})
+            missed |= set(upserted)
+        return missed
+
+    def _unclaim_offer(self, ask: "Order", qty: int):
+        if not self.db.market_offers.update_one({"_id": ask.id, "status": "open"}, {"$inc": {"amount_g": qty}}).matched_count:
+            # cancelled meanwhile: the cancel released what was left then, this part is still locked
+            self.db.credits.update_one({"_id": ask.credit_id}, {"$inc": {"locked_g": -qty}})
+
+    def _refresh(self, o: "Order"):
+        """After a missed claim: take the resting order's remaining grams from Mongo, or drop it if it is gone."""
+        coll, field = (BIDS, "left_g") if o.side == "buy" else ("market_offers", "amount_g")
+        doc = self.db[coll].find_one({"_id": o.id}, {field: 1, "status": 1})
+        if doc and doc.get("status") == "open" and int(doc.get(field) or 0) > 0:
+            o.left = int(doc[field])
+        else:
+            self.book.cancel(o.id)
+            o.left = 0
+
+    def _fill(self, fills: list, taker: str, fx: Fills) -> dict:
+        """Claims and settles fills [(ask, bid, buyer_id, qty, price)] with one bulk per collection however many
+        there are -> {position: "ask" / "bid" / "credit"} for the fills whose claim missed (nothing written for them).
+        bid: the bid Order (None for POST /market/buy); claimed in Mongo only when it is the resting side."""
+        from pymongo import UpdateOne
+        resting_bid = taker == "sell"   # an incoming bid is not in Mongo yet
+        missed = {}
+
+        def claim(coll, why, op):
+            live = [i for i in range(len(fills)) if i not in missed]
+            for k in self._claims(coll, [op(*fills[i]) for i in live]):
+                missed[live[k]] = why
+
+        claim("market_offers", "ask", lambda ask, bid, buyer, qty, price: UpdateOne(
+            {"_id": ask.id, "status": "open", "amount_g": {"$gte": qty}}, {"$inc": {"amount_g": -qty}}, upsert=True))
+        if resting_bid:
+            claim(BIDS, "bid", lambda ask, bid, buyer, qty, price: UpdateOne(
+                {"_id": bid.id, "status": "open", "left_g": {"$gte": qty}}, {"$inc": {"left_g": -qty}}, upsert=True))
+        claim("credits", "credit", lambda ask, bid, buyer, qty, price: UpdateOne(
+            {"_id": ask.credit_id, "amount_g": {"$gte": qty},
+             "$or": [{"locked_g": {"$exists": False}}, {"locked_g": {"$gte": qty}}]},
+            {"$inc": {"amount_g": -qty, "locked_g": -qty}}, upsert=True))
+
+        # give back what the claims that did land took for a fill that missed later on (contention only)
+        for i, why in missed.items():
+            ask, bid, _, qty, _ = fills[i]
+            if why != "ask":
+                self._unclaim_offer(ask, qty)
+            if why == "credit" and resting_bid:
+                self.db[BIDS].update_one({"_id": bid.id, "status": "open"}, {"$inc": {"left_g": qty}})
+
+        now = datetime.now(timezone.utc)
+        for i, (ask, bid, buyer_id, qty, price) in enumerate(fills):
+            if i in missed:
+                continue
+            ask.left -= qty
+            fx.offers.add(ask.id)
+            if bid is not None:
+                bid.left -= qty
+                if resting_bid:
+                    fx.bids.add(bid.id)
+            cred = {"_id": ObjectId(), "amount_g": int(qty), "owner_account_id": ObjectId(buyer_id), "status": "issued",
+                    "from_offer": str(ask.id), "source_credit_id": str(ask.credit_id), "created_at": now}
+            fx.credits.append(cred)
+            fx.ledger.append(("market_buy", {"buyer_id": buyer_id, "producer_id": ask.owner, "offer_id": str(ask.id),
+                                             "new_credit_id": str(cred["_id"]), "amount_g": int(qty),
+                                             "price_per_g": float(price)}))
+            fx.trades.append({"offer_id": str(ask.id), "bid_id": str(bid.id) if bid is not None else None,
+                              "buyer_id": buyer_id, "seller_id": ask.owner, "credit_id": str(ask.credit_id),
+                              "new_credit_id": str(cred["_id"]), "amount_g": int(qty), "price_per_g": float(price),
+                              "taker": taker, "created_at": now})
+        return missed
+
+    def _plan(self, taker: Order, limit):
+        """Walks the other side best first -> ([(resting order, qty)], "self_trade" or None) for what `taker`
+        would fill against the book as it is now."""
+        out, want = [], taker.left
+        for o in self.book.walk("sell" if taker.side == "buy" else "buy"):
+            if want <= 0 or (limit is not None and (o.price > limit if taker.side == "buy" else o.price < limit)):
+                break
+            if o.owner == taker.owner:
+                return out, "self_trade"
+            out.append((o, min(want, o.left)))
+            want -= out[-1][1]
+        return out, None
+
+    def _match(self, taker: Order, limit, fx: Fills):
+        """Fills `taker` against the other side; -> None, or why it stopped early ("self_trade" / "credit_changed")."""
+        while taker.left > 0:
+            plan, stop = self._plan(taker, limit)
+            if taker.side == "buy":
+                fills = [(o, taker, taker.owner, qty, o.price) for o, qty in plan]
+            else:
+                fills = [(taker, o, o.owner, qty, o.price) for o, qty in plan]
+            missed = self._fill(fills, taker.side, fx)
+            for i, (o, _) in enumerate(plan):
+                why = missed.get(i)
+                if why == "credit" and taker.side == "buy":
+                    self.book.cancel(o.id)        # credit changed outside the book: drop the ask until the next load
+                elif why and (why == "bid" or taker.side == "buy"):
+                    self._refresh(o)              # filled / cancelled through another worker
+                elif o.left <= 0:
+                    self.book.cancel(o.id)
+            if taker.side == "sell" and any(w != "bid" for w in missed.values()):
+                return "credit_changed"           # our own offer / credit moved (cancelled, or spent outside the book)
+            if not missed:
+                return stop                       # all of the plan filled: the book has nothing more for it
+        return None
+
+    # ---------------- orders ----------------
+    def buy(self, buyer_id: str, amount_g: int, price: float = None) -> dict:
+        with self.lock:
+            bid = Order(ObjectId(), "buy", price, int(amount_g), buyer_id)
+            fx = Fills()
+            stop = self._match(bid, price, fx)
+            rests = price is not None and bid.left > 0 and not stop
+            status = "open" if rests else ("filled" if bid.left == 0 else "cancelled")
+            self.db[BIDS].insert_one({"_id": bid.id, "buyer_id": buyer_id, "type": "limit" if price is not None else "market",
+                                      "price_per_g": price, "amount_g": int(amount_g), "left_g": bid.left if rests else 0,
+                                      "status": status, "created_at": datetime.now(timezone.utc)})
+            if rests:
+                self.book.add(bid)
+            fx.flush(self.db)
+            return _result(bid.id, "buy", amount_g, bid.left, status, fx.trades, stop)
+
+    def sell(self, producer_id: str, credit_id: str, amount_g: int, price: float = None) -> tuple:
+        """-> (offer doc, result). price None = market order."""
+        with self.lock:
+            offer = reserve_offer(self.db, producer_id, credit_id, int(amount_g), price)
+            ask = Order(offer["_id"], "sell", price, int(amount_g), producer_id, ObjectId(credit_id))
+            fx = Fills()
+            stop = self._match(ask, price, fx)
+            rests = price is not None and ask.left > 0 and not stop
+            status = "open" if rests else ("closed" if ask.left == 0 else "cancelled")
+            if status == "cancelled":   # unsold part of a market / stopped sell: give the reservation back
+                left = self._close_offer(ask.id, ask.credit_id)
+                ask.left = ask.left if left is None else left
+            if rests:
+                self.book.add(ask)
+            fx.flush(self.db)
+            offer.update(amount_g=ask.left, status=status)
+            return offer, _result(ask.id, "sell", amount_g, ask.left, status, fx.trades, stop)
+
+    def _close_offer(self, offer_id, credit_id):
+        """Cancels an open offer and releases what it still held -> grams released, or None if it was not open."""
+        doc = self.db.market_offers.find_one_and_update({"_id": offer_id, "status": "open"},
+                                                        {"$set": {"status": "cancelled"}}, projection={"amount_g": 1})
+        if doc is None:
+            return None
+        left = int(doc.get("amount_g") or 0)
+        if left:
+            self.db.credits.update_one({"_id": credit_id}, {"$inc": {"locked_g": -left}})
+        return left
+
+    def take(self, offer_id: ObjectId, buyer_id: str, amount_g: int) -> dict:
+        """POST /market/buy: a buyer picks one offer instead of the best price."""
+        with self.lock:
+            offer = self.db.market_offers.find_one({"_id": offer_id})
+            if not offer:
+                raise OrderError("offer not found", 404)
+            if offer.get("status") != "open":
+                raise OrderError("offer closed")
+            if amount_g > int(offer["amount_g"]):
+                raise OrderError(f"exceeds available in offer: {offer['amount_g']}g")
+            credit = self.db.credits.find_one({"_id": ObjectId(offer["credit_id"])}, {"_id": 1})
+            if not credit:
+                raise OrderError("linked credit missing", 404)
+            ask = self.book.orders.get(offer_id) or Order(offer_id, "sell", float(offer["price_per_g"]),
+                                                          int(offer["amount_g"]), str(offer["producer_id"]), credit["_id"])
+            ask.left = int(offer["amount_g"])
+            fx = Fills()
+            if self._fill([(ask, None, buyer_id, amount_g, float(offer["price_per_g"]))], "buy", fx):
+                if offer_id in self.book.orders:
+                    self._refresh(ask)
+                raise OrderError("not enough locked or amount changed concurrently")
+            if not ask.left:
+                self.book.cancel(offer_id)
+            fx.flush(self.db)
+            return {"ok": True, "new_credit_id": str(fx.credits[0]["_id"]), "offer_left": ask.left,
+                    "offer_status": "open" if ask.left else "closed"}
+
+    def cancel(self, order_id: ObjectId, account_id: str) -> dict:
+        with self.lock:
+            bid = self.db[BIDS].find_one({"_id": order_id})
+            if bid:
+                if str(bid["buyer_id"]) != account_id:
+                    raise OrderError("not order owner", 403)
+                doc = self.db[BIDS].find_one_and_update({"_id": order_id, "status": "open"},
+                                                        {"$set": {"status": "cancelled"}}, projection={"left_g": 1})
+                if doc is None:
+                    raise OrderError(f"order is {self.db[BIDS].find_one({'_id': order_id})['status']}", 409)
+                self.book.cancel(order_id)
+                return {"order_id": str(order_id), "side": "buy", "status": "cancelled", "left_g": int(doc["left_g"])}
+            offer = self.db.market_offers.find_one({"_id": order_id})
+            if not offer:
+                raise OrderError("order not found", 404)
+            if str(offer["producer_id"]) != account_id:
+                raise OrderError("not order owner", 403)
+            left = self._close_offer(order_id, ObjectId(offer["credit_id"]))
+            if left is None:
+                raise OrderError(f"order is {self.db.market_offers.find_one({'_id': order_id})['status']}", 409)
+            self.book.cancel(order_id)
+            return {"order_id": str(order_id), "side": "sell", "status": "cancelled", "left_g": left}
+
+    def depth(self, n: int = 20) -> dict:
+        with self.lock:
+            return {"bids": self.book.depth("buy", n), "asks": self.book.depth("sell", n)}
+
+def _result(oid, side, amount_g, left, status, trades, stop) -> dict:
+    filled = int(amount_g) - left
+    notional = sum(t["amount_g"] * t["price_per_g"] for t in trades)
+    out = {"order_id": str(oid), "side": side, "status": status, "amount_g": int(amount_g), "filled_g": filled,
+           "left_g": left if status == "open" else 0, "avg_price_per_g": notional / filled if filled else None,
+           "trades": [{k: t[k] for k in ("offer_id", "bid_id", "new_credit_id", "amount_g", "price_per_g")} for t in trades]}
+    if stop:
+        out["stopped"] = stop
+    return out
+
+def reserve_offer(db, producer_id: str, credit_id: str, amount_g: int, price) -> dict:
+    """Locks amount_g of the credit and inserts the open offer + market_list ledger tx (POST /market/offers)."""
+    from app import ledger_append
+    try:
+        credit = db.credits.find_one({"_id": ObjectId(credit_id)})
+    except Exception:
+        raise OrderError("invalid credit_id")
+    if not credit:
+        raise OrderError("credit not found", 404)
+    if str(credit.get("owner_account_id")) != producer_id:
+        raise OrderError("not credit owner", 403)
+    status = credit.get("status")
+    if status in ["retired", "pending"]:
+        raise OrderError(f"credit status not sellable: {status}")
+    locked    = int(credit.get("locked_g", 0))
+    available = int(credit.get("amount_g", 0)) - locked
+    if amount_g > available:
+        raise OrderError(f"insufficient available: {available}g")
+
+    # atomic reservation (prevent oversell)
+    res = db.credits.update_one({"_id": credit["_id"], "$or": [{"locked_g": locked}, {"locked_g": {"$exists": False}}],
+                                 "ops.0": {"$exists": False}},
+                                {"$set": {"locked_g": locked + amount_g}})
+    if res.modified_count != 1:
+        raise OrderError("reservation failed (concurrent change)")
+
+    offer_doc = {
+        "producer_id": producer_id,
+        "credit_id": credit_id,
+        "amount_g": int(amount_g),
+        "price_per_g": float(price) if price is not None else None,
+        "created_at": datetime.now(timezone.utc),
+        "status": "open",
+    }
+    db.market_offers.insert_one(offer_doc)
+    ledger_append("market_list", {"offer_id": str(offer_doc["_id"]), "producer_id": producer_id, "credit_id": credit_id,
+                                  "amount_g": int(amount_g), "price_per_g": offer_doc["price_per_g"]})
+    return offer_doc
+
+_engines, _engines_lock = {}, threading.Lock()   # pid -> engine
+
+def engine(db) -> MatchingEngine:
+    """This process's engine (a new one after a fork). Its book is loaded from Mongo on first use and reloaded
+    in place, under the engine's own lock, when older than REFRESH_S."""
+    pid = os.getpid()
+    eng = _engines.get(pid)
+    if eng is None:
+        with _engines_lock:
+            eng = _engines.get(pid)
+            if eng is None:
+                _engines.clear()
+                eng = _engines[pid] = MatchingEngine(db)
+    return eng.refresh(REFRESH_S)
@@ -0,0 +1,151 @@
+# profiling.py
+# Opt-in in-place profiling of live requests with cProfile.
+#
+#   PROFILE_SAMPLE_N=50     profile 1 in 50 requests *per route* (0 = off, default)
+#   PROFILE_ROUTES=/api/v1/blocks/close,/api/v2/state/proof/<account_id>   (optional allow-list)
+#   PROFILE_DIR=profiles    where .pstats files go
+#   PROFILE_KEEP=200        newest files kept, older ones pruned
+#   ADMIN_TOKEN=...         required in X-Admin-Token for forced profiles and the admin routes;
+#                           unset = both are off (sampling still works)
+#
+# A single request can be forced with headers "X-Profile: 1" + X-Admin-Token (even when sampling is off).
+# The profile is written when the request is torn down, so views that raise are captured too (status 500);
+# a request is not sampled while another profiler is already active on its thread.
+#
+# Admin:
+#   GET /api/v1/admin/profiles                     newest first
+#   GET /api/v1/admin/profiles/<name>              raw .pstats (python -m pstats / snakeviz)
+#   GET /api/v1/admin/profiles/<name>?format=text  top functions by cumulative time
+
+import os, io, re, sys, hmac, time, threading, cProfile, pstats
+from collections import defaultdict
+
+SAMPLE_N = int(os.getenv("PROFILE_SAMPLE_N", "0"))
+ROUTES   = {r.strip() for r in os.getenv("PROFILE_ROUTES", "").split(",") if r.strip()}
+DIR      = os.getenv("PROFILE_DIR", "profiles")
+KEEP     = int(os.getenv("PROFILE_KEEP", "200"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+_counts = defaultdict(int)
+_lock = threading.Lock()
+_NAME_RE = re.compile(r"^[\w.\-]+\.pstats$")
+
+def _slug(route: str) -> str:
+    return re.sub(r"[^\w]+", "_", route).strip("_") or "root"
+
+def _admin_ok(request) -> bool:
+    # fail closed: no ADMIN_TOKEN configured -> nobody is admin
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+def should_profile(route: str, forced: bool) -> bool:
+    if forced:
+        return True
+    if SAMPLE_N <= 0 or (ROUTES and route not in ROUTES):
+        return False
+    with _lock:
+        _counts[route] += 1
+        return _counts[route] % SAMPLE_N == 0
+
+def _prune():
+    files = sorted((f for f in os.listdir(DIR) if f.endswith(".pstats")), reverse=True)
+    for f in files[KEEP:]:
+        try:
+            os.remove(os.path.join(DIR, f))
+        except OSError:
+            pass
+
+def save(prof: cProfile.Profile, route: str, method: str, status: int, elapsed_s: float) -> str:
+    os.makedirs(DIR, exist_ok=True)
+    # timestamp first so names sort newest-last and prune by name
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}_{int(time.time() * 1e6) % 1_000_000:06d}_{method}_{_slug(route)}_{status}_{int(elapsed_s * 1000)}ms.pstats"
+    prof.dump_stats(os.path.join(DIR, name))
+    _prune()
+    return name
+
+def list_profiles(limit: int = 100) -> list:
+    if not os.path.isdir(DIR):
+        return []
+    out = []
+    for f in sorted((f for f in os.listdir(DIR) if f.endswith(".pstats")), reverse=True)[:limit]:
+        st = os.stat(os.path.join(DIR, f))
+        out.append({"name": f, "bytes": st.st_size, "mtime": int(st.st_mtime)})
+    return out
+
+def text_summary(name: str, top: int = 40) -> str:
+    buf = io.StringIO()
+    pstats.Stats(os.path.join(DIR, name), stream=buf).sort_stats("cumulative").print_stats(top)
+    return buf.getvalue()
+
+def init_app(app):
+    """Register the sampling hooks and the admin listing/download routes on a Flask app."""
+    from flask import g, request, Response, send_file
+
+    def _err(msg: str, code: int):
+        from fastjson import dumps
+        return Response(dumps({"error": msg}), status=code, mimetype="application/json")
+
+    def _int_arg(name: str, default: int, hi: int):
+        """-> (value clamped to [1, hi], None) or (None, 400 response)."""
+        try:
+            return max(1, min(int(request.args.get(name, default)), hi)), None
+        except ValueError:
+            return None, _err(f"{name} must be an integer", 400)
+
+    @app.before_request
+    def _profile_start():
+        route = request.url_rule.rule if request.url_rule else None
+        if route is None:
+            return
+        forced = request.headers.get("X-Profile") == "1" and _admin_ok(request)
+        if not should_profile(route, forced) or sys.getprofile() is not None:
+            return   # another profiler (debugger, outer cProfile) owns this thread: skip the sample
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:   # 3.12+ sys.monitoring: "Another profiling tool is already active"
+            return
+        g._profiler, g._profile_t0 = prof, time.perf_counter()
+
+    def _finish(status: int):
+        prof = g.pop("_profiler", None)
+        if prof is None:
+            return None
+        prof.disable()
+        return save(prof, request.url_rule.rule, request.method, status, time.perf_counter() - g.pop("_profile_t0"))
+
+    @app.after_request
+    def _profile_stop(resp):
+        name = _finish(resp.status_code)
+        if name:
+            resp.headers["X-Profile-Name"] = name
+        return resp
+
+    @app.teardown_request
+    def _profile_teardown(exc):
+        # after_request is skipped when the view raises: never leave the profiler enabled on this thread
+        _finish(500)
+
+    @app.get("/api/v1/admin/profiles")
+    def admin_list_profiles():
+        if not _admin_ok(request):
+            return _err("admin token required", 403)
+        from fastjson import dumps
+        limit, bad = _int_arg("limit", 100, 1000)
+        if bad:
+            return bad
+        return Response(dumps({"dir": DIR, "sample_n": SAMPLE_N, "routes": sorted(ROUTES),
+                               "profiles": list_profiles(limit)}), mimetype="application/json")
+
+    @app.get("/api/v1/admin/profiles/<name>")
+    def admin_get_profile(name):
+        if not _admin_ok(request):
+            return _err("admin token required", 403)
+        if not _NAME_RE.match(name) or not os.path.exists(os.path.join(DIR, name)):
+            return _err("profile not found", 404)
+        if request.args.get("format") == "text":
+            top, bad = _int_arg("top", 40, 10_000)
+            if bad:
+                return bad
+            return Response(text_summary(name, top), mimetype="text/plain")
+        return send_file(os.path.abspath(os.path.join(DIR, name)), mimetype="application/octet-stream",
+                         as_attachment=True, download_name=name)
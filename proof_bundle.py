@@ -0,0 +1,182 @@
+# proof_bundle.py
+# Builds proof bundles (.h2pb) for auditors: block headers, tx inclusion proofs, one SMT proof for a set
+# of account balances and the anchor references, in the binary format documented (and verified
+# offline) by bundle_verifier.py.
+#
+# Shared siblings are written once: each block carries a single multiproof for all requested txs in
+# it (a sibling that another requested tx already yields is never stored), and the state section is
+# one SMT multiproof in which empty-subtree siblings cost one bit.
+#
+#   POST /api/v1/proof/bundle  {"tx_hashes": [...], "account_ids": [...]}  -> application/x-h2-proof-bundle
+#   python proof_bundle.py --tx-file hashes.txt --accounts <id>,<id> --out audit.h2pb
+#
+# PROOF_BUNDLE_MAX_TXS=50000, PROOF_BUNDLE_MAX_ACCOUNTS=10000 cap one request.
+
+import os, re, sys, json, hashlib, argparse
+from datetime import datetime
+
+from bundle_verifier import (MAGIC, VERSION, F_STATE, F_STATE_CONTRACT, B_PREV, B_ANCHOR, B_CONTRACT,
+                             DEFAULTS, fold_merkle, fold_smt, smt_key)
+
+MAX_TXS      = int(os.getenv("PROOF_BUNDLE_MAX_TXS", "50000"))
+MAX_ACCOUNTS = int(os.getenv("PROOF_BUNDLE_MAX_ACCOUNTS", "10000"))
+MIMETYPE     = "application/x-h2-proof-bundle"
+
+_H32 = re.compile(r"^(0x)?[0-9a-fA-F]{64}$")
+_ADDR = re.compile(r"^(0x)?[0-9a-fA-F]{40}$")
+
+class Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def u8(self, v: int):
+        self.buf.append(v)
+
+    def raw(self, b: bytes):
+        self.buf += b
+
+    def hexbytes(self, h: str):
+        self.buf += bytes.fromhex(h.lower().removeprefix("0x"))
+
+    def varint(self, v: int):
+        while v >= 0x80:
+            self.buf.append((v & 0x7F) | 0x80)
+            v >>= 7
+        self.buf.append(v)
+
+def tx_multiproof(block_hashes: list, wanted: set):
+    """-> (leaves [(index, tx_hash)], siblings [hex], root) for the wanted txs of one block."""
+    layers, layer = {}, list(block_hashes)
+    while len(layer) > 1:
+        layers[len(layer)] = layer
+        layer = [hashlib.sha256((layer[i] + (layer[i + 1] if i + 1 < len(layer) else layer[i])).encode("utf-8")).hexdigest()
+                 for i in range(0, len(layer), 2)]
+    siblings = []
+    def take(width, pos):
+        siblings.append(layers[width][pos])
+        return siblings[-1]
+    leaves = sorted((i, h) for i, h in enumerate(block_hashes) if h in wanted)
+    root = fold_merkle(len(block_hashes), dict(leaves), take)
+    return leaves, siblings, root
+
+def smt_multiproof(balances: dict, account_ids: list):
+    """-> (accounts [(id, balance_g)], siblings [bytes | None for default], root hex)."""
+    from phase2.smt_state import build_state_root, leaf_hash
+    root_hex, levels = build_state_root(balances, return_levels=True)
+    siblings = []
+    def take(depth, pos):
+        h = levels[depth].get(pos)
+        siblings.append(h)
+        return DEFAULTS[depth] if h is None else h
+    accounts = [(a, int(balances.get(a, 0))) for a in dict.fromkeys(account_ids)]
+    folded = fold_smt({smt_key(a): leaf_hash(b) for a, b in accounts}, take)
+    if "0x" + folded.hex() != root_hex:
+        raise RuntimeError("SMT multiproof does not reproduce the state root")
+    return accounts, siblings, root_hex
+
+def locate(db, tx_hashes: list):
+    """-> ({block ObjectId: set(tx_hash)}, missing, pending) for the requested txs."""
+    wanted = list(dict.fromkeys(h.lower() for h in tx_hashes))
+    by_block, found, pending = {}, set(), []
+    for i in range(0, len(wanted), 5000):
+        for t in db.ledger_txs.find({"tx_hash": {"$in": wanted[i:i + 5000]}}, {"tx_hash": 1, "block_id": 1}):
+            found.add(t["tx_hash"])
+            if t.get("block_id") is None:
+                pending.append(t["tx_hash"])
+            else:
+                by_block.setdefault(t["block_id"], set()).add(t["tx_hash"])
+    return by_block, [h for h in wanted if h not in found], pending
+
+def build(db, by_block: dict, account_ids: list = (), balances: dict = None, state_contract: str = None) -> bytes:
+    w = Writer()
+    flags = F_STATE if account_ids else 0
+    if account_ids and state_contract and _ADDR.match(state_contract):
+        flags |= F_STATE_CONTRACT
+    w.raw(MAGIC)
+    w.u8(VERSION)
+    w.u8(flags)
+    meta = json.dumps({
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "chain": os.getenv("CHAIN_NAME", "sepolia"),
+        "tx_merkle": "sha256_hex(left_hex || right_hex), odd last node paired with itself, txs in created_at order",
+        "smt": "key sha256(account_id), leaf H(0x00||u256 balance_g), node H(0x01||left||right)",
+        "onchain_block_id": "uint256(sha256(block_id))",
+    }, separators=(",", ":")).encode("utf-8")
+    w.varint(len(meta))
+    w.raw(meta)
+
+    blocks = sorted(db.blocks.find({"_id": {"$in": list(by_block)}}), key=lambda b: b["_id"])
+    w.varint(len(blocks))
+    for b in blocks:
+        # same order as app._block_txs
+        hashes = [t["tx_hash"] for t in db.ledger_txs.find({"block_id": b["_id"]}, {"tx_hash": 1}).sort("created_at", 1)]
+        leaves, siblings, root = tx_multiproof(hashes, by_block[b["_id"]])
+        anchor_tx, contract = b.get("anchor_tx") or "", b.get("contract_address") or ""
+        bits = ((B_PREV if b.get("prev_hash") else 0) | (B_ANCHOR if _H32.match(anchor_tx) else 0)
+                | (B_CONTRACT if _ADDR.match(contract) else 0))
+        w.raw(b["_id"].binary)
+        w.hexbytes(b["merkle_root"])
+        w.u8(bits)
+        if bits & B_PREV:
+            w.hexbytes(b["prev_hash"])
+        w.hexbytes(b["chain_hash"])
+        w.varint(len(hashes))
+        if bits & B_CONTRACT:
+            w.hexbytes(contract)
+        if bits & B_ANCHOR:
+            w.hexbytes(anchor_tx)
+        w.varint(len(leaves))
+        for i, h in leaves:
+            w.varint(i)
+            w.hexbytes(h)
+        w.varint(len(siblings))
+        for h in siblings:
+            w.hexbytes(h)
+
+    if account_ids:
+        accounts, siblings, root_hex = smt_multiproof(balances or {}, account_ids)
+        w.hexbytes(root_hex)
+        if flags & F_STATE_CONTRACT:
+            w.hexbytes(state_contract)
+        w.varint(len(accounts))
+        for a, bal in accounts:
+            ab = a.encode("utf-8")
+            w.varint(len(ab))
+            w.raw(ab)
+            w.varint(bal)
+        w.varint(len(siblings))
+        bitmap = bytearray((len(siblings) + 7) // 8)
+        for i, h in enumerate(siblings):
+            if h is not None:
+                bitmap[i >> 3] |= 0x80 >> (i & 7)
+        w.raw(bytes(bitmap))
+        for h in siblings:
+            if h is not None:
+                w.raw(h)
+    return bytes(w.buf)
+
+def main():
+    ap = argparse.ArgumentParser(description="Export a proof bundle for auditors")
+    ap.add_argument("--tx-file", help="tx hashes, one per line")
+    ap.add_argument("--txs", default="", help="comma-separated tx hashes")
+    ap.add_argument("--accounts", default="", help="comma-separated account ids for the state proof")
+    ap.add_argument("--out", default="proof_bundle.h2pb")
+    args = ap.parse_args()
+
+    from app import db, _fetch_balances, ANCHOR_ADDR
+    txs = [h for h in args.txs.split(",") if h]
+    if args.tx_file:
+        with open(args.tx_file) as f:
+            txs += [l.strip() for l in f if l.strip() and not l.startswith("#")]
+    accounts = [a for a in args.accounts.split(",") if a]
+    by_block, missing, pending = locate(db, txs)
+    if missing or pending:
+        sys.exit(f"❌ {len(missing)} tx(s) not found, {len(pending)} not in a closed block yet: "
+                 f"{(missing + pending)[:5]}")
+    data = build(db, by_block, accounts, _fetch_balances() if accounts else None, ANCHOR_ADDR)
+    with open(args.out, "wb") as f:
+        f.write(data)
+    print(f"✔ wrote {args.out}: {len(by_block)} blocks, {len(txs)} txs, {len(accounts)} accounts, {len(data):,} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# registry_audit.py
+# Offline re-verification of the whole registry straight from Mongo (no API, no chain).
+#
+#   ledger   : every ledger_txs.tx_hash recomputed from type + payload; every block's merkle_root
+#              recomputed from its txs (created_at order), tx_count, prev_hash / chain_hash linkage
+#   events   : every production_events.payload_canonical re-verified against its sensor's Ed25519 key
+#              and compared with the stored signature_valid flag; per-file signed events (evidence ingest)
+#              must carry their evidence's id and sha256_hex, per-row ones the event's own values
+#   balances : credits replayed (ledger_replay.LedgerState) from every credit-moving tx (mint, transfer,
+#              retire, multi_*, market_*, merge) in block order (pending txs last), compared credit-by-credit
+#              and per account with db.credits, and the SMT state root (phase2.smt_state) recomputed from both sides
+#
+# Blocks are cut into shards of ~--shard-txs txs and events into shards of --shard-events, checked in
+# a process pool (--procs, each worker with its own MongoClient). Block results are folded back in
+# block order, so the replay stays sequential and only touches compact balance ops.
+# Progress goes to stderr; state is pickled to --checkpoint every --checkpoint-every seconds (always
+# between shards, so it is consistent), and --resume continues from the last one after a crash/Ctrl-C.
+#
+# usage:
+#   python registry_audit.py --procs 8 --report audit_report.json
+#   python registry_audit.py --resume              # after a crash / Ctrl-C
+#
+# exit status: 0 clean, 2 mismatches found
+
+import os, sys, time, json, pickle, argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from app import tx_hash, merkle_root, sha256_hex, load_pubkey, MONGODB_URI, DB_NAME
+from phase2.smt_state import build_state_root
+from ledger_replay import LedgerState, REPLAY_TYPES as BALANCE_TYPES
+
+MAX_LISTED = 100000   # mismatches kept in the report; all are counted
+
+# ---------------- worker side ----------------
+_db = None
+_keys = {}
+_evidence_sha = {}
+
+def _init_worker(uri: str, name: str):
+    global _db
+    from pymongo import MongoClient
+    _db = MongoClient(uri)[name]
+    _keys.clear()
+    _evidence_sha.clear()
+
+def audit_blocks(block_ids: list) -> list:
+    """-> [(block_id, tx_count, recomputed_root, bad_tx_hashes, balance_ops)] in the given block order."""
+    by_block = {b: [] for b in block_ids}
+    for t in _db.ledger_txs.find({"block_id": {"$in": block_ids}},
+                                 {"type": 1, "payload": 1, "tx_hash": 1, "block_id": 1, "created_at": 1}):
+        by_block[t["block_id"]].append(t)
+    out = []
+    for b in block_ids:
+        txs = sorted(by_block[b], key=lambda t: (t["created_at"], t["_id"]))
+        bad, ops = [], []
+        for t in txs:
+            want = tx_hash({"type": t["type"], **t["payload"]})
+            if want != t["tx_hash"]:
+                bad.append((t["tx_hash"], want))
+            if t["type"] in BALANCE_TYPES:
+                ops.append((t["type"], t["payload"], t["tx_hash"]))
+        out.append((b, len(txs), merkle_root([t["tx_hash"] for t in txs]), bad, ops))
+    return out
+
+def _pubkey(sensor_id):
+    if sensor_id not in _keys:
+        s = _db.sensors.find_one({"_id": sensor_id}, {"public_key_pem": 1})
+        try:
+            _keys[sensor_id] = load_pubkey(s["public_key_pem"]) if s else None
+        except ValueError:
+            _keys[sensor_id] = None
+    return _keys[sensor_id]
+
+def _evidence_sha256(evidence_id):
+    if evidence_id not in _evidence_sha:
+        ev = _db.evidence.find_one({"_id": evidence_id}, {"sha256_hex": 1}) if evidence_id is not None else None
+        _evidence_sha[evidence_id] = ev and ev.get("sha256_hex")
+    return _evidence_sha[evidence_id]
+
+def _payload_matches(e: dict, canonical: str) -> bool:
+    """Does the signed canonical describe this event? Per-file signatures (evidence ingest, signature_scope
+    "file") sign {evidence_id, sensor_id, sha256_hex} of the evidence the event was read from."""
+    p = json.loads(canonical)
+    if p.get("sensor_id") != str(e.get("sensor_id")):
+        return False
+    if e.get("signature_scope") == "file":
+        sha = _evidence_sha256(e.get("evidence_id"))
+        return bool(sha) and p.get("evidence_id") == str(e.get("evidence_id")) and p.get("sha256_hex") == sha
+    return p.get("hydrogen_kg") == round(float(e.get("hydrogen_kg")), 6)
+
+def audit_events(bounds: tuple) -> tuple:
+    """Events with lo < _id <= hi -> (checked, valid, mismatches)."""
+    from cryptography.exceptions import InvalidSignature
+    lo, hi = bounds
+    q = {"_id": {"$lte": hi}}
+    if lo is not None:
+        q["_id"]["$gt"] = lo
+    proj = {"sensor_id": 1, "payload_canonical": 1, "sensor_signature_hex": 1, "signature_valid": 1, "hydrogen_kg": 1,
+            "signature_scope": 1, "evidence_id": 1}
+    n = valid = 0
+    bad = []
+    for e in _db.production_events.find(q, proj):
+        n += 1
+        eid = str(e["_id"])
+        canonical, sig = e.get("payload_canonical"), e.get("sensor_signature_hex")
+        pub = _pubkey(e.get("sensor_id"))
+        ok = False
+        if pub is None:
+            bad.append({"event_id": eid, "reason": "sensor_missing", "sensor_id": str(e.get("sensor_id"))})
+        elif canonical and sig:
+            try:
+                pub.verify(bytes.fromhex(sig), canonical.encode("utf-8"))
+                ok = True
+            except (InvalidSignature, ValueError):
+                pass
+            try:
+                same = _payload_matches(e, canonical)
+            except (ValueError, TypeError, AttributeError):
+                same = False
+            if not same:
+                bad.append({"event_id": eid, "reason": "payload_mismatch"})
+        valid += ok
+        if ok != bool(e.get("signature_valid")):
+            bad.append({"event_id": eid, "reason": "signature_flag_mismatch",
+                        "recomputed": ok, "stored": e.get("signature_valid")})
+    return n, valid, bad
+
+# ---------------- driver ----------------
+
+def ordered(ex, fn, items, window: int):
+    """Like ex.map(fn, items) but with at most `window` tasks in flight; ex=None runs inline."""
+    if ex is None:
+        for it in items:
+            yield it, fn(it)
+        return
+    pending = []
+    for it in items:
+        pending.append((it, ex.submit(fn, it)))
+        if len(pending) >= window:
+            it0, fut = pending.pop(0)
+            yield it0, fut.result()
+    for it0, fut in pending:
+        yield it0, fut.result()
+
+class Progress:
+    def __init__(self, every: float = 2.0):
+        self.every, self.last = every, 0.0
+
+    def __call__(self, msg: str, force: bool = False):
+        now = time.perf_counter()
+        if force or now - self.last >= self.every:
+            self.last = now
+            print(msg, file=sys.stderr, flush=True)
+
+class Audit:
+    """Everything a resumed run needs; pickled as-is to the checkpoint file."""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.phase = "events"
+        self.events_after = None     # last production_events _id of the completed prefix
+        self.blocks_done = 0         # blocks (in _id order) folded into the replay
+        self.last_block = None
+        self.prev_root = None
+        self.pending_done = False
+        self.ledger = LedgerState()  # balance replay (ledger_replay.py)
+        self.counts = Counter()
+        self.mismatches = []
+        self.timing = {}
+        self.summary = {}
+
+    def flag(self, **m):
+        self.counts["mismatch:" + m["reason"]] += 1
+        if len(self.mismatches) < MAX_LISTED:
+            self.mismatches.append(m)
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def apply(self, typ: str, p: dict, th: str):
+        why = self.ledger.apply(typ, p)
+        if why:
+            src_id = self.ledger.offers.get(p.get("offer_id")) if typ == "market_buy" else p.get("credit_id")
+            self.flag(reason=f"replay_invalid_{typ}", detail=why, tx_hash=th, credit_id=src_id,
+                      replayed=self.ledger.credits.get(src_id))
+
+    # ---- phases ----
+    def run_events(self, db, ex, args, progress, ckpt):
+        def shards():
+            q = {"_id": {"$gt": self.events_after}} if self.events_after is not None else {}
+            lo, n = self.events_after, 0
+            for d in db.production_events.find(q, {"_id": 1}).sort("_id", 1):
+                n += 1
+                if n == args.shard_events:
+                    yield (lo, d["_id"])
+                    lo, n = d["_id"], 0
+            if n:
+                yield (lo, d["_id"])
+
+        total = db.production_events.estimated_document_count()
+        for (lo, hi), (n, valid, bad) in ordered(ex, audit_events, shards(), args.procs * 4):
+            self.counts["events"] += n
+            self.counts["signatures_valid"] += valid
+            for m in bad:
+                self.flag(**m)
+            self.events_after = hi
+            progress(f"  events {self.counts['events']:,}/{total:,}")
+            ckpt()
+
+    def run_ledger(self, db, ex, args, progress, ckpt):
+        proj = {"merkle_root": 1, "prev_hash": 1, "chain_hash": 1, "tx_count": 1}
+        blocks = list(db.blocks.find({}, proj).sort("_id", 1))
+        if self.blocks_done and str(blocks[self.blocks_done - 1]["_id"]) != self.last_block:
+            raise SystemExit("checkpoint does not match db.blocks (blocks deleted or reordered); rerun without --resume")
+        header = {b["_id"]: b for b in blocks}
+
+        def shards():
+            cur, n = [], 0
+            for b in blocks[self.blocks_done:]:
+                cur.append(b["_id"])
+                n += int(b.get("tx_count") or 0)
+                if n >= args.shard_txs:
+                    yield cur
+                    cur, n = [], 0
+            if cur:
+                yield cur
+
+        for _, results in ordered(ex, audit_blocks, shards(), args.procs * 4):
+            for bid, n, root, bad, ops in results:
+                b = header[bid]
+                self.check_block(b, n, root, bad)
+                for op in ops:
+                    self.apply(*op)
+                self.counts["txs"] += n
+                self.counts["blocks"] += 1
+                self.blocks_done += 1
+                self.last_block = str(bid)
+            progress(f"  ledger {self.blocks_done:,}/{len(blocks):,} blocks, {self.counts['txs']:,} txs")
+            ckpt()
+
+        if not self.pending_done:
+            pend = db.ledger_txs.find({"$or": [{"block_id": None}, {"block_id": {"$exists": False}}]},
+                                      {"type": 1, "payload": 1, "tx_hash": 1}).sort([("created_at", 1), ("_id", 1)])
+            for t in pend:
+                self.counts["pending_txs"] += 1
+                if tx_hash({"type": t["type"], **t["payload"]}) != t["tx_hash"]:
+                    self.flag(reason="tx_hash_mismatch", tx_hash=t["tx_hash"], block_id=None)
+                if t["type"] in BALANCE_TYPES:
+                    self.apply(t["type"], t["payload"], t["tx_hash"])
+            self.pending_done = True
+
+    def check_block(self, b: dict, n: int, root: str, bad: list):
+        bid = str(b["_id"])
+        for stored, want in bad:
+            self.flag(reason="tx_hash_mismatch", tx_hash=stored, recomputed=want, block_id=bid)
+        if n != b.get("tx_count"):
+            self.flag(reason="tx_count_mismatch", block_id=bid, stored=b.get("tx_count"), recomputed=n)
+        if root != b.get("merkle_root"):
+            self.flag(reason="merkle_root_mismatch", block_id=bid, stored=b.get("merkle_root"), recomputed=root)
+        if b.get("prev_hash") != self.prev_root:
+            self.flag(reason="prev_hash_mismatch", block_id=bid, stored=b.get("prev_hash"), expected=self.prev_root)
+        want = sha256_hex(((b.get("prev_hash") or "") + (b.get("merkle_root") or "")).encode("utf-8"))
+        if b.get("chain_hash") != want:
+            self.flag(reason="chain_hash_mismatch", block_id=bid, stored=b.get("chain_hash"), recomputed=want)
+        self.prev_root = b.get("merkle_root")
+
+    def run_balances(self, db, progress):
+        seen = set()
+        db_bal = Counter()
+        for cr in db.credits.find({}, {"owner_account_id": 1, "amount_g": 1, "status": 1}):
+            cid, owner = str(cr["_id"]), str(cr.get("owner_account_id"))
+            amount, retired = int(cr.get("amount_g") or 0), cr.get("status") == "retired"
+            if not retired:   # same rule as app._fetch_balances (everything not retired)
+                db_bal[owner] += amount
+            seen.add(cid)
+            r = self.ledger.credits.get(cid)
+            if r is None:
+                self.flag(reason="credit_not_in_ledger", credit_id=cid)
+            elif r[0] != owner or r[2] != retired or (not retired and r[1] != amount):
+                self.flag(reason="credit_mismatch", credit_id=cid, stored=[owner, amount, retired], replayed=r)
+        for cid in self.ledger.credits.keys() - seen:
+            self.flag(reason="credit_missing", credit_id=cid, replayed=self.ledger.credits[cid])
+
+        ledger_bal, db_bal = Counter(self.ledger.balances()), +db_bal   # zero balances are default SMT leaves
+        for acc in ledger_bal.keys() | db_bal.keys():
+            if ledger_bal[acc] != db_bal[acc]:
+                self.flag(reason="balance_mismatch", account_id=acc, stored_g=db_bal[acc], replayed_g=ledger_bal[acc])
+        progress(f"  balances: {len(ledger_bal):,} accounts, building SMT roots", force=True)
+        root_ledger = build_state_root(dict(ledger_bal))
+        root_db = root_ledger if ledger_bal == db_bal else build_state_root(dict(db_bal))
+        if root_ledger != root_db:
+            self.flag(reason="state_root_mismatch", stored=root_db, replayed=root_ledger)
+        self.summary.update(credits=len(self.ledger.credits), accounts=len(ledger_bal),
+                            state_root_replayed=root_ledger, state_root_db=root_db)
+
+def main():
+    ap = argparse.ArgumentParser(description="Re-verify the whole registry offline")
+    ap.add_argument("--uri", default=MONGODB_URI)
+    ap.add_argument("--db", default=DB_NAME)
+    ap.add_argument("--procs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--shard-txs", type=int, default=20000, help="ledger txs per block shard (whole blocks)")
+    ap.add_argument("--shard-events", type=int, default=20000, help="events per signature shard")
+    ap.add_argument("--report", default="audit_report.json")
+    ap.add_argument("--checkpoint", default="audit.ckpt")
+    ap.add_argument("--checkpoint-every", type=float, default=30.0, help="seconds")
+    ap.add_argument("--resume", action="store_true")
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri)[args.db]
+    if args.resume and os.path.exists(args.checkpoint):
+        with open(args.checkpoint, "rb") as f:
+            audit = pickle.load(f)
+        if audit.db_name != args.db:
+            sys.exit(f"❌ checkpoint is for {audit.db_name}, not {args.db}")
+        print(f"== resuming {args.db} at phase {audit.phase} ==", file=sys.stderr)
+    else:
+        audit = Audit(args.db)
+
+    last_save = [time.perf_counter()]
+    def ckpt(force=False):
+        if force or time.perf_counter() - last_save[0] >= args.checkpoint_every:
+            audit.save(args.checkpoint)
+            last_save[0] = time.perf_counter()
+
+    progress = Progress()
+    _init_worker(args.uri, args.db)   # inline runs (--procs 1) use this process as the worker
+    ex = (ProcessPoolExecutor(max_workers=args.procs, initializer=_init_worker, initargs=(args.uri, args.db))
+          if args.procs > 1 else None)
+    try:
+        for phase in ("events", "ledger", "balances"):
+            if audit.phase != phase:
+                continue
+            t0 = time.perf_counter()
+            print(f"== {phase} ==", file=sys.stderr)
+            if phase == "events":
+                audit.run_events(db, ex, args, progress, ckpt)
+                audit.phase = "ledger"
+            elif phase == "ledger":
+                audit.run_ledger(db, ex, args, progress, ckpt)
+                audit.phase = "balances"
+            else:
+                audit.run_balances(db, progress)
+                audit.phase = "done"
+            audit.timing[phase] = round(audit.timing.get(phase, 0) + time.perf_counter() - t0, 3)
+            ckpt(force=True)
+    except KeyboardInterrupt:
+        sys.exit(f"interrupted; rerun with --resume to continue from {args.checkpoint}")
+    finally:
+        if ex:
+            ex.shutdown(cancel_futures=True)
+
+    c = audit.counts
+    by_reason = {k.split(":", 1)[1]: v for k, v in c.items() if k.startswith("mismatch:")}
+    total_s = sum(audit.timing.values())
+    summary = {
+        "db": args.db, "blocks": c["blocks"], "txs": c["txs"], "pending_txs": c["pending_txs"],
+        "events": c["events"], "signatures_valid": c["signatures_valid"],
+        **audit.summary,
+        "state_roots_match": audit.summary.get("state_root_replayed") == audit.summary.get("state_root_db"),
+        "mismatches": sum(by_reason.values()), "mismatches_by_reason": by_reason,
+        "timing_s": {**audit.timing, "total": round(total_s, 3)},
+        "tx_per_s": round(c["txs"] / audit.timing["ledger"], 1) if audit.timing.get("ledger") else None,
+    }
+    with open(args.report, "w") as f:
+        json.dump({"summary": summary, "mismatches": audit.mismatches}, f, indent=2, default=str)
+    print(json.dumps(summary, indent=2))
+    print("report:", args.report)
+    sys.exit(2 if by_reason else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# tester_anchor_indexer.py
+# Tests anchor_indexer.sync() against DevChain, an in-process stand-in for a dev chain's JSON-RPC
+# (eth_blockNumber / eth_getLogs / eth_getBlockByNumber), so no node and no contract are needed.
+#
+# What it verifies:
+# 1) Backfill from --from-block, staying `confirmations` behind head; eth_getLogs ranges the "provider"
+#    rejects as too large are halved
+# 2) Logs inside the confirmation window are not indexed until they are deep enough
+# 3) Resume: a second run continues from anchor_index_state, a run with no new blocks scans nothing
+# 4) Reorg deeper than the confirmation window: the saved height's hash no longer matches, the indexer
+#    rewinds, applies the removed logs (event gone / moved to its new block with its new root) and
+#    catches up
+# 5) An anchor reorged out with no replacement disappears from the index
+#
+# Prereqs: a MongoDB (MONGODB_URI); the test database is dropped before and after the run.
+#
+# Usage:
+#   python tester_anchor_indexer.py [--db h2_anchor_indexer_test]
+#
+# Exit codes:
+#   0 = all checks passed
+#   2 = a check failed
+
+import os, sys, hashlib, argparse
+
+import anchor_indexer
+
+CONTRACT = "0x361f4564d6f6f045adecf7eb7f88d018ffa7447a"
+CALLER   = "0x" + "ab" * 20
+
+def _h(*parts) -> str:
+    return "0x" + hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+
+class DevChain:
+    """Blocks with Anchored logs, head moved with mine(); reorg() swaps the newest blocks for a fork."""
+
+    def __init__(self, max_range: int = None):
+        self.blocks = []      # [{"hash", "logs"}], index = block number
+        self.removed = []     # logs reorged out, delivered with "removed": true by eth_getLogs
+        self.max_range, self.fork = max_range, 0
+        self.mine(1)          # genesis
+
+    def mine(self, n: int = 1, anchors: dict = None):
+        """Appends n blocks; anchors: {offset in this batch: [(onchain_block_id, root hex)]}."""
+        for i in range(n):
+            num = len(self.blocks)
+            h = _h("block", num, self.fork)
+            logs = [self._log(num, h, k, bid, root) for k, (bid, root) in enumerate((anchors or {}).get(i, []))]
+            self.blocks.append({"hash": h, "logs": logs})
+
+    def reorg(self, depth: int, n: int, anchors: dict = None):
+        """Drops the newest `depth` blocks (their logs come back as removed) and mines n fork blocks."""
+        for b in self.blocks[-depth:]:
+            self.removed += [{**l, "removed": True} for l in b["logs"]]
+        del self.blocks[-depth:]
+        self.fork += 1
+        self.mine(n, anchors)
+
+    def _log(self, num, block_hash, index, onchain_block_id, root) -> dict:
+        return {"address": CONTRACT, "blockNumber": hex(num), "blockHash": block_hash, "logIndex": hex(index),
+                "transactionHash": _h("tx", block_hash, index), "removed": False,
+                "topics": [anchor_indexer.topic0(), "0x" + format(onchain_block_id, "064x"), "0x" + root,
+                           "0x" + "0" * 24 + CALLER[2:]]}
+
+    # ---- the JSON-RPC surface anchor_indexer uses (same as anchor_verifier.BatchRPC) ----
+    def block_number(self) -> int:
+        return len(self.blocks) - 1
+
+    def call(self, method: str, params: list):
+        if method == "eth_blockNumber":
+            return hex(self.block_number())
+        if method == "eth_getBlockByNumber":
+            n = int(params[0], 16)
+            return {"number": params[0], "hash": self.blocks[n]["hash"]} if n < len(self.blocks) else None
+        if method == "eth_getLogs":
+            f = params[0]
+            lo, hi = int(f["fromBlock"], 16), int(f["toBlock"], 16)
+            if self.max_range and hi - lo + 1 > self.max_range:
+                raise RuntimeError({"code": -32005, "message": "query returned more than 10000 results"})
+            inside = lambda l: lo <= int(l["blockNumber"], 16) <= hi
+            out = [l for l in self.removed if inside(l)]
+            self.removed = [l for l in self.removed if not inside(l)]
+            for b in self.blocks[lo:hi + 1]:
+                out += [l for l in b["logs"] if l["address"] == f["address"] and l["topics"][0] == f["topics"][0]]
+            return out
+        raise RuntimeError(f"DevChain: unsupported method {method}")
+
+failures = []
+
+def check(cond: bool, msg: str):
+    print(("  ✔ " if cond else "  ✘ ") + msg)
+    if not cond:
+        failures.append(msg)
+
+def root(i) -> str:
+    return hashlib.sha256(f"root{i}".encode()).hexdigest()
+
+def main():
+    ap = argparse.ArgumentParser(description="anchor_indexer against an in-process dev chain")
+    ap.add_argument("--uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--db", default="h2_anchor_indexer_test")
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    client = MongoClient(args.uri)
+    client.drop_database(args.db)
+    db = client[args.db]
+    quiet = lambda msg: None
+    events = lambda: {e["onchain_block_id"]: e for e in db[anchor_indexer.EVENTS].find()}
+    anchor_indexer.REORG_REWIND = 20
+
+    print("1) backfill")
+    chain = DevChain(max_range=5)
+    chain.mine(9)                                           # blocks 1..9
+    chain.mine(40, {0: [(1, root(1))], 7: [(2, root(2))], 20: [(3, root(3)), (4, root(4))]})   # 10..49
+    st = anchor_indexer.sync(db, chain, CONTRACT, from_block=5, confirmations=6, chunk=20, log=quiet)
+    ev = events()
+    check((st["from"], st["to"]) == (5, 43), f"scanned 5..43 (got {st['from']}..{st['to']})")
+    check(set(ev) == {"1", "2", "3", "4"}, f"4 Anchored logs indexed (got {sorted(ev)})")
+    check(ev["2"]["block_number"] == 17 and ev["2"]["root"] == root(2), "event 2 at block 17 with its root")
+    check(ev["3"]["tx_hash"] != ev["4"]["tx_hash"] and ev["4"]["log_index"] == 1, "two logs in one block kept apart")
+    check(st["ranges"] == 8, f"ranges halved to the provider limit (5 blocks -> 8 requests, got {st['ranges']})")
+    check(anchor_indexer.indexed_height(db, CONTRACT) == 43, "anchor_index_state at 43")
+
+    print("2) confirmations")
+    chain.mine(3, {1: [(5, root(5))]})                      # 50..52, anchor 5 at 51 (head 52 -> safe 46)
+    anchor_indexer.sync(db, chain, CONTRACT, confirmations=6, log=quiet)
+    check("5" not in events(), "anchor in the last 6 blocks not indexed yet")
+
+    print("3) resume")
+    chain.mine(10)                                          # head 62 -> safe 56
+    st = anchor_indexer.sync(db, chain, CONTRACT, from_block=0, confirmations=6, log=quiet)
+    check(st["from"] == 47 and st["rewound_to"] is None, f"resumed after the saved height, not --from-block (from {st['from']})")
+    check("5" in events() and events()["5"]["block_number"] == 51, "anchor 5 indexed once confirmed")
+    st = anchor_indexer.sync(db, chain, CONTRACT, confirmations=6, log=quiet)
+    check(st["ranges"] == 0 and st["logs"] == 0, "nothing new -> nothing scanned")
+    n_before = db[anchor_indexer.EVENTS].count_documents({})
+    db[anchor_indexer.STATE].update_one({"_id": CONTRACT}, {"$set": {"last_block": 20,
+                                                                     "last_block_hash": chain.blocks[20]["hash"].lower()}})
+    chain.max_range = None
+    st = anchor_indexer.sync(db, chain, CONTRACT, confirmations=6, log=quiet)
+    check(st["rewound_to"] is None and st["logs"] == 3, f"re-scan from 21 finds anchors 3, 4, 5 again (got {st['logs']})")
+    check(db[anchor_indexer.EVENTS].count_documents({}) == n_before, "re-scanning indexed blocks adds no duplicates")
+
+    print("4) reorg deeper than the confirmation window")
+    # fork off block 47: anchor 5 (block 51) moves to a new block with a new root, anchor 2 is untouched
+    chain.reorg(depth=16, n=18, anchors={6: [(5, root(55))], 9: [(6, root(6))]})   # new 47..64, head 64 -> safe 58
+    st = anchor_indexer.sync(db, chain, CONTRACT, confirmations=6, log=quiet)
+    ev = events()
+    check(st["rewound_to"] == 37, f"stale saved block detected, rewound to 37 (got {st['rewound_to']})")
+    check(st["removed"] == 1, f"removed log applied (got {st['removed']})")
+    check(ev["5"]["root"] == root(55) and ev["5"]["block_number"] == 53, "anchor 5 now at its fork block / root")
+    check(ev["6"]["block_number"] == 56 and set(ev) == {"1", "2", "3", "4", "5", "6"}, "fork-only anchor indexed")
+    check(ev["5"]["block_hash"] == chain.blocks[53]["hash"].lower(), "indexed block hash is the fork's")
+    check(db[anchor_indexer.STATE].find_one({"_id": CONTRACT})["last_block_hash"] == chain.blocks[58]["hash"].lower(),
+          "saved height carries the fork's block hash")
+
+    print("5) anchor reorged out for good")
+    chain.reorg(depth=10, n=12)                             # drops anchor 6 (block 56) for good; head 66 -> safe 60
+    st = anchor_indexer.sync(db, chain, CONTRACT, confirmations=6, log=quiet)
+    check("6" not in events() and "5" in events(), "reorged-out anchor dropped, older one kept")
+
+    client.drop_database(args.db)
+    print("✔ all checks passed" if not failures else f"✘ {len(failures)} check(s) failed")
+    sys.exit(2 if failures else 0)
+
+if __name__ == "__main__":
+    main()
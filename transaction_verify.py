@@ -1,9 +1,34 @@
 # verify_tx.py
 # usage: python verify_tx.py <api_base> <tx_hash>
+#        python verify_tx.py <api_base> --file hashes.txt [--workers 32] [--procs 4] [--report verify_report.json]
 # example: python verify_tx.py http://127.0.0.1:5000/api/v1 119f5d1e...
+#
+# Batch mode (quarterly audits):
+#   - proofs fetched concurrently over one pooled HTTP session
+#   - grouped by (contract_address, onchain_block_id): each on-chain root is read once
+#   - proofs folded in a process pool, in chunks
+#   - summary + every failure written to --report (JSON)
+# RPC: --rpc or WEB3_RPC_URL
 
-import sys, requests, hashlib
-from web3 import Web3
+import sys, os, json, time, argparse, hashlib, threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import requests
+
+DEFAULT_RPC = "https://eth-sepolia.g.alchemy.com/v2/47qnmmhS4pv3SC7AIZQ51"
+ROOTS_ABI = [
+    {
+        "inputs": [
+            {"internalType": "uint256", "name": "blockId", "type": "uint256"}
+        ],
+        "name": "roots",
+        "outputs": [{"internalType": "bytes32", "name": "", "type": "bytes32"}],
+        "stateMutability": "view",
+        "type": "function",
+    }
+]
+ZERO_ROOT = "0" * 64
+FOLD_CHUNK = 2000
 
 
 def sha256_hex(b: bytes) -> str:
@@ -21,6 +46,32 @@ def fold_proof(tx_hash, proof):
     return cur
 
 
+def fold_chunk(items):
+    """[(tx_hash, proof, merkle_root)] -> [bool]; runs in worker processes."""
+    return [fold_proof(th, proof) == (root or "").lower() for th, proof, root in items]
+
+
+def norm_root(h) -> str:
+    h = h.hex() if hasattr(h, "hex") and not isinstance(h, str) else str(h)
+    h = h.lower()
+    return h[2:] if h.startswith("0x") else h
+
+
+def roots_reader(rpc_url: str):
+    """(contract_address, onchain_block_id) -> on-chain root hex (no 0x)."""
+    from web3 import Web3
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    contracts, lock = {}, threading.Lock()
+
+    def read(address: str, onchain_block_id) -> str:
+        with lock:
+            c = contracts.get(address)
+            if c is None:
+                c = contracts[address] = w3.eth.contract(address=Web3.to_checksum_address(address), abi=ROOTS_ABI)
+        return norm_root(c.functions.roots(int(onchain_block_id)).call())
+    return read
+
+
 def main():
     api = sys.argv[1]
     th = sys.argv[2].lower()
@@ -34,30 +85,167 @@ def main():
     print("local==server?", ok_local)
 
     # check on-chain
-    w3 = Web3(
-        Web3.HTTPProvider("https://eth-sepolia.g.alchemy.com/v2/47qnmmhS4pv3SC7AIZQ51")
-    )
-    abi = [
-        {
-            "inputs": [
-                {"internalType": "uint256", "name": "blockId", "type": "uint256"}
-            ],
-            "name": "roots",
-            "outputs": [{"internalType": "bytes32", "name": "", "type": "bytes32"}],
-            "stateMutability": "view",
-            "type": "function",
-        }
-    ]
-    c = w3.eth.contract(address=Web3.to_checksum_address(p["contract_address"]), abi=abi)
-    onchain_root = c.functions.roots(int(p["onchain_block_id"])).call().hex()
-    ok_chain = onchain_root.lower() == p["merkle_root"].lower()
+    read_root = roots_reader(os.getenv("WEB3_RPC_URL", DEFAULT_RPC))
+    onchain_root = read_root(p["contract_address"], p["onchain_block_id"])
+    ok_chain = onchain_root == p["merkle_root"].lower()
     print("on-chain root:", onchain_root)
     print("server==chain?", ok_chain)
     print("VERIFIED:", ok_local and ok_chain)
 
 
+# ---------------- batch mode ----------------
+
+def read_hashes(path: str) -> list:
+    seen, out = set(), []
+    with open(path) as f:
+        for line in f:
+            h = line.strip().lower()
+            if h and not h.startswith("#") and h not in seen:
+                seen.add(h)
+                out.append(h)
+    return out
+
+
+def fetch_proofs(api: str, hashes: list, workers: int, timeout: float):
+    """Yields (tx_hash, proof_json | None, error | None) as responses arrive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def one(th):
+        try:
+            r = session.get(f"{api}/proof/tx/{th}", timeout=timeout)
+        except requests.RequestException as e:
+            return th, None, f"fetch_error: {e}"
+        if r.status_code == 404:
+            return th, None, "not_found"
+        if r.status_code != 200:
+            return th, None, f"http_{r.status_code}"
+        return th, r.json(), None
+
+    window = workers * 64   # bounded number of in-flight futures
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for lo in range(0, len(hashes), window):
+            for fut in as_completed([ex.submit(one, th) for th in hashes[lo:lo + window]]):
+                yield fut.result()
+
+
+def batch(args):
+    api = args.api.rstrip("/")
+    hashes = read_hashes(args.file)
+    t0 = time.perf_counter()
+    print(f"verifying {len(hashes)} tx hashes against {api}", file=sys.stderr)
+
+    failures = []                 # {"tx_hash", "reason", ...}
+    by_block = {}                 # (contract, onchain_id) -> {"root": server root, "txs": [tx_hash]}
+    fold_jobs = []                # [(future, [tx_hash...])]
+    buf, buf_ids = [], []
+    procs = ProcessPoolExecutor(max_workers=args.procs) if args.procs > 1 else None
+
+    def flush_folds():
+        if not buf:
+            return
+        items, ids = list(buf), list(buf_ids)
+        buf.clear(); buf_ids.clear()
+        fut = procs.submit(fold_chunk, items) if procs else None
+        fold_jobs.append((fut if fut else fold_chunk(items), ids))
+
+    fetched = 0
+    for th, p, err in fetch_proofs(api, hashes, args.workers, args.timeout):
+        fetched += 1
+        if err:
+            failures.append({"tx_hash": th, "reason": err})
+            continue
+        buf.append((th, p["proof"], p["merkle_root"]))
+        buf_ids.append(th)
+        if len(buf) >= FOLD_CHUNK:
+            flush_folds()
+        key = (p.get("contract_address"), p.get("onchain_block_id"))
+        grp = by_block.setdefault(key, {"root": (p["merkle_root"] or "").lower(), "block_id": p.get("block_id"), "txs": []})
+        grp["txs"].append(th)
+        if fetched % 10000 == 0:
+            print(f"  fetched {fetched}/{len(hashes)}", file=sys.stderr)
+    flush_folds()
+    t_fetch = time.perf_counter() - t0
+
+    local_ok = set()
+    for res, ids in fold_jobs:
+        oks = res.result() if procs else res
+        for th, ok in zip(ids, oks):
+            if ok:
+                local_ok.add(th)
+            else:
+                failures.append({"tx_hash": th, "reason": "local_mismatch"})
+    if procs:
+        procs.shutdown()
+    t_fold = time.perf_counter() - t0 - t_fetch
+
+    # one on-chain read per distinct anchored block
+    chain_root = {}
+    anchored = {k: g for k, g in by_block.items() if k[0] and k[1]}
+    if anchored and not args.no_chain:
+        read_root = roots_reader(args.rpc)
+        with ThreadPoolExecutor(max_workers=min(args.workers, 16)) as ex:
+            futs = {ex.submit(read_root, k[0], k[1]): k for k in anchored}
+            for fut in as_completed(futs):
+                try:
+                    chain_root[futs[fut]] = fut.result()
+                except Exception as e:
+                    chain_root[futs[fut]] = f"error: {e}"
+    t_chain = time.perf_counter() - t0 - t_fetch - t_fold
+
+    verified = 0
+    for key, grp in by_block.items():
+        onchain = chain_root.get(key)
+        for th in grp["txs"]:
+            if th not in local_ok:
+                continue
+            if args.no_chain:
+                reason = None
+            elif not (key[0] and key[1]):
+                reason = "block_not_anchored"
+            elif onchain is None or onchain.startswith("error"):
+                reason = "chain_read_error"
+            elif onchain == ZERO_ROOT:
+                reason = "root_not_on_chain"
+            elif onchain != grp["root"]:
+                reason = "chain_mismatch"
+            else:
+                reason = None
+            if reason:
+                failures.append({"tx_hash": th, "reason": reason, "block_id": grp["block_id"],
+                                 "onchain_block_id": key[1], "onchain_root": onchain, "server_root": grp["root"]})
+            else:
+                verified += 1
+
+    elapsed = time.perf_counter() - t0
+    summary = {
+        "api": api, "total": len(hashes), "verified": verified, "failed": len(hashes) - verified,
+        "failures_by_reason": dict(Counter(f["reason"].split(":")[0] for f in failures)),
+        "blocks": len(by_block), "chain_reads": len(chain_root), "chain_checked": not args.no_chain,
+        "timing_s": {"fetch": round(t_fetch, 3), "fold": round(t_fold, 3), "chain": round(t_chain, 3),
+                     "total": round(elapsed, 3)},
+        "tx_per_s": round(len(hashes) / elapsed, 1) if elapsed else None,
+    }
+    with open(args.report, "w") as f:
+        json.dump({"summary": summary, "failures": failures}, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    print("report:", args.report)
+    return 0 if verified == len(hashes) else 2
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("usage: python verify_tx.py <api_base> <tx_hash>")
-        sys.exit(1)
-    main()
+    if len(sys.argv) == 3 and not sys.argv[2].startswith("-"):
+        main()
+        sys.exit(0)
+    ap = argparse.ArgumentParser(description="Verify ledger tx inclusion proofs (single or batch)")
+    ap.add_argument("api", help="API base, e.g. http://127.0.0.1:5000/api/v1")
+    ap.add_argument("--file", required=True, help="tx hashes, one per line")
+    ap.add_argument("--workers", type=int, default=32, help="concurrent proof fetches")
+    ap.add_argument("--procs", type=int, default=os.cpu_count() or 1, help="processes folding proofs")
+    ap.add_argument("--rpc", default=os.getenv("WEB3_RPC_URL", DEFAULT_RPC))
+    ap.add_argument("--no-chain", action="store_true", help="skip on-chain root reads")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--report", default="verify_report.json")
+    sys.exit(batch(ap.parse_args()))
@@ -13,7 +13,7 @@ def derive_onchain_block_id(mongo_oid_str: str) -> int:
     # same rule as anchor_block.py (sha256 string -> uint256)
     return int(hashlib.sha256(mongo_oid_str.encode()).hexdigest(), 16) % (2**256)
 
-from web3.exceptions import TransactionNotFound
+import asyncio
 from time import sleep
 
 def _bump(fee):
@@ -76,3 +76,48 @@ def send_anchor_with_bump(w3, acct, contract, onchain_block_id, root_bytes, chai
             break
 
     raise last_exc if last_exc else RuntimeError("Failed to anchor after retries.")
+
+
+async def send_anchor_with_bump_async(w3, acct, contract, onchain_block_id, root_bytes, chain_id, attempts=3, wait_receipt=True, wait_timeout=90):
+    # AsyncWeb3 twin of send_anchor_with_bump (used by asgi.py); same fee/nonce retry rules
+    base = (await w3.eth.get_block("pending"))["baseFeePerGas"]
+    max_priority = w3.to_wei(2, "gwei")
+    max_fee      = base * 2 + max_priority
+    nonce = await w3.eth.get_transaction_count(acct.address, "pending")
+
+    last_exc = None
+    for i in range(attempts):
+        tx = await contract.functions.anchor(onchain_block_id, root_bytes).build_transaction({
+            "from": acct.address,
+            "nonce": nonce,
+            "gas": 200000,
+            "maxFeePerGas": max_fee,
+            "maxPriorityFeePerGas": max_priority,
+            "chainId": chain_id,
+        })
+        signed = w3.eth.account.sign_transaction(tx, acct.key)
+        try:
+            tx_hash = await w3.eth.send_raw_transaction(_signed_raw_bytes(signed))
+            txh_hex = tx_hash.hex() if hasattr(tx_hash, "hex") else str(tx_hash)
+            if wait_receipt:
+                await w3.eth.wait_for_transaction_receipt(tx_hash, timeout=wait_timeout)
+            return txh_hex
+        except ValueError as e:
+            msg = str(e)
+            last_exc = e
+            if "replacement transaction underpriced" in msg or "fee too low" in msg or "underpriced" in msg:
+                max_fee      = _bump(max_fee)
+                max_priority = _bump(max_priority)
+                await asyncio.sleep(2)
+                continue
+            elif "nonce too low" in msg:
+                nonce = await w3.eth.get_transaction_count(acct.address, "pending")
+                await asyncio.sleep(1)
+                continue
+            else:
+                break
+        except Exception as e:
+            last_exc = e
+            break
+
+    raise last_exc if last_exc else RuntimeError("Failed to anchor after retries.")